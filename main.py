@@ -1,14 +1,59 @@
+import argparse
+import asyncio
 import logging
 import os
 import shutil
 import signal
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
-from src.config.config_reader import get_channel_ids, load_config
-from src.core.history_manager import has_records_for_channel, init_db, is_downloaded, log_download, mark_downloaded
-from src.core.scheduler import run_loop, setup_schedule
-from src.downloader.channel_checker import get_videos
-from src.downloader.video_downloader import download_video
+from src.config.config_reader import get_channel_ids, get_option, load_config
+from src.core.history_manager import (
+    claim_jobs,
+    close_stores,
+    delete_job,
+    enqueue_jobs,
+    fail_job,
+    filter_new_video_ids,
+    filter_open_jobs,
+    flush_downloads,
+    delete_channel_resolution,
+    get_channel_resolution,
+    get_channel_watermark,
+    get_http_cache,
+    get_unavailable_videos,
+    has_open_jobs,
+    has_records_for_channel,
+    init_db,
+    is_downloaded,
+    load_downloaded_index,
+    mark_unavailable,
+    prune_http_cache,
+    prune_jobs,
+    prune_unavailable,
+    record_download,
+    requeue_running_jobs,
+    set_channel_resolution,
+    set_channel_watermark,
+    set_http_cache,
+)
+from src.core.cluster import heartbeat, node_id
+from src.core.scheduler import print_timetable, run_loop, setup_schedule
+from src.downloader.channel_checker import feed_url, fetch_feed, fetch_video_metadata, get_videos, resolve_channel
+from src.downloader.engine import terminate_processes
+from src.downloader.rate_limiter import UNAVAILABLE_TTL_SEC, cancel_requests
+from src.downloader.video_downloader import (
+    INFO_JSON_MAX_AGE_SEC,
+    download_video,
+    download_videos,
+    gc_staging,
+    recover_staging,
+    stage_video,
+    transfer_video,
+)
 
 # 设置日志
 if not os.path.exists("logs"):
@@ -16,7 +61,7 @@ if not os.path.exists("logs"):
 
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
+    format="%(asctime)s - %(levelname)s - [%(threadName)s] %(message)s",
     handlers=[
         logging.FileHandler("logs/app.log", encoding="utf-8"),
         logging.StreamHandler(sys.stdout),
@@ -24,64 +69,533 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 扫描阶段保存的info JSON目录（位于temp下，随临时目录清理）
+INFO_DIR = os.path.join("temp", "info")
 
-def check_and_download(config):
+
+class FeedCacheStats:
     """
-    检查并下载新视频的核心函数。
+    本轮订阅源HTTP缓存的命中/未命中计数（扫描线程并发更新）。
     """
-    temp_dir = "temp"
-    os.makedirs(temp_dir, exist_ok=True)
-    
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+
+def filter_pending_video_ids(video_ids: List[str]) -> List[str]:
+    """
+    返回video_ids中待下载的ID：尚未下载，且不在未过期的不可用负缓存中（保持原顺序）。
+    """
+    new_ids = filter_new_video_ids(video_ids)
+    unavailable = get_unavailable_videos(new_ids) if new_ids else {}
+    return [video_id for video_id in new_ids if video_id not in unavailable]
+
+
+def record_unavailable(video_id: str, channel_id: str, reason: str) -> None:
+    """
+    把不可用的视频写入负缓存，在该原因的UNAVAILABLE_TTL_SEC期内不再尝试。
+    """
+    mark_unavailable(video_id, channel_id, reason, UNAVAILABLE_TTL_SEC[reason])
+    logger.info(f"视频 {video_id} 不可用（{reason}），暂不再尝试")
+
+
+def scan_channel(channel_id: str, config: dict, feed_stats: Optional[FeedCacheStats] = None):
+    """
+    扫描单个频道：判断是否首次运行，并拉取最近视频元数据。
+    handle解析为UC ID的结果缓存在数据库中（过期或按ID访问失败时重新解析），
+    解析后按UC ID访问频道，并以UC ID判断首次运行（频道改名不会重新回填）。
+    非首次运行且已知频道UC ID时先条件请求上传订阅源：304或视频ID列表与缓存一致时直接结束
+    （不排重、不扫描）；订阅源中没有待下载视频（未下载、不在不可用负缓存中且没有未完成的下载任务）时
+    更新缓存并跳过yt-dlp扫描；已有任务的视频由任务队列负责重试，不因它们回退到扫描。
+    缓存只在确认无新视频时写入（包括回退扫描后没有新视频），因此"未变化"总是意味着没有待下载的视频；
+    订阅源中有负缓存或被忽略的视频时不写验证信息，每轮重新判断。
+    订阅源包含Shorts和直播，/videos列表不包含；回退扫描后订阅源中不在列表里的视频记为ignored_ids，以后不再触发扫描。
+    读到水位线视频或已下载视频时提前停止列表读取；flat列举模式下再为新视频补全元数据。
+    启用reuse_info_json时新视频的完整info JSON保存到INFO_DIR，供下载阶段复用。
+    扫描中发现的不可用视频写入负缓存。
+    在扫描线程池中执行（阻塞调用），返回 (is_first, videos, known_video)，
+    known_video为停止处的已知视频（未提前停止时为None）。
+    """
+    logger.info(f"处理频道: {channel_id}")
+    resolution = get_channel_resolution(channel_id)
+    if resolution is None or resolution["stale"]:
+        resolved = resolve_channel(channel_id, config)
+        if resolved:
+            set_channel_resolution(channel_id, resolved["uc_id"], resolved["uploader"])
+            resolution = resolved
+    uc_id = resolution["uc_id"] if resolution else None
+    is_first = not has_records_for_channel(uc_id or channel_id)
+    watermark = get_channel_watermark(channel_id)
+    last_video_id = watermark["video_id"] if watermark else None
+    feed = None
+    if uc_id and not is_first and get_option(config, "feed_check"):
+        url = feed_url(uc_id)
+        cached = get_http_cache(url)
+        feed = fetch_feed(uc_id, config, cached)
+        if feed is not None:
+            if feed_stats is not None:
+                feed_stats.record(feed["unchanged"])
+            if feed["unchanged"]:
+                logger.info(f"频道 {channel_id} 订阅源未变化，跳过")
+                return is_first, [], watermark
+            feed_ids = [video["video_id"] for video in feed["videos"]]
+            # 上次扫描确认不在/videos列表中的视频（Shorts、直播）不当作待下载
+            ignored = [video_id for video_id in cached["ignored_ids"] if video_id in feed_ids] if cached else []
+            new_ids = filter_new_video_ids(feed_ids)
+            unavailable = get_unavailable_videos(new_ids) if new_ids else {}
+            feed_pending = [video_id for video_id in new_ids if video_id not in unavailable and video_id not in ignored]
+            if feed_pending:
+                queued = set(filter_open_jobs(feed_pending))
+                feed_pending = [video_id for video_id in feed_pending if video_id not in queued]
+            # 订阅源中有负缓存或被忽略的视频时（如等待首播的视频），它们的状态以后会变：
+            # 不写条件请求的验证信息，避免负缓存过期后订阅源"未变化"而跳过该频道
+            revalidate = bool(unavailable or ignored)
+            if not feed_pending:
+                if revalidate:
+                    set_http_cache(url, channel_id, None, None, None, ignored)
+                else:
+                    set_http_cache(url, channel_id, feed["etag"], feed["last_modified"], feed["body_hash"], ignored)
+                logger.info(f"频道 {channel_id} 订阅源无新视频，跳过yt-dlp扫描")
+                # 水位线只取已下载的视频，负缓存中的视频过期后仍会被列表扫描到
+                newest = next((video for video in feed["videos"] if video["video_id"] not in new_ids), None)
+                return is_first, [], newest or watermark
+
+    known = []
+
+    def stop_at(video):
+        if video["video_id"] == last_video_id or is_downloaded(video["video_id"]):
+            known.append(video)
+            return True
+        return False
+
+    info_dir = INFO_DIR if get_option(config, "reuse_info_json") else None
+    failures = {}
+    videos = get_videos(uc_id or channel_id, is_first, config, stop_at=stop_at, info_dir=info_dir, failures=failures)
+    listed = videos[0] if videos else known[0] if known else None
+    if feed is not None and known:
+        # 列表已读到已知视频（比它新的视频都已列出）：订阅源中待下载却不在列表中的视频是Shorts或直播，
+        # 记下后不再因它们每轮回退到yt-dlp扫描
+        listed_ids = {video["video_id"] for video in videos} | {known[0]["video_id"]}
+        ignored += [video_id for video_id in feed_pending if video_id not in listed_ids]
+        if revalidate or ignored or filter_pending_video_ids([video["video_id"] for video in videos]):
+            # 有新视频或需要重新判断的视频，不写条件请求缓存（"未变化"只表示没有待下载的视频）
+            set_http_cache(url, channel_id, None, None, None, ignored)
+        else:
+            set_http_cache(url, channel_id, feed["etag"], feed["last_modified"], feed["body_hash"], ignored)
+    if uc_id and listed is None:
+        # 按UC ID未取到任何视频，视为解析失效，下次按handle重新解析
+        logger.warning(f"频道 {channel_id} 按ID {uc_id} 未取到视频，清除解析缓存")
+        delete_channel_resolution(channel_id)
+    elif listed and listed.get("channel_uc_id") and listed["channel_uc_id"] != uc_id:
+        # 主页解析失败时从扫描结果中获得UC ID
+        set_channel_resolution(channel_id, listed["channel_uc_id"], listed.get("channel_name") or None)
+    if videos and get_option(config, "listing_mode") == "flat":
+        # 两阶段扫描：轻量列举后只为未下载的视频获取完整元数据
+        new_ids = filter_pending_video_ids([video["video_id"] for video in videos])
+        videos = fetch_video_metadata(new_ids, channel_id, config, info_dir=info_dir, failures=failures) if new_ids else []
+    for video_id, reason in failures.items():
+        record_unavailable(video_id, uc_id or channel_id, reason)
+    return is_first, videos, known[0] if known else None
+
+
+def enqueue_new_videos(channel_id: str, is_first: bool, videos: list, known_video: Optional[dict]) -> int:
+    """
+    对单个频道的扫描结果排重（跳过已下载和负缓存中不可用的视频），把新视频写入持久化任务队列。
+    已有任务的视频（其他频道本轮已发现，或等待重试中）不重复入队。
+    返回新入队的视频数。
+    """
+    if not videos:
+        if known_video:
+            logger.info(f"频道 {channel_id} 无新视频（最新视频已处理: {known_video['video_id']}）")
+        else:
+            logger.warning(f"频道 {channel_id} 无视频数据")
+        return 0
+
+    logger.info(f"从频道 {channel_id} 拉取 {len(videos)} 个视频")
+
+    new_ids = set(filter_pending_video_ids([video["video_id"] for video in videos]))
+
+    new_videos = []
+    for video in videos:
+        video_id = video["video_id"]
+        if video_id in new_ids:
+            logger.info(f"发现新视频: {video['title'][:50]}...")
+            new_videos.append(video)
+        else:
+            logger.debug(f"视频已下载: {video_id}")
+
+    if not new_videos:
+        logger.info(f"频道 {channel_id} 本批次无新视频下载")
+        return 0
+    return enqueue_jobs(channel_id, is_first, new_videos)
+
+
+def retry_later(video_id: str, error: str, config: dict) -> None:
+    """
+    记录下载任务失败：按退避安排重试，失败次数达到job_max_attempts时放弃。
+    """
+    max_attempts = get_option(config, "job_max_attempts")
+    if fail_job(video_id, error, max_attempts) == "dead":
+        logger.error(f"视频 {video_id} 已失败 {max_attempts} 次，放弃下载")
+
+
+def download_job(job: dict, config: dict) -> List[dict]:
+    """
+    执行单个下载任务（同一频道的一批视频）。多个视频时交给一次yt-dlp调用批量下载。
+    下载完成的文件留在暂存目录，返回传输任务列表；下载失败的视频在此记录logs
+    并按退避重试，其中不可用的视频写入负缓存并删除任务。
+    history/logs以视频所属频道的UC ID记录（未知时使用channels.txt中的频道名）。
+    """
+    videos = job["videos"]
+    channel_id = job["channel_id"]
+    is_first = job["is_first"]
+
+    for video in videos:
+        stage_video(video, video.get("channel_uc_id") or channel_id, is_first)
+
+    failures = {}
+    if len(videos) == 1:
+        video = videos[0]
+        results = {
+            video["video_id"]: download_video(
+                video["video_id"],
+                video["channel_name"],
+                video["upload_date"],
+                video["title"],
+                config,
+                info_json=video.get("info_json"),
+                transfer=False,
+                failures=failures,
+            )
+        }
+    else:
+        results = download_videos(videos, config, transfer=False, failures=failures)
+
+    transfers = []
+    for video in videos:
+        video_id = video["video_id"]
+        staged_path = results.get(video_id)
+        if staged_path:
+            transfers.append({"video": video, "staged_path": staged_path, "channel_id": channel_id, "is_first": is_first})
+        else:
+            record_download(video_id, video.get("channel_uc_id") or channel_id, "failed", None, str(is_first))
+            logger.error(f"下载失败: {video_id}")
+            if video_id in failures:
+                record_unavailable(video_id, video.get("channel_uc_id") or channel_id, failures[video_id])
+                delete_job(video_id)
+            else:
+                retry_later(video_id, "下载失败", config)
+    return transfers
+
+
+def transfer_job(job: dict, config: dict) -> bool:
+    """
+    把下载完成的视频从暂存目录传输到download_dir，传输并校验成功后才记录history/logs
+    （经写后缓冲批量提交，history、logs和任务完成在同一事务中）。
+    返回是否成功；失败时文件留在暂存目录，任务按退避重试（或下次启动时恢复）。
+    """
+    video = job["video"]
+    video_id = video["video_id"]
+    history_channel_id = video.get("channel_uc_id") or job["channel_id"]
     try:
-        channel_ids = get_channel_ids()
-        if not channel_ids:
-            logger.warning("没有找到频道ID，请检查channels.txt")
-            return
+        file_path = transfer_video(video, job["staged_path"], config)
+    except OSError as e:
+        record_download(video_id, history_channel_id, "failed", None, str(job["is_first"]))
+        logger.error(f"传输失败: {video_id}: {e}")
+        retry_later(video_id, f"传输失败: {e}", config)
+        return False
+    record_download(video_id, history_channel_id, "success", file_path, str(job["is_first"]))
+    logger.info(f"下载成功: {file_path}")
+    return True
 
-        logger.info(f"开始检查 {len(channel_ids)} 个频道的新视频")
 
-        for channel_id in channel_ids:
-            logger.info(f"处理频道: {channel_id}")
+class DownloadPipeline:
+    """
+    下载与传输流水线：config['download_workers']个下载任务从持久化任务队列（jobs表）领取到期任务，
+    同一频道的到期任务按config['download_batch_size']分批，每批一次yt-dlp调用，只下载到暂存目录；
+    完成的文件放入有界队列(download_queue_size)，由config['transfer_workers']个传输任务移动到download_dir，
+    下载与传输并行。阻塞调用在对应大小的线程池中执行，不占用事件循环；心跳在流水线运行期间续约本节点的租约。
+    serve中整个进程共用一个长期运行的流水线，调度器只等待频道扫描，不等待下载；
+    单轮检查（check_and_download）用drain()等待到期任务全部执行完。
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.download_executor = ThreadPoolExecutor(max_workers=get_option(config, "download_workers"), thread_name_prefix="download")
+        self.transfer_executor = ThreadPoolExecutor(max_workers=get_option(config, "transfer_workers"), thread_name_prefix="transfer")
+        self.transfers = asyncio.Queue(maxsize=get_option(config, "download_queue_size"))
+        self.job_signal = asyncio.Event()
+        self.draining = False
+        # 扫描得到、等待该频道任务全部完成后才写入的水位线
+        self.watermarks = {}
+        self.download_workers = []
+        self.transfer_workers = []
+        self.heartbeat_task = None
+
+    def start(self) -> None:
+        self.heartbeat_task = asyncio.create_task(heartbeat(self.config), name="heartbeat")
+        self.transfer_workers = [
+            asyncio.create_task(self._transfer_worker(), name=f"transfer-{i}")
+            for i in range(get_option(self.config, "transfer_workers"))
+        ]
+        self.download_workers = [
+            asyncio.create_task(self._download_worker(), name=f"download-{i}")
+            for i in range(get_option(self.config, "download_workers"))
+        ]
 
-            is_first = not has_records_for_channel(channel_id)
-            videos = get_videos(channel_id, is_first, config)
+    def notify(self) -> None:
+        """
+        唤醒等待中的下载任务（写入了新任务，或有任务到期重试）。
+        """
+        self.job_signal.set()
 
-            if not videos:
-                logger.warning(f"频道 {channel_id} 无视频数据")
+    async def _download_worker(self) -> None:
+        """
+        下载任务主循环：领取同一频道的到期任务，在下载线程池中执行，完成的文件放入传输队列。
+        没有到期任务时等待notify()；drain()后没有到期任务时退出。
+        """
+        loop = asyncio.get_running_loop()
+        batch_size = get_option(self.config, "download_batch_size")
+        owner, lease_sec = node_id(self.config), get_option(self.config, "lease_seconds")
+        while True:
+            self.job_signal.clear()
+            claimed = await loop.run_in_executor(self.download_executor, claim_jobs, owner, batch_size, lease_sec)
+            if not claimed:
+                if self.draining:
+                    return
+                await self.job_signal.wait()
                 continue
+            job = {
+                "videos": [item["video"] for item in claimed],
+                "channel_id": claimed[0]["channel_id"],
+                "is_first": claimed[0]["is_first"],
+            }
+            try:
+                for transfer in await loop.run_in_executor(self.download_executor, download_job, job, self.config):
+                    await self.transfers.put(transfer)
+            except Exception as e:
+                logger.error(f"下载任务错误: {e}", exc_info=True)
+                for video in job["videos"]:
+                    retry_later(video["video_id"], f"下载任务错误: {e}", self.config)
 
-            logger.info(f"从频道 {channel_id} 拉取 {len(videos)} 个视频")
+    async def _transfer_worker(self) -> None:
+        """
+        传输任务主循环：从传输队列取任务，在传输线程池中执行，取到None时退出。
+        下载线程不必等待到网络共享的复制完成。
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.transfers.get()
+            try:
+                if job is None:
+                    return
+                await loop.run_in_executor(self.transfer_executor, transfer_job, job, self.config)
+            except Exception as e:
+                logger.error(f"传输任务错误: {e}", exc_info=True)
+            finally:
+                self.transfers.task_done()
 
-            new_downloads = 0
-            for video in videos:
-                video_id = video["video_id"]
-                if not is_downloaded(video_id):
-                    logger.info(f"发现新视频: {video['title'][:50]}...")
+    async def drain(self) -> None:
+        """
+        执行完所有到期任务后停止下载和传输任务。
+        """
+        self.draining = True
+        self.notify()
+        await asyncio.gather(*self.download_workers)
+        for _ in self.transfer_workers:
+            await self.transfers.put(None)
+        await asyncio.gather(*self.transfer_workers)
 
-                    file_path = download_video(video_id, video["channel_name"], video["upload_date"], video["title"], config)
+    def close(self) -> None:
+        """
+        取消所有任务并关闭线程池（未完成的任务保留在jobs表中，重启后续做）。
+        """
+        for task in self.download_workers + self.transfer_workers + [self.heartbeat_task]:
+            if task is not None:
+                task.cancel()
+        for executor in (self.download_executor, self.transfer_executor):
+            executor.shutdown(wait=False, cancel_futures=True)
 
-                    if file_path:
-                        mark_downloaded(video_id, channel_id)
-                        log_download(video_id, channel_id, "success", file_path, str(is_first))
-                        logger.info(f"下载成功: {file_path}")
-                        new_downloads += 1
-                    else:
-                        log_download(video_id, channel_id, "failed", None, str(is_first))
-                        logger.error(f"下载失败: {video_id}")
-                else:
-                    logger.debug(f"视频已下载: {video_id}")
+    def hold_watermark(self, channel_id: str, newest: dict) -> None:
+        """
+        记下频道本次列表中最新的视频，待该频道的任务全部完成后写入水位线。
+        """
+        self.watermarks[channel_id] = newest
+
+    def advance_watermarks(self) -> None:
+        """
+        为没有未完成任务的频道写入水位线（先提交缓冲中的下载结果，任务状态才是最新的）。
+        等待重试的任务使水位线保持不动；放弃（dead）或不可用而删除的任务不再阻止，但水位线只推进到已下载的视频。
+        """
+        flush_downloads()
+        for channel_id, newest in list(self.watermarks.items()):
+            if not has_open_jobs(channel_id):
+                # 未下载的视频（如不可用而删除任务、等待首播）不作水位线，否则其负缓存过期后列表扫描在它处停止
+                if is_downloaded(newest["video_id"]):
+                    set_channel_watermark(channel_id, newest["video_id"], newest["upload_date"])
+                del self.watermarks[channel_id]
+
+
+async def check_channels(config: dict, channel_ids: Optional[list] = None, pipeline: Optional[DownloadPipeline] = None) -> None:
+    """
+    检查新视频的核心协程。channel_ids为本次到期的频道（由调度器给出），缺省时检查channels.txt中的全部频道；
+    为空列表时不扫描，只唤醒下载任务执行到期的任务（重试或上次中断的任务）。
+    每个频道的扫描（get_videos）是一个任务，由信号量限制为config['scan_workers']个并发，在扫描线程池中执行；
+    扫描结果排重后写入持久化任务队列（jobs表），交给下载流水线。失败的任务按各自的退避时间重试，不必等待频道重新扫描。
+    给出pipeline（serve中长期运行的流水线）时扫描结束即返回，不等待下载；否则新建流水线并等待到期任务全部执行完。
+    频道的水位线在其任务全部完成（或放弃）后推进到扫描时列表中最新的视频。
+    被取消时（停止信号）终止进行中的yt-dlp子进程，不推进水位线。
+    """
+    temp_dir = "temp"
+    os.makedirs(temp_dir, exist_ok=True)
+    own_pipeline = pipeline is None
+
+    try:
+        all_channel_ids = get_channel_ids()
+        if not all_channel_ids:
+            logger.warning("没有找到频道ID，请检查channels.txt")
+            return
+        if channel_ids is None:
+            channel_ids = all_channel_ids
+
+        if channel_ids:
+            logger.info(f"开始检查 {len(channel_ids)} 个频道的新视频")
+        else:
+            logger.info("执行到期的下载任务")
+        removed = prune_http_cache(all_channel_ids)
+        if removed:
+            logger.info(f"已清理 {removed} 条已移除频道的订阅源缓存")
+        expired = prune_unavailable()
+        if expired:
+            logger.info(f"已清理 {expired} 条过期的不可用视频记录")
+        prune_jobs()
+
+        loop = asyncio.get_running_loop()
+        scan_workers = max(min(get_option(config, "scan_workers"), len(channel_ids)), 1)
+        scan_semaphore = asyncio.Semaphore(scan_workers)
+        scan_executor = ThreadPoolExecutor(max_workers=scan_workers, thread_name_prefix="scan")
+        if own_pipeline:
+            pipeline = DownloadPipeline(config)
+            pipeline.start()
+        enqueued = 0
+        feed_stats = FeedCacheStats()
+
+        async def scan(channel_id):
+            async with scan_semaphore:
+                return await loop.run_in_executor(scan_executor, scan_channel, channel_id, config, feed_stats)
 
-            if new_downloads == 0:
-                logger.info(f"频道 {channel_id} 本批次无新视频下载")
+        scans = {asyncio.create_task(scan(channel_id), name=f"scan-{channel_id}"): channel_id for channel_id in channel_ids}
+        try:
+            pending = set(scans)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    channel_id = scans[task]
+                    try:
+                        is_first, videos, known_video = task.result()
+                    except Exception as e:
+                        logger.error(f"扫描频道 {channel_id} 错误: {e}", exc_info=True)
+                        continue
+                    added = enqueue_new_videos(channel_id, is_first, videos, known_video)
+                    if added:
+                        enqueued += added
+                        pipeline.notify()
+                    newest = videos[0] if videos else known_video
+                    if newest:
+                        pipeline.hold_watermark(channel_id, newest)
+            if channel_ids:
+                logger.info(f"扫描完成，共 {enqueued} 个新视频待下载")
+                logger.info(f"订阅源缓存: 命中 {feed_stats.hits}，未命中 {feed_stats.misses}")
+            pipeline.notify()
+            if own_pipeline:
+                # 下载任务执行完所有到期任务后退出
+                await pipeline.drain()
+        except asyncio.CancelledError:
+            cancel_requests()
+            killed = terminate_processes()
+            logger.info(f"检查已取消，终止 {killed} 个yt-dlp进程")
+            raise
+        finally:
+            for task in scans:
+                task.cancel()
+            scan_executor.shutdown(wait=False, cancel_futures=True)
+            if own_pipeline:
+                pipeline.close()
 
+        pipeline.advance_watermarks()
         logger.info("检查循环完成")
     except Exception as e:
         logger.error(f"检查循环错误: {e}", exc_info=True)
     finally:
-        # 清理临时目录
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-            logger.info("临时目录已清理")
+        # 提交缓冲中的下载结果，调度器随后按logs重新排期
+        try:
+            flush_downloads()
+        except Exception as e:
+            logger.error(f"写入下载记录失败: {e}", exc_info=True)
+        if own_pipeline:
+            # 清理临时目录（未完成的下载保留在暂存目录中，下次续传）
+            if os.path.exists(temp_dir):
+                shutil.rmtree(temp_dir)
+                logger.info("临时目录已清理")
+        else:
+            # 长期运行的流水线仍可能使用之前保存的info JSON，只删除已过期不再复用的
+            clean_info_dir()
+        clean_staging(config)
+
+
+def clean_info_dir() -> None:
+    """
+    删除INFO_DIR中超过INFO_JSON_MAX_AGE_SEC的info JSON（下载时已不再复用）。
+    """
+    if not os.path.isdir(INFO_DIR):
+        return
+    now = time.time()
+    for entry in os.scandir(INFO_DIR):
+        if entry.is_file() and now - entry.stat().st_mtime > INFO_JSON_MAX_AGE_SEC:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def clean_staging(config: dict) -> None:
+    """
+    删除超过staging_max_age_hours未更新的暂存下载。
+    """
+    removed = gc_staging(get_option(config, "staging_max_age_hours") * 3600)
+    if removed:
+        logger.info(f"已清理 {removed} 个过期的未完成下载")
+
+
+def recover_staged_downloads(config: dict) -> None:
+    """
+    启动时恢复上次运行中已下载完成但未移到download_dir的视频，并补记history/logs；
+    其余中断的下载任务放回任务队列，下一轮从暂存目录续传（集群模式下只放回本节点的任务，
+    其他节点的任务在租约过期后由任一节点接管）。
+    """
+    for meta in recover_staging(config):
+        record_download(meta["video_id"], meta["channel_id"], "success", meta["file_path"], str(meta["is_first"]))
+    flush_downloads()
+    clean_staging(config)
+    requeued = requeue_running_jobs(node_id(config) if get_option(config, "cluster_mode") else None)
+    if requeued:
+        logger.info(f"恢复 {requeued} 个上次中断的下载任务")
+
+
+def check_and_download(config, channel_ids: Optional[list] = None):
+    """
+    在新的事件循环中执行一轮check_channels（供不在事件循环中的调用方使用）。
+    """
+    asyncio.run(check_channels(config, channel_ids))
 
 
 def signal_handler(sig, frame):
@@ -89,7 +603,43 @@ def signal_handler(sig, frame):
     sys.exit(0)
 
 
-def main():
+async def serve(config: dict) -> None:
+    """
+    在事件循环中运行按频道自适应的调度器和长期运行的下载流水线。SIGINT/SIGTERM取消调度任务：
+    进行中的检查被中断、yt-dlp子进程被终止后正常返回（不支持的平台沿用signal_handler）。
+    """
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, task.cancel)
+        except NotImplementedError:
+            pass
+
+    # 下载流水线在整个运行期间持续执行任务，调度器只等待频道扫描
+    pipeline = DownloadPipeline(config)
+    pipeline.start()
+
+    # 设置按频道自适应的定时任务：到期的频道（首次启动时为全部频道）立即检查
+    async def wrapper(channel_ids):
+        await check_channels(config, channel_ids, pipeline)
+    scheduler = setup_schedule(wrapper, config)
+
+    try:
+        await run_loop(scheduler)
+    except asyncio.CancelledError:
+        logger.info("接收到停止信号，优雅关闭...")
+    finally:
+        pipeline.close()
+        cancel_requests()
+        terminate_processes()
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="YouTube订阅视频下载器")
+    parser.add_argument("--dry-run", action="store_true", help="只打印channels.txt中各频道的检查时间表，不执行检查")
+    args = parser.parse_args(argv or [])
+
     # 注册信号处理
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
@@ -97,26 +647,35 @@ def main():
     # 加载配置
     config = load_config()
 
-    # 初始化
-    init_db()
-    logger.info("YouTube订阅视频下载器启动")
-
-    # 立即执行一次检查
-    check_and_download(config)
+    # 初始化：集群模式下数据库位于多台主机共享的文件系统上，不能使用WAL
+    init_db(journal_mode="DELETE" if get_option(config, "cluster_mode") else "WAL")
+    if args.dry_run:
+        print_timetable(config)
+        close_stores()
+        return
 
-    # 设置定时任务
-    def wrapper():
-        check_and_download(config)
-    setup_schedule(wrapper, config)
+    if get_option(config, "cluster_mode"):
+        # 其他节点的下载不会进入本进程的内存索引，集群模式下排重直接查询共享数据库
+        logger.info(f"集群模式，节点ID: {node_id(config)}")
+    else:
+        index = load_downloaded_index(get_option(config, "index_error_rate"))
+        logger.info(
+            f"已加载下载索引: {len(index)} 个视频ID，容量 {index.capacity}，"
+            f"占用内存 {index.memory_bytes / 1024:.1f} KB，误判率 {index.error_rate}"
+        )
+    logger.info("YouTube订阅视频下载器启动")
+    recover_staged_downloads(config)
 
     # 运行循环
     try:
-        run_loop()
+        asyncio.run(serve(config))
     except KeyboardInterrupt:
         logger.info("脚本停止")
     except Exception as e:
         logger.error(f"运行错误: {e}", exc_info=True)
+    finally:
+        close_stores()
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])
@@ -1,11 +1,61 @@
 import logging
 import os
+import re
 import sys
 
 import tomlkit
 
 logger = logging.getLogger(__name__)
 
+# 可选参数及默认值：缺省时使用默认值，不要求写入config.toml
+OPTIONAL_DEFAULTS = {
+    "scan_workers": 4,
+    "download_workers": 2,
+    "download_queue_size": 20,
+    "download_batch_size": 1,
+    "index_error_rate": 0.001,
+    "listing_mode": "flat",
+    "engine": "subprocess",
+    "reuse_info_json": True,
+    "feed_check": True,
+    "poll_min_interval_min": 60,
+    "poll_max_interval_min": 10080,
+    # None：错开窗口取interval_min，首批检查分布在整个轮询间隔内
+    "stagger_window_min": None,
+    "scan_jitter": 0.1,
+    "staging_max_age_hours": 72,
+    "transfer_workers": 1,
+    "transfer_checksum": False,
+    "max_bandwidth_mbps": 0,
+    "bandwidth_profiles": [],
+    "request_rate_per_min": 60,
+    "request_burst": 10,
+    "job_max_attempts": 8,
+    "cluster_mode": False,
+    "node_id": "",
+    "lease_seconds": 300,
+}
+
+
+def _valid_bandwidth_profile(profile) -> bool:
+    """
+    检查带宽时段配置：start/end为HH:MM，max_bandwidth_mbps为非负数。
+    """
+    if not isinstance(profile, dict):
+        return False
+    for key in ("start", "end"):
+        if not isinstance(profile.get(key), str) or not re.fullmatch(r"([01]\d|2[0-3]):[0-5]\d", profile[key]):
+            return False
+    rate = profile.get("max_bandwidth_mbps")
+    return not isinstance(rate, bool) and isinstance(rate, (int, float)) and rate >= 0
+
+
+def get_option(config: dict, key: str):
+    """
+    读取可选配置参数，config中缺省时返回OPTIONAL_DEFAULTS中的默认值。
+    """
+    return config.get(key, OPTIONAL_DEFAULTS[key])
+
 
 def get_channel_ids(file_path: str = "channels.txt") -> list[str]:
     """
@@ -87,14 +137,42 @@ def load_config(file_path: str = "config.toml") -> dict:
 
         # 类型验证（简单检查）
         for key, value in config.items():
-            if key in ["query_limit", "first_run_limit", "interval_min", "max_retries"]:
+            if key in ["query_limit", "first_run_limit", "interval_min", "max_retries", "scan_workers", "download_workers", "download_queue_size", "download_batch_size", "poll_min_interval_min", "poll_max_interval_min", "stagger_window_min", "staging_max_age_hours", "transfer_workers", "request_rate_per_min", "request_burst", "job_max_attempts", "lease_seconds"]:
                 if not isinstance(value, int) or value <= 0:
                     logger.error(f"{key} 必须是正整数，当前值: {value}")
                     sys.exit(1)
-            elif key in ["download_format", "proxy", "download_dir"]:
+            elif key in ["scan_jitter"]:
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 <= value < 1:
+                    logger.error(f"{key} 必须是0到1之间的小数（可为0），当前值: {value}")
+                    sys.exit(1)
+            elif key in ["max_bandwidth_mbps"]:
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                    logger.error(f"{key} 必须是非负数（0表示不限速），当前值: {value}")
+                    sys.exit(1)
+            elif key == "bandwidth_profiles":
+                if not isinstance(value, list) or not all(_valid_bandwidth_profile(profile) for profile in value):
+                    logger.error(f"{key} 必须是时段列表，每项形如 {{start = \"09:00\", end = \"18:00\", max_bandwidth_mbps = 20}}，当前值: {value}")
+                    sys.exit(1)
+            elif key in ["index_error_rate"]:
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 < value < 1:
+                    logger.error(f"{key} 必须是0到1之间的小数，当前值: {value}")
+                    sys.exit(1)
+            elif key in ["download_format", "proxy", "download_dir", "node_id"]:
                 if not isinstance(value, str):
                     logger.error(f"{key} 必须是字符串，当前值: {value}")
                     sys.exit(1)
+            elif key in ["reuse_info_json", "feed_check", "transfer_checksum", "cluster_mode"]:
+                if not isinstance(value, bool):
+                    logger.error(f"{key} 必须是布尔值 (true/false)，当前值: {value}")
+                    sys.exit(1)
+            elif key == "listing_mode":
+                if value not in ["flat", "full"]:
+                    logger.error(f"{key} 必须是 'flat' 或 'full'，当前值: {value}")
+                    sys.exit(1)
+            elif key == "engine":
+                if value not in ["subprocess", "inprocess"]:
+                    logger.error(f"{key} 必须是 'subprocess' 或 'inprocess'，当前值: {value}")
+                    sys.exit(1)
 
         return dict(config)  # 转换为普通dict
     except Exception as e:
@@ -0,0 +1,37 @@
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+
+from src.config.config_reader import get_option
+from src.core.history_manager import renew_leases
+
+logger = logging.getLogger(__name__)
+
+# 心跳间隔为租约时长的1/HEARTBEAT_FRACTION，偶尔一次心跳失败不会使租约过期
+HEARTBEAT_FRACTION = 3
+# 未配置node_id时的节点标识（主机名-进程号）
+DEFAULT_NODE_ID = f"{socket.gethostname()}-{os.getpid()}"
+
+
+def node_id(config: dict) -> str:
+    """
+    本节点领取频道和下载任务时使用的租约持有者标识。
+    """
+    return get_option(config, "node_id") or DEFAULT_NODE_ID
+
+
+async def heartbeat(config: dict) -> None:
+    """
+    定期续约本节点持有的下载任务和频道租约，直到被取消。
+    节点崩溃或失联后租约在lease_seconds内过期，由其他节点（或重启后的本节点）接管。
+    """
+    owner = node_id(config)
+    lease_sec = get_option(config, "lease_seconds")
+    while True:
+        await asyncio.sleep(lease_sec / HEARTBEAT_FRACTION)
+        try:
+            await asyncio.to_thread(renew_leases, owner, lease_sec)
+        except sqlite3.Error as e:
+            logger.warning(f"租约续约失败: {e}")
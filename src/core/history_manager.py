@@ -1,81 +1,1149 @@
+import json
+import logging
+import queue
 import sqlite3
-from typing import Optional
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.core.video_index import DownloadedIndex
+
+logger = logging.getLogger(__name__)
 
 DB_PATH = "download_history.db"
+DB_POOL_SIZE = 8
+# 单条语句的参数个数上限（低于旧版SQLite默认的SQLITE_MAX_VARIABLE_NUMBER=999）
+MAX_SQL_VARIABLES = 900
+# 内存索引的最小容量，以及按现有记录数预留的增长倍数
+INDEX_MIN_CAPACITY = 100_000
+INDEX_GROWTH = 2
+# 频道解析结果（handle到UC ID）的有效期，过期后重新解析
+RESOLUTION_TTL_DAYS = 30
+# 估计频道上传节奏时使用的最近上传记录数
+UPLOAD_HISTORY_LIMIT = 10
+
+# 下载任务的默认租约时长，租约过期的running任务可被重新领取（进行中的任务由心跳续约）
+JOB_LEASE_SEC = 300
+# 下载任务失败后的重试退避：首次JOB_RETRY_BASE_SEC，每次失败加倍，最长JOB_RETRY_MAX_SEC
+JOB_RETRY_BASE_SEC = 300
+JOB_RETRY_MAX_SEC = 6 * 3600
+# 已完成任务的保留天数
+JOB_RETENTION_DAYS = 7
+
+# 下载结果的写后缓冲：攒满WRITE_BATCH_SIZE条，或最早一条已等待WRITE_FLUSH_SEC秒时一次事务写入
+WRITE_BATCH_SIZE = 50
+WRITE_FLUSH_SEC = 2.0
+
+# 日志模式：单机默认WAL，允许读写并发，synchronous=NORMAL在WAL下只在checkpoint时fsync。
+# WAL依赖共享内存，数据库位于网络文件系统上被多台主机共享时（集群模式）改用回滚日志DELETE，
+# 此时synchronous=FULL且不使用mmap
+JOURNAL_MODE = "WAL"
+# 每个连接建立后执行的其余调优参数
+PRAGMAS = (
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+)
+WAL_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=67108864",
+)
+ROLLBACK_PRAGMAS = (
+    "PRAGMA synchronous=FULL",
+)
+
+
+class HistoryWriter:
+    """
+    下载结果的写后缓冲，替代每个视频mark_downloaded + log_download各自连接、各自提交。
+    record()只把结果放入缓冲，不在下载线程的关键路径上写数据库；后台线程在攒满batch_size条
+    或最早一条等待flush_sec秒后把整批写入一个事务。同一视频的history、logs和任务完成在同一事务中提交，
+    history与logs不会不一致。flush()立即写入（每轮检查结束和关闭时调用）。
+    """
+
+    def __init__(self, store: "HistoryStore", batch_size: int = WRITE_BATCH_SIZE, flush_sec: float = WRITE_FLUSH_SEC):
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_sec = flush_sec
+        self._pending: List[Tuple] = []
+        self._oldest: Optional[float] = None
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def record(self, entry: Tuple) -> None:
+        """
+        缓冲一条下载结果 (video_id, channel_id, status, file_path, is_first_for_channel)。
+        """
+        with self._cond:
+            self._pending.append(entry)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+                self._thread.start()
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def flush(self) -> int:
+        """
+        把缓冲中的结果写入一个事务，返回写入的条数。写入失败时结果放回缓冲并抛出异常。
+        """
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending, self._oldest = self._pending, [], None
+            if not batch:
+                return 0
+            try:
+                self.store.write_downloads(batch)
+            except sqlite3.Error:
+                with self._cond:
+                    self._pending[:0] = batch
+                    self._oldest = time.monotonic()
+                raise
+            return len(batch)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if not self._pending:
+                        self._cond.wait()
+                        continue
+                    remaining = self._oldest + self.flush_sec - time.monotonic()
+                    if len(self._pending) >= self.batch_size or remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.error(f"写入下载记录失败，稍后重试: {e}")
+                time.sleep(self.flush_sec)
+
+    def close(self) -> None:
+        """
+        停止后台线程并写入剩余结果。
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
 
 
-def init_db(db_path: str = DB_PATH) -> None:
+class HistoryStore:
+    """
+    下载历史存储，持有长连接池，替代每次调用单独connect/close。
+    连接池线程安全，最多pool_size个连接，供并发扫描/下载线程共享。
+    """
+
+    def __init__(self, db_path: str = DB_PATH, pool_size: int = DB_POOL_SIZE, journal_mode: str = JOURNAL_MODE):
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.journal_mode = journal_mode.upper()
+        self._idle = queue.LifoQueue()
+        self._connections = []
+        self._lock = threading.Lock()
+        self.index: Optional[DownloadedIndex] = None
+        self.writer = HistoryWriter(self)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        for pragma in PRAGMAS + (WAL_PRAGMAS if self.journal_mode == "WAL" else ROLLBACK_PRAGMAS):
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        从连接池借出一个连接，用完归还；池满时等待其他线程归还。
+        """
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                conn = None
+                if len(self._connections) < self.pool_size:
+                    conn = self._connect()
+                    self._connections.append(conn)
+            if conn is None:
+                conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self) -> None:
+        """
+        写入缓冲中的下载结果后关闭连接池中的所有连接。
+        """
+        self.writer.close()
+        self.writer = HistoryWriter(self)
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+            self._idle = queue.LifoQueue()
+
+    def init_schema(self) -> None:
+        """
+        创建表和索引如果不存在。
+        """
+        with self.connection() as conn, conn:
+            # 创建history表
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS history (
+                    video_id TEXT PRIMARY KEY,
+                    channel_id TEXT NOT NULL
+                )
+            """)
+
+            # 创建索引
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_channel ON history(channel_id)")
+
+            # 创建logs表
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS logs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    video_id TEXT NOT NULL,
+                    channel_id TEXT NOT NULL,
+                    download_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    status TEXT NOT NULL,
+                    file_path TEXT,
+                    is_first_for_channel TEXT DEFAULT 'false'
+                )
+            """)
+
+            # 创建logs索引
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_channel_log ON logs(channel_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_time ON logs(download_time)")
+
+            # 创建channel_state表（每频道水位线：上次扫描到的最新视频）
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS channel_state (
+                    channel_id TEXT PRIMARY KEY,
+                    last_video_id TEXT NOT NULL,
+                    last_upload_date TEXT,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # 创建channel_resolution表（频道handle到UC开头频道ID/频道名的解析缓存）
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS channel_resolution (
+                    channel_id TEXT PRIMARY KEY,
+                    uc_id TEXT NOT NULL,
+                    uploader TEXT,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            # 旧版channel_resolution表只有uc_id列，补齐uploader列
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(channel_resolution)")}
+            if "uploader" not in columns:
+                conn.execute("ALTER TABLE channel_resolution ADD COLUMN uploader TEXT")
+
+            # 创建poll_schedule表（每频道的下次轮询时间，重启后继续按此调度）
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS poll_schedule (
+                    channel_id TEXT PRIMARY KEY,
+                    next_poll_at REAL NOT NULL,
+                    interval_sec REAL NOT NULL,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # 创建http_cache表（按URL缓存订阅源的ETag/Last-Modified和内容哈希，用于条件请求）
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS http_cache (
+                    url TEXT PRIMARY KEY,
+                    channel_id TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    body_hash TEXT,
+                    ignored_ids TEXT,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            # 旧版http_cache表没有ignored_ids列
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(http_cache)")}
+            if "ignored_ids" not in columns:
+                conn.execute("ALTER TABLE http_cache ADD COLUMN ignored_ids TEXT")
+
+            # 创建unavailable_videos表（视频不可用的负缓存，expires_at为NULL表示永久）
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS unavailable_videos (
+                    video_id TEXT PRIMARY KEY,
+                    channel_id TEXT NOT NULL,
+                    reason TEXT NOT NULL,
+                    expires_at REAL,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # 创建jobs表（持久化的下载任务队列：发现阶段写入，下载线程按租约领取，重启后继续）
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    video_id TEXT PRIMARY KEY,
+                    channel_id TEXT NOT NULL,
+                    is_first INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    state TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    lease_owner TEXT,
+                    lease_until REAL,
+                    last_error TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs(state, next_attempt_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_channel ON jobs(channel_id, state)")
+
+            # 创建channel_leases表（集群模式下正在检查频道的节点及租约）
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS channel_leases (
+                    channel_id TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    lease_until REAL NOT NULL
+                )
+            """)
+
+    def load_index(self, error_rate: float = 0.001) -> DownloadedIndex:
+        """
+        把history表中所有video_id一次性加载到内存索引。
+        加载后is_downloaded/filter_new_video_ids只对索引命中的ID回查SQLite。
+        """
+        with self.connection() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+            index = DownloadedIndex(max(count * INDEX_GROWTH, INDEX_MIN_CAPACITY), error_rate)
+            for (video_id,) in conn.execute("SELECT video_id FROM history"):
+                index.add(video_id)
+        self.index = index
+        return index
+
+    def has_records_for_channel(self, channel_id: str) -> bool:
+        with self.connection() as conn:
+            row = conn.execute("SELECT 1 FROM history WHERE channel_id = ? LIMIT 1", (channel_id,)).fetchone()
+        return row is not None
+
+    def is_downloaded(self, video_id: str) -> bool:
+        if self.index is not None and video_id not in self.index:
+            return False
+        with self.connection() as conn:
+            row = conn.execute("SELECT 1 FROM history WHERE video_id = ?", (video_id,)).fetchone()
+        return row is not None
+
+    def filter_new_video_ids(self, video_ids: Iterable[str]) -> List[str]:
+        """
+        批量排重：返回video_ids中尚未下载的ID（保持原顺序并去重），按参数上限分块查询。
+        """
+        video_ids = list(dict.fromkeys(video_ids))
+        # 有内存索引时只回查索引命中的ID（已下载或误判）
+        candidates = video_ids if self.index is None else [video_id for video_id in video_ids if video_id in self.index]
+        if not candidates:
+            return video_ids
+        known = set()
+        with self.connection() as conn:
+            for start in range(0, len(candidates), MAX_SQL_VARIABLES):
+                chunk = candidates[start : start + MAX_SQL_VARIABLES]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(f"SELECT video_id FROM history WHERE video_id IN ({placeholders})", chunk)
+                known.update(row[0] for row in rows)
+        return [video_id for video_id in video_ids if video_id not in known]
+
+    def mark_downloaded(self, video_id: str, channel_id: str) -> None:
+        with self.connection() as conn, conn:
+            conn.execute("INSERT OR IGNORE INTO history (video_id, channel_id) VALUES (?, ?)", (video_id, channel_id))
+        self._index_add(video_id)
+
+    def _index_add(self, video_id: str) -> None:
+        index = self.index
+        if index is None:
+            return
+        index.add(video_id)
+        if index.is_full:
+            self.load_index(index.error_rate)
+
+    def get_channel_watermark(self, channel_id: str) -> Optional[Dict[str, str]]:
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT last_video_id, last_upload_date FROM channel_state WHERE channel_id = ?", (channel_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"video_id": row[0], "upload_date": row[1]}
+
+    def set_channel_watermark(self, channel_id: str, video_id: str, upload_date: str) -> None:
+        with self.connection() as conn, conn:
+            conn.execute(
+                """
+                INSERT INTO channel_state (channel_id, last_video_id, last_upload_date, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(channel_id) DO UPDATE SET
+                    last_video_id = excluded.last_video_id,
+                    last_upload_date = excluded.last_upload_date,
+                    updated_at = excluded.updated_at
+            """,
+                (channel_id, video_id, upload_date),
+            )
+
+    def get_channel_resolution(self, channel_id: str) -> Optional[Dict]:
+        with self.connection() as conn:
+            row = conn.execute(
+                """
+                SELECT uc_id, uploader, updated_at <= datetime('now', ?)
+                FROM channel_resolution WHERE channel_id = ?
+            """,
+                (f"-{RESOLUTION_TTL_DAYS} days", channel_id),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"uc_id": row[0], "uploader": row[1], "stale": bool(row[2])}
+
+    def set_channel_resolution(self, channel_id: str, uc_id: str, uploader: Optional[str] = None) -> None:
+        """
+        保存频道解析结果，并把以handle记录的history/logs迁移到UC ID下（同一事务）。
+        """
+        with self.connection() as conn, conn:
+            conn.execute(
+                """
+                INSERT INTO channel_resolution (channel_id, uc_id, uploader, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(channel_id) DO UPDATE SET
+                    uc_id = excluded.uc_id,
+                    uploader = COALESCE(excluded.uploader, channel_resolution.uploader),
+                    updated_at = excluded.updated_at
+            """,
+                (channel_id, uc_id, uploader),
+            )
+            if channel_id != uc_id:
+                conn.execute("UPDATE history SET channel_id = ? WHERE channel_id = ?", (uc_id, channel_id))
+                conn.execute("UPDATE logs SET channel_id = ? WHERE channel_id = ?", (uc_id, channel_id))
+
+    def delete_channel_resolution(self, channel_id: str) -> None:
+        with self.connection() as conn, conn:
+            conn.execute("DELETE FROM channel_resolution WHERE channel_id = ?", (channel_id,))
+
+    def get_channel_upload_times(self, channel_id: str, limit: int = UPLOAD_HISTORY_LIMIT) -> List[float]:
+        """
+        返回频道最近的上传时间戳（新到旧）：取非首次运行的成功下载时间（定期轮询下接近上传时间），
+        没有下载记录时取水位线视频的上传日期。
+        """
+        with self.connection() as conn:
+            rows = conn.execute(
+                """
+                SELECT CAST(strftime('%s', download_time) AS REAL) FROM logs
+                WHERE channel_id IN (?, COALESCE((SELECT uc_id FROM channel_resolution WHERE channel_id = ?), ?))
+                  AND status = 'success' AND is_first_for_channel != 'True'
+                ORDER BY download_time DESC LIMIT ?
+            """,
+                (channel_id, channel_id, channel_id, limit),
+            ).fetchall()
+            if rows:
+                return [row[0] for row in rows]
+            row = conn.execute("SELECT last_upload_date FROM channel_state WHERE channel_id = ?", (channel_id,)).fetchone()
+        if row is None or not row[0]:
+            return []
+        try:
+            return [datetime.strptime(row[0], "%Y%m%d").replace(tzinfo=timezone.utc).timestamp()]
+        except ValueError:
+            return []
+
+    def load_poll_schedule(self) -> Dict[str, float]:
+        with self.connection() as conn:
+            return dict(conn.execute("SELECT channel_id, next_poll_at FROM poll_schedule"))
+
+    def save_poll_schedule(self, channel_id: str, next_poll_at: float, interval_sec: float) -> None:
+        with self.connection() as conn, conn:
+            conn.execute(
+                """
+                INSERT INTO poll_schedule (channel_id, next_poll_at, interval_sec, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(channel_id) DO UPDATE SET
+                    next_poll_at = excluded.next_poll_at,
+                    interval_sec = excluded.interval_sec,
+                    updated_at = excluded.updated_at
+            """,
+                (channel_id, next_poll_at, interval_sec),
+            )
+
+    def delete_poll_schedule(self, channel_id: str) -> None:
+        with self.connection() as conn, conn:
+            conn.execute("DELETE FROM poll_schedule WHERE channel_id = ?", (channel_id,))
+
+    def get_http_cache(self, url: str) -> Optional[Dict]:
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT etag, last_modified, body_hash, ignored_ids FROM http_cache WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"etag": row[0], "last_modified": row[1], "body_hash": row[2], "ignored_ids": json.loads(row[3] or "[]")}
+
+    def set_http_cache(
+        self,
+        url: str,
+        channel_id: str,
+        etag: Optional[str],
+        last_modified: Optional[str],
+        body_hash: Optional[str],
+        ignored_ids: Optional[List[str]] = None,
+    ) -> None:
+        with self.connection() as conn, conn:
+            conn.execute(
+                """
+                INSERT INTO http_cache (url, channel_id, etag, last_modified, body_hash, ignored_ids, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(url) DO UPDATE SET
+                    channel_id = excluded.channel_id,
+                    etag = excluded.etag,
+                    last_modified = excluded.last_modified,
+                    body_hash = excluded.body_hash,
+                    ignored_ids = excluded.ignored_ids,
+                    updated_at = excluded.updated_at
+            """,
+                (url, channel_id, etag, last_modified, body_hash, json.dumps(ignored_ids or [])),
+            )
+
+    def prune_http_cache(self, channel_ids: Iterable[str]) -> int:
+        """
+        删除不在channel_ids中的频道的缓存项，返回删除的条数。
+        """
+        keep = set(channel_ids)
+        with self.connection() as conn, conn:
+            stale = [row[0] for row in conn.execute("SELECT DISTINCT channel_id FROM http_cache") if row[0] not in keep]
+            removed = 0
+            for start in range(0, len(stale), MAX_SQL_VARIABLES):
+                chunk = stale[start : start + MAX_SQL_VARIABLES]
+                placeholders = ",".join("?" * len(chunk))
+                removed += conn.execute(f"DELETE FROM http_cache WHERE channel_id IN ({placeholders})", chunk).rowcount
+        return removed
+
+    def mark_unavailable(self, video_id: str, channel_id: str, reason: str, ttl_sec: Optional[float]) -> None:
+        expires_at = None if ttl_sec is None else time.time() + ttl_sec
+        with self.connection() as conn, conn:
+            conn.execute(
+                """
+                INSERT INTO unavailable_videos (video_id, channel_id, reason, expires_at, updated_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(video_id) DO UPDATE SET
+                    channel_id = excluded.channel_id,
+                    reason = excluded.reason,
+                    expires_at = excluded.expires_at,
+                    updated_at = excluded.updated_at
+            """,
+                (video_id, channel_id, reason, expires_at),
+            )
+
+    def get_unavailable_videos(self, video_ids: Iterable[str]) -> Dict[str, str]:
+        """
+        返回video_ids中负缓存未过期的视频 {video_id: 原因}，按参数上限分块查询。
+        """
+        video_ids = list(dict.fromkeys(video_ids))
+        now = time.time()
+        unavailable = {}
+        with self.connection() as conn:
+            for start in range(0, len(video_ids), MAX_SQL_VARIABLES - 1):
+                chunk = video_ids[start : start + MAX_SQL_VARIABLES - 1]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"""
+                    SELECT video_id, reason FROM unavailable_videos
+                    WHERE video_id IN ({placeholders}) AND (expires_at IS NULL OR expires_at > ?)
+                """,
+                    chunk + [now],
+                )
+                unavailable.update(rows)
+        return unavailable
+
+    def prune_unavailable(self) -> int:
+        """
+        删除已过期的负缓存项，返回删除的条数。
+        同时清除这些视频所在频道的订阅源验证信息（保留ignored_ids），下次检查重新判断而不是因"未变化"跳过。
+        """
+        now = time.time()
+        with self.connection() as conn, conn:
+            channel_ids = [
+                row[0] for row in conn.execute("SELECT DISTINCT channel_id FROM unavailable_videos WHERE expires_at <= ?", (now,))
+            ]
+            # 负缓存按UC ID记录，订阅源缓存按channels.txt中的ID记录，经channel_resolution对应
+            size = MAX_SQL_VARIABLES // 2
+            for start in range(0, len(channel_ids), size):
+                chunk = channel_ids[start : start + size]
+                placeholders = ",".join("?" * len(chunk))
+                conn.execute(
+                    f"""
+                    UPDATE http_cache SET etag = NULL, last_modified = NULL, body_hash = NULL
+                    WHERE channel_id IN ({placeholders})
+                       OR channel_id IN (SELECT channel_id FROM channel_resolution WHERE uc_id IN ({placeholders}))
+                """,
+                    chunk + chunk,
+                )
+            return conn.execute("DELETE FROM unavailable_videos WHERE expires_at <= ?", (now,)).rowcount
+
+    def enqueue_jobs(self, channel_id: str, is_first: bool, videos: List[Dict]) -> int:
+        """
+        为videos各建一个pending下载任务（已有任务的视频忽略），返回新建的任务数。
+        """
+        now = time.time()
+        with self.connection() as conn, conn:
+            return sum(
+                conn.execute(
+                    """
+                    INSERT OR IGNORE INTO jobs (video_id, channel_id, is_first, payload, state, next_attempt_at)
+                    VALUES (?, ?, ?, ?, 'pending', ?)
+                """,
+                    (video["video_id"], channel_id, int(is_first), json.dumps(video, ensure_ascii=False), now),
+                ).rowcount
+                for video in videos
+            )
+
+    def claim_jobs(self, owner: str, limit: int, lease_sec: float = JOB_LEASE_SEC) -> List[Dict]:
+        """
+        领取最早到期的任务，以及同一频道的其他到期任务（共最多limit个），标记为running并加租约。
+        到期：pending/failed且到达next_attempt_at，或running但租约已过期。
+        返回 [{"video", "channel_id", "is_first", "attempts"}]，没有到期任务时返回空列表。
+        """
+        now = time.time()
+        due = """
+            ((state IN ('pending', 'failed') AND next_attempt_at <= :now)
+             OR (state = 'running' AND lease_until <= :now))
+        """
+        with self.connection() as conn, conn:
+            # 立即取得写锁，领取（读+改）在同一事务内完成，多个线程/进程不会领到同一任务
+            conn.execute("BEGIN IMMEDIATE")
+            first = conn.execute(
+                f"SELECT channel_id FROM jobs WHERE {due} ORDER BY next_attempt_at, rowid LIMIT 1", {"now": now}
+            ).fetchone()
+            if first is None:
+                return []
+            rows = conn.execute(
+                f"""
+                SELECT video_id, channel_id, is_first, payload, attempts FROM jobs
+                WHERE channel_id = :channel_id AND {due} ORDER BY next_attempt_at, rowid LIMIT :limit
+            """,
+                {"now": now, "channel_id": first[0], "limit": limit},
+            ).fetchall()
+            conn.executemany(
+                """
+                UPDATE jobs SET state = 'running', attempts = attempts + 1, lease_owner = ?, lease_until = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE video_id = ?
+            """,
+                [(owner, now + lease_sec, row[0]) for row in rows],
+            )
+        return [
+            {"video": json.loads(row[3]), "channel_id": row[1], "is_first": bool(row[2]), "attempts": row[4] + 1}
+            for row in rows
+        ]
+
+    def complete_job(self, video_id: str) -> None:
+        with self.connection() as conn, conn:
+            conn.execute(
+                """
+                UPDATE jobs SET state = 'done', lease_owner = NULL, lease_until = NULL, last_error = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE video_id = ?
+            """,
+                (video_id,),
+            )
+
+    def fail_job(self, video_id: str, error: str, max_attempts: int) -> Optional[str]:
+        """
+        记录任务失败：未达max_attempts次时转为failed并按退避安排下次尝试，否则转为dead。
+        返回新状态，任务不存在时返回None。
+        """
+        with self.connection() as conn, conn:
+            row = conn.execute("SELECT attempts FROM jobs WHERE video_id = ?", (video_id,)).fetchone()
+            if row is None:
+                return None
+            attempts = row[0]
+            state = "dead" if attempts >= max_attempts else "failed"
+            delay = min(JOB_RETRY_BASE_SEC * 2 ** max(attempts - 1, 0), JOB_RETRY_MAX_SEC)
+            conn.execute(
+                """
+                UPDATE jobs SET state = ?, next_attempt_at = ?, lease_owner = NULL, lease_until = NULL,
+                    last_error = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE video_id = ?
+            """,
+                (state, time.time() + delay, error, video_id),
+            )
+        return state
+
+    def delete_job(self, video_id: str) -> None:
+        with self.connection() as conn, conn:
+            conn.execute("DELETE FROM jobs WHERE video_id = ?", (video_id,))
+
+    def requeue_running_jobs(self, owner: Optional[str] = None) -> int:
+        """
+        把running任务（指定owner时只限其持有的）放回pending（不计尝试次数），返回放回的任务数。
+        """
+        with self.connection() as conn, conn:
+            return conn.execute(
+                """
+                UPDATE jobs SET state = 'pending', attempts = MAX(attempts - 1, 0), lease_owner = NULL,
+                    lease_until = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE state = 'running' AND (:owner IS NULL OR lease_owner = :owner)
+            """,
+                {"owner": owner},
+            ).rowcount
+
+    def next_job_due_at(self) -> Optional[float]:
+        """
+        返回最早到期的任务时间：pending/failed任务的下次尝试时间，或running任务的租约到期时间。
+        """
+        with self.connection() as conn:
+            row = conn.execute(
+                """
+                SELECT MIN(CASE WHEN state = 'running' THEN lease_until ELSE next_attempt_at END) FROM jobs
+                WHERE state IN ('pending', 'failed', 'running')
+            """
+            ).fetchone()
+        return row[0]
+
+    def has_open_jobs(self, channel_id: str) -> bool:
+        """
+        频道是否还有未完成的任务（等待、进行中或等待重试）。
+        """
+        with self.connection() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM jobs WHERE channel_id = ? AND state IN ('pending', 'running', 'failed') LIMIT 1",
+                (channel_id,),
+            ).fetchone()
+        return row is not None
+
+    def filter_open_jobs(self, video_ids: Iterable[str]) -> List[str]:
+        """
+        返回video_ids中有未完成任务（等待、进行中或等待重试）的ID，按参数上限分块查询。
+        """
+        video_ids = list(dict.fromkeys(video_ids))
+        queued = set()
+        with self.connection() as conn:
+            for start in range(0, len(video_ids), MAX_SQL_VARIABLES):
+                chunk = video_ids[start : start + MAX_SQL_VARIABLES]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"""
+                    SELECT video_id FROM jobs
+                    WHERE video_id IN ({placeholders}) AND state IN ('pending', 'running', 'failed')
+                """,
+                    chunk,
+                )
+                queued.update(row[0] for row in rows)
+        return [video_id for video_id in video_ids if video_id in queued]
+
+    def claim_channels(self, channel_ids: List[str], owner: str, lease_sec: float) -> Tuple[List[str], Dict[str, float]]:
+        """
+        为channel_ids中可检查的频道加租约：没有其他节点持有有效租约，且共享的poll_schedule中未被其他节点排到以后。
+        返回 (领取的频道, {未领取的频道: 应再次查看的时间戳})。
+        """
+        now = time.time()
+        claimed, deferred = [], {}
+        with self.connection() as conn, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for channel_id in channel_ids:
+                row = conn.execute("SELECT next_poll_at FROM poll_schedule WHERE channel_id = ?", (channel_id,)).fetchone()
+                if row is not None and row[0] > now:
+                    deferred[channel_id] = row[0]
+                    continue
+                row = conn.execute(
+                    "SELECT owner, lease_until FROM channel_leases WHERE channel_id = ?", (channel_id,)
+                ).fetchone()
+                if row is not None and row[0] != owner and row[1] > now:
+                    deferred[channel_id] = row[1]
+                    continue
+                conn.execute(
+                    """
+                    INSERT INTO channel_leases (channel_id, owner, lease_until) VALUES (?, ?, ?)
+                    ON CONFLICT(channel_id) DO UPDATE SET owner = excluded.owner, lease_until = excluded.lease_until
+                """,
+                    (channel_id, owner, now + lease_sec),
+                )
+                claimed.append(channel_id)
+        return claimed, deferred
+
+    def release_channels(self, channel_ids: List[str], owner: str) -> None:
+        with self.connection() as conn, conn:
+            conn.executemany(
+                "DELETE FROM channel_leases WHERE channel_id = ? AND owner = ?",
+                [(channel_id, owner) for channel_id in channel_ids],
+            )
+
+    def renew_leases(self, owner: str, lease_sec: float) -> int:
+        """
+        心跳：延长owner持有的running任务和频道租约，返回续约的条数。
+        """
+        lease_until = time.time() + lease_sec
+        with self.connection() as conn, conn:
+            renewed = conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE state = 'running' AND lease_owner = ?", (lease_until, owner)
+            ).rowcount
+            renewed += conn.execute(
+                "UPDATE channel_leases SET lease_until = ? WHERE owner = ?", (lease_until, owner)
+            ).rowcount
+        return renewed
+
+    def prune_jobs(self) -> int:
+        """
+        删除完成超过JOB_RETENTION_DAYS天的任务，返回删除的条数。
+        """
+        with self.connection() as conn, conn:
+            return conn.execute(
+                "DELETE FROM jobs WHERE state = 'done' AND updated_at <= datetime('now', ?)",
+                (f"-{JOB_RETENTION_DAYS} days",),
+            ).rowcount
+
+    def write_downloads(self, entries: List[Tuple]) -> None:
+        """
+        在一个事务中写入一批下载结果 (video_id, channel_id, status, file_path, is_first_for_channel)：
+        全部写入logs；status为success的同时插入history并把对应任务标记为完成。
+        """
+        downloaded = [(entry[0], entry[1]) for entry in entries if entry[2] == "success"]
+        with self.connection() as conn, conn:
+            conn.executemany("INSERT OR IGNORE INTO history (video_id, channel_id) VALUES (?, ?)", downloaded)
+            conn.executemany(
+                """
+                INSERT INTO logs (video_id, channel_id, status, file_path, is_first_for_channel)
+                VALUES (?, ?, ?, ?, ?)
+            """,
+                entries,
+            )
+            conn.executemany(
+                """
+                UPDATE jobs SET state = 'done', lease_owner = NULL, lease_until = NULL, last_error = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE video_id = ?
+            """,
+                [(video_id,) for video_id, _ in downloaded],
+            )
+        for video_id, _ in downloaded:
+            self._index_add(video_id)
+
+    def log_download(
+        self,
+        video_id: str,
+        channel_id: str,
+        status: str,
+        file_path: Optional[str] = None,
+        is_first_for_channel: str = "false",
+    ) -> None:
+        with self.connection() as conn, conn:
+            conn.execute(
+                """
+                INSERT INTO logs (video_id, channel_id, status, file_path, is_first_for_channel)
+                VALUES (?, ?, ?, ?, ?)
+            """,
+                (video_id, channel_id, status, file_path, is_first_for_channel),
+            )
+
+
+_stores: Dict[str, HistoryStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(db_path: str = DB_PATH) -> HistoryStore:
+    """
+    获取db_path对应的进程级共享HistoryStore（首次调用时创建）。
+    """
+    with _stores_lock:
+        store = _stores.get(db_path)
+        if store is None:
+            store = HistoryStore(db_path)
+            _stores[db_path] = store
+        return store
+
+
+def close_stores() -> None:
+    """
+    关闭所有共享HistoryStore的连接（程序退出或测试清理时调用）。
+    """
+    with _stores_lock:
+        for store in _stores.values():
+            store.close()
+        _stores.clear()
+
+
+def init_db(db_path: str = DB_PATH, journal_mode: str = JOURNAL_MODE) -> None:
     """
     初始化数据库，创建表和索引如果不存在。
+    journal_mode在建立连接前设置，集群模式下传入"DELETE"使用回滚日志。
+    """
+    store = get_store(db_path)
+    store.journal_mode = journal_mode.upper()
+    store.init_schema()
+
+
+def load_downloaded_index(error_rate: float = 0.001, db_path: str = DB_PATH) -> DownloadedIndex:
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    # 创建history表
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS history (
-            video_id TEXT PRIMARY KEY,
-            channel_id TEXT NOT NULL
-        )
-    """)
-
-    # 创建索引
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_channel ON history(channel_id)")
-
-    # 创建logs表
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            video_id TEXT NOT NULL,
-            channel_id TEXT NOT NULL,
-            download_time DATETIME DEFAULT CURRENT_TIMESTAMP,
-            status TEXT NOT NULL,
-            file_path TEXT,
-            is_first_for_channel TEXT DEFAULT 'false'
-        )
-    """)
-
-    # 创建logs索引
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_channel_log ON logs(channel_id)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_time ON logs(download_time)")
-
-    conn.commit()
-    conn.close()
+    启动时加载已下载video_id的内存索引，返回索引（用于报告数量和内存占用）。
+    """
+    return get_store(db_path).load_index(error_rate)
 
 
 def has_records_for_channel(channel_id: str, db_path: str = DB_PATH) -> bool:
     """
     检查指定频道是否有下载记录。
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM history WHERE channel_id = ?", (channel_id,))
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count > 0
+    return get_store(db_path).has_records_for_channel(channel_id)
 
 
 def is_downloaded(video_id: str, db_path: str = DB_PATH) -> bool:
     """
     检查视频ID是否已下载。
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM history WHERE video_id = ?", (video_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result is not None
+    return get_store(db_path).is_downloaded(video_id)
+
+
+def filter_new_video_ids(video_ids: Iterable[str], db_path: str = DB_PATH) -> List[str]:
+    """
+    批量检查视频ID，返回尚未下载的子集（保持原顺序）。
+    """
+    return get_store(db_path).filter_new_video_ids(video_ids)
 
 
 def mark_downloaded(video_id: str, channel_id: str, db_path: str = DB_PATH) -> None:
     """
     标记视频为已下载（插入history）。
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("INSERT OR IGNORE INTO history (video_id, channel_id) VALUES (?, ?)", (video_id, channel_id))
-    conn.commit()
-    conn.close()
+    get_store(db_path).mark_downloaded(video_id, channel_id)
+
+
+def get_channel_watermark(channel_id: str, db_path: str = DB_PATH) -> Optional[Dict[str, str]]:
+    """
+    读取频道水位线（上次扫描到的最新视频ID和上传日期），无记录返回None。
+    """
+    return get_store(db_path).get_channel_watermark(channel_id)
+
+
+def set_channel_watermark(channel_id: str, video_id: str, upload_date: str, db_path: str = DB_PATH) -> None:
+    """
+    更新频道水位线。
+    """
+    get_store(db_path).set_channel_watermark(channel_id, video_id, upload_date)
+
+
+def get_channel_resolution(channel_id: str, db_path: str = DB_PATH) -> Optional[Dict]:
+    """
+    读取频道解析结果 {"uc_id", "uploader", "stale"}，无记录返回None。
+    stale表示超过RESOLUTION_TTL_DAYS未刷新。
+    """
+    return get_store(db_path).get_channel_resolution(channel_id)
+
+
+def set_channel_resolution(channel_id: str, uc_id: str, uploader: Optional[str] = None, db_path: str = DB_PATH) -> None:
+    """
+    保存频道解析结果；该频道以handle记录的下载历史改为以UC ID记录，频道改名不影响排重和首次运行判断。
+    """
+    get_store(db_path).set_channel_resolution(channel_id, uc_id, uploader)
+
+
+def delete_channel_resolution(channel_id: str, db_path: str = DB_PATH) -> None:
+    """
+    删除频道解析结果（按UC ID访问失败时调用，下次按handle重新解析）。
+    """
+    get_store(db_path).delete_channel_resolution(channel_id)
+
+
+def get_channel_upload_times(channel_id: str, db_path: str = DB_PATH) -> List[float]:
+    """
+    返回频道最近的上传时间戳（新到旧），用于估计上传节奏。
+    """
+    return get_store(db_path).get_channel_upload_times(channel_id)
+
+
+def load_poll_schedule(db_path: str = DB_PATH) -> Dict[str, float]:
+    """
+    读取持久化的轮询计划 {channel_id: 下次轮询时间戳}。
+    """
+    return get_store(db_path).load_poll_schedule()
+
+
+def save_poll_schedule(channel_id: str, next_poll_at: float, interval_sec: float, db_path: str = DB_PATH) -> None:
+    """
+    保存频道的下次轮询时间和当前轮询间隔。
+    """
+    get_store(db_path).save_poll_schedule(channel_id, next_poll_at, interval_sec)
+
+
+def delete_poll_schedule(channel_id: str, db_path: str = DB_PATH) -> None:
+    """
+    删除频道的轮询计划（频道已从channels.txt移除）。
+    """
+    get_store(db_path).delete_poll_schedule(channel_id)
+
+
+def get_http_cache(url: str, db_path: str = DB_PATH) -> Optional[Dict]:
+    """
+    读取URL的HTTP缓存项（etag/last_modified/body_hash/ignored_ids），无记录返回None。
+    """
+    return get_store(db_path).get_http_cache(url)
+
+
+def set_http_cache(
+    url: str,
+    channel_id: str,
+    etag: Optional[str],
+    last_modified: Optional[str],
+    body_hash: Optional[str],
+    ignored_ids: Optional[List[str]] = None,
+    db_path: str = DB_PATH,
+) -> None:
+    """
+    保存URL的HTTP缓存项。ignored_ids为订阅源中有、但频道/videos列表中没有的视频ID（Shorts、直播），
+    检查订阅源时不当作待下载的视频。
+    """
+    get_store(db_path).set_http_cache(url, channel_id, etag, last_modified, body_hash, ignored_ids)
+
+
+def prune_http_cache(channel_ids: Iterable[str], db_path: str = DB_PATH) -> int:
+    """
+    清理已从channels.txt移除的频道的HTTP缓存项，返回删除的条数。
+    """
+    return get_store(db_path).prune_http_cache(channel_ids)
+
+
+def mark_unavailable(video_id: str, channel_id: str, reason: str, ttl_sec: Optional[float], db_path: str = DB_PATH) -> None:
+    """
+    记录视频不可用（负缓存），ttl_sec秒内不再尝试下载；ttl_sec为None表示永久。
+    """
+    get_store(db_path).mark_unavailable(video_id, channel_id, reason, ttl_sec)
+
+
+def get_unavailable_videos(video_ids: Iterable[str], db_path: str = DB_PATH) -> Dict[str, str]:
+    """
+    批量查询负缓存，返回video_ids中仍不可用的视频 {video_id: 原因}。
+    """
+    return get_store(db_path).get_unavailable_videos(video_ids)
+
+
+def prune_unavailable(db_path: str = DB_PATH) -> int:
+    """
+    清理已过期的负缓存项，返回删除的条数。
+    """
+    return get_store(db_path).prune_unavailable()
+
+
+def enqueue_jobs(channel_id: str, is_first: bool, videos: List[Dict], db_path: str = DB_PATH) -> int:
+    """
+    把新视频写入持久化任务队列（每个视频一个pending任务），返回新建的任务数。
+    """
+    return get_store(db_path).enqueue_jobs(channel_id, is_first, videos)
+
+
+def claim_jobs(owner: str, limit: int, lease_sec: float = JOB_LEASE_SEC, db_path: str = DB_PATH) -> List[Dict]:
+    """
+    领取同一频道的最多limit个到期任务（加租约），返回任务列表。
+    """
+    return get_store(db_path).claim_jobs(owner, limit, lease_sec)
+
+
+def complete_job(video_id: str, db_path: str = DB_PATH) -> None:
+    """
+    标记任务完成（视频已下载并传输）。
+    """
+    get_store(db_path).complete_job(video_id)
+
+
+def fail_job(video_id: str, error: str, max_attempts: int, db_path: str = DB_PATH) -> Optional[str]:
+    """
+    记录任务失败，按退避安排重试或在尝试次数用尽时转为dead，返回新状态。
+    """
+    return get_store(db_path).fail_job(video_id, error, max_attempts)
+
+
+def delete_job(video_id: str, db_path: str = DB_PATH) -> None:
+    """
+    删除任务（视频不可用，由负缓存决定何时再尝试）。
+    """
+    get_store(db_path).delete_job(video_id)
+
+
+def requeue_running_jobs(owner: Optional[str] = None, db_path: str = DB_PATH) -> int:
+    """
+    启动时把上次运行中断的running任务放回pending，返回放回的任务数。
+    集群模式下只放回本节点（owner）持有的任务，其他节点的任务由租约过期接管。
+    """
+    return get_store(db_path).requeue_running_jobs(owner)
+
+
+def next_job_due_at(db_path: str = DB_PATH) -> Optional[float]:
+    """
+    返回最早到期的任务（待重试，或租约过期可接管）的时间戳，没有时返回None。
+    """
+    return get_store(db_path).next_job_due_at()
+
+
+def has_open_jobs(channel_id: str, db_path: str = DB_PATH) -> bool:
+    """
+    频道是否还有未完成的下载任务（未完成时不推进其水位线）。
+    """
+    return get_store(db_path).has_open_jobs(channel_id)
+
+
+def filter_open_jobs(video_ids: Iterable[str], db_path: str = DB_PATH) -> List[str]:
+    """
+    批量查询video_ids中已在任务队列中等待或重试的视频（其重试由任务队列负责）。
+    """
+    return get_store(db_path).filter_open_jobs(video_ids)
+
+
+def claim_channels(
+    channel_ids: List[str], owner: str, lease_sec: float, db_path: str = DB_PATH
+) -> Tuple[List[str], Dict[str, float]]:
+    """
+    集群模式下领取要检查的频道，返回 (领取的频道, {其他节点正在或已经检查的频道: 再次查看的时间戳})。
+    """
+    return get_store(db_path).claim_channels(channel_ids, owner, lease_sec)
+
+
+def release_channels(channel_ids: List[str], owner: str, db_path: str = DB_PATH) -> None:
+    """
+    释放owner持有的频道租约（检查并重新排期之后）。
+    """
+    get_store(db_path).release_channels(channel_ids, owner)
+
+
+def renew_leases(owner: str, lease_sec: float, db_path: str = DB_PATH) -> int:
+    """
+    延长owner持有的下载任务和频道租约（心跳），返回续约的条数。
+    """
+    return get_store(db_path).renew_leases(owner, lease_sec)
+
+
+def prune_jobs(db_path: str = DB_PATH) -> int:
+    """
+    清理过期的已完成任务，返回删除的条数。
+    """
+    return get_store(db_path).prune_jobs()
+
+
+def record_download(
+    video_id: str,
+    channel_id: str,
+    status: str,
+    file_path: Optional[str] = None,
+    is_first_for_channel: str = "false",
+    db_path: str = DB_PATH,
+) -> None:
+    """
+    经写后缓冲记录下载结果（最迟WRITE_FLUSH_SEC秒后批量写入）：写入logs，
+    status为success时在同一事务中插入history并把下载任务标记为完成。
+    """
+    get_store(db_path).writer.record((video_id, channel_id, status, file_path, is_first_for_channel))
+
+
+def flush_downloads(db_path: str = DB_PATH) -> int:
+    """
+    立即写入缓冲中的下载结果，返回写入的条数。
+    """
+    return get_store(db_path).writer.flush()
 
 
 def log_download(
@@ -89,14 +1157,4 @@ def log_download(
     """
     记录下载日志到logs表。
     """
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        INSERT INTO logs (video_id, channel_id, status, file_path, is_first_for_channel)
-        VALUES (?, ?, ?, ?, ?)
-    """,
-        (video_id, channel_id, status, file_path, is_first_for_channel),
-    )
-    conn.commit()
-    conn.close()
+    get_store(db_path).log_download(video_id, channel_id, status, file_path, is_first_for_channel)
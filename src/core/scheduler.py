@@ -1,20 +1,229 @@
+import asyncio
+import heapq
+import logging
+import random
+import statistics
 import time
-from typing import Callable
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 
-import schedule
+from src.config.config_reader import get_channel_ids, get_option
+from src.core.cluster import node_id
+from src.core.history_manager import (
+    claim_channels,
+    delete_poll_schedule,
+    get_channel_upload_times,
+    load_poll_schedule,
+    next_job_due_at,
+    release_channels,
+    save_poll_schedule,
+)
 
+logger = logging.getLogger(__name__)
 
-def setup_schedule(check_func: Callable, config: dict) -> None:
+# 每个典型上传间隔内轮询的次数
+POLLS_PER_UPLOAD = 4
+# 调度循环最长休眠秒数（以便及时发现channels.txt的变化）；其余时候定时器在下一个频道到期时唤醒
+MAX_SLEEP_SEC = 60
+
+
+def compute_poll_interval(upload_times: List[float], now: float, config: dict) -> float:
     """
-    设置定时任务，每config['interval_min']分钟执行check_func。
+    按频道的上传节奏计算轮询间隔（秒）。upload_times为最近上传时间戳（新到旧）。
+    典型上传间隔取相邻上传间隔的中位数；距最近一次上传更久时取后者，不活跃的频道逐步放缓。
+    轮询间隔为典型上传间隔的1/POLLS_PER_UPLOAD，限制在[poll_min_interval_min, poll_max_interval_min]分钟内；
+    没有上传记录时使用interval_min。
     """
-    interval_min = config['interval_min']
-    schedule.every(interval_min).minutes.do(check_func)
+    min_sec = get_option(config, "poll_min_interval_min") * 60
+    max_sec = max(get_option(config, "poll_max_interval_min") * 60, min_sec)
+    if not upload_times:
+        interval = config["interval_min"] * 60
+    else:
+        gaps = [newer - older for newer, older in zip(upload_times, upload_times[1:])]
+        typical = max(statistics.median(gaps) if gaps else 0, now - upload_times[0])
+        interval = typical / POLLS_PER_UPLOAD
+    return min(max(interval, min_sec), max_sec)
+
+
+class PollScheduler:
+    """
+    按频道下次轮询时间排序的优先队列（堆）。到期的频道一起交给check_func（协程函数）检查，
+    检查后按各自的上传节奏重新排期；计划持久化在poll_schedule表，重启后继续。
+    同时到期的一批频道（启动时、新增频道）均匀错开到stagger_window_min（缺省为interval_min）分钟内，
+    重新排期的间隔加±scan_jitter比例的随机抖动，避免请求集中。
+    集群模式下到期的频道先在共享数据库中领取租约，其他节点正在检查或已排到以后的频道推迟到那时再看，
+    每个频道在整个集群中每次到期只检查一次。
+    check_func只应等待频道扫描（下载由长期运行的流水线执行），否则检查期间到期的频道会在结束后集中检查。
+    persist=False时不写数据库（用于--dry-run）。
+    """
+
+    def __init__(self, check_func: Optional[Callable[[List[str]], Awaitable[None]]], config: dict, persist: bool = True):
+        self.check_func = check_func
+        self.config = config
+        self.persist = persist
+        self._heap = []
+        # 每个频道当前有效的下次轮询时间；堆中与之不符的条目已过期，出堆时丢弃
+        self._next_poll: Dict[str, float] = {}
+        # 启动时已过期的频道与新频道一样错开检查
+        self._overdue = []
+        now = time.time()
+        for channel_id, next_poll_at in load_poll_schedule().items():
+            if next_poll_at <= now:
+                self._overdue.append(channel_id)
+            else:
+                self._push(channel_id, next_poll_at)
+
+    def _push(self, channel_id: str, next_poll_at: float) -> None:
+        self._next_poll[channel_id] = next_poll_at
+        heapq.heappush(self._heap, (next_poll_at, channel_id))
+
+    def _is_current(self, entry) -> bool:
+        next_poll_at, channel_id = entry
+        return self._next_poll.get(channel_id) == next_poll_at
+
+    def _stagger(self, channel_ids: List[str], now: float) -> None:
+        """
+        把一批同时到期的频道均匀排在[now, now + stagger_window_min)内，第一个立即到期，
+        其余各自在所在时段内加随机抖动。未配置窗口时取interval_min，之后各频道按各自的间隔重新排期，检查保持分散。
+        """
+        if not channel_ids:
+            return
+        window_min = get_option(self.config, "stagger_window_min")
+        if window_min is None:
+            window_min = self.config["interval_min"]
+        slot = window_min * 60 / len(channel_ids)
+        jitter = get_option(self.config, "scan_jitter")
+        for i, channel_id in enumerate(channel_ids):
+            offset = i * slot + (random.uniform(0, jitter * slot) if i else 0)
+            self._push(channel_id, now + offset)
+
+    def sync_channels(self, channel_ids: List[str], now: float) -> None:
+        """
+        与channels.txt同步：新频道（及启动时已过期的频道）错开到期，已移除的频道删除计划。
+        """
+        current = set(channel_ids)
+        pending = [channel_id for channel_id in self._overdue if channel_id in current]
+        pending += [channel_id for channel_id in channel_ids if channel_id not in self._next_poll and channel_id not in pending]
+        self._overdue = []
+        self._stagger(pending, now)
+        for channel_id in [channel_id for channel_id in self._next_poll if channel_id not in current]:
+            del self._next_poll[channel_id]
+            if self.persist:
+                delete_poll_schedule(channel_id)
+
+    def pop_due(self, now: float) -> List[str]:
+        """
+        取出所有已到期的频道（按到期时间先后）。
+        """
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if self._is_current(entry):
+                due.append(entry[1])
+        return due
+
+    def reschedule(self, channel_ids: List[str], now: float) -> None:
+        """
+        按上传节奏为检查过的频道计算下次轮询时间并持久化。
+        """
+        jitter = get_option(self.config, "scan_jitter")
+        for channel_id in channel_ids:
+            interval = compute_poll_interval(get_channel_upload_times(channel_id), now, self.config)
+            next_poll_at = now + interval * (1 + random.uniform(-jitter, jitter))
+            self._push(channel_id, next_poll_at)
+            if self.persist:
+                save_poll_schedule(channel_id, next_poll_at, interval)
+            logger.info(f"频道 {channel_id} 下次检查在 {(next_poll_at - now) / 60:.0f} 分钟后")
+
+    def timetable(self) -> List[Tuple[float, str]]:
+        """
+        返回 [(下次轮询时间戳, 频道ID)]，按时间先后排序。
+        """
+        return sorted((next_poll_at, channel_id) for channel_id, next_poll_at in self._next_poll.items())
+
+    def next_poll_at(self) -> Optional[float]:
+        while self._heap and not self._is_current(self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def _claim(self, channel_ids: List[str]) -> List[str]:
+        """
+        集群模式下领取到期频道的租约，返回本节点负责检查的频道；其余频道按共享计划推迟。
+        """
+        claimed, deferred = claim_channels(channel_ids, node_id(self.config), get_option(self.config, "lease_seconds"))
+        for channel_id, retry_at in deferred.items():
+            self._push(channel_id, retry_at)
+        if deferred:
+            logger.info(f"{len(deferred)} 个到期频道由其他节点检查")
+        return claimed
+
+    async def run_pending(self) -> None:
+        """
+        检查所有到期的频道，检查结束后（包括出错时）重新排期。
+        被取消（程序停止）时频道未必已检查，保持到期，poll_schedule中仍为原到期时间，重启后照常检查。
+        没有到期频道但有到期的下载任务（失败重试）时，以空列表调用check_func只执行下载任务。
+        """
+        now = time.time()
+        self.sync_channels(get_channel_ids(), now)
+        due = self.pop_due(now)
+        cluster = get_option(self.config, "cluster_mode")
+        if due and cluster:
+            due = self._claim(due)
+        if not due:
+            next_job_at = next_job_due_at()
+            if next_job_at is not None and next_job_at <= now:
+                await self.check_func([])
+            return
+        cancelled = False
+        try:
+            await self.check_func(due)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            if cancelled:
+                for channel_id in due:
+                    self._push(channel_id, now)
+            else:
+                self.reschedule(due, time.time())
+            if cluster:
+                release_channels(due, node_id(self.config))
+
+    def idle_seconds(self) -> float:
+        """
+        距下一个频道到期的秒数，最长MAX_SLEEP_SEC。
+        """
+        next_poll_at = self.next_poll_at()
+        if next_poll_at is None:
+            return MAX_SLEEP_SEC
+        return min(max(next_poll_at - time.time(), 0), MAX_SLEEP_SEC)
+
+
+def setup_schedule(check_func: Callable[[List[str]], Awaitable[None]], config: dict) -> PollScheduler:
+    """
+    创建按频道自适应轮询的调度器，check_func为协程函数，接收本次到期的频道ID列表。
+    """
+    return PollScheduler(check_func, config)
+
+
+def print_timetable(config: dict) -> None:
+    """
+    打印channels.txt中各频道的检查时间表（--dry-run），不执行检查也不修改计划。
+    """
+    scheduler = PollScheduler(None, config, persist=False)
+    now = time.time()
+    channel_ids = get_channel_ids()
+    scheduler.sync_channels(channel_ids, now)
+    print(f"{len(channel_ids)} 个频道的检查时间表：")
+    for next_poll_at, channel_id in scheduler.timetable():
+        when = datetime.fromtimestamp(next_poll_at).strftime("%Y-%m-%d %H:%M:%S")
+        print(f"{when}  +{(next_poll_at - now) / 60:7.1f} 分钟  {channel_id}")
+
 
-def run_loop() -> None:
+async def run_loop(scheduler: PollScheduler) -> None:
     """
-    运行调度循环。
+    在事件循环中运行调度：检查到期频道后休眠到下一个频道到期，取消任务即停止。
     """
     while True:
-        schedule.run_pending()
-        time.sleep(1)
\ No newline at end of file
+        await scheduler.run_pending()
+        await asyncio.sleep(scheduler.idle_seconds())
@@ -0,0 +1,105 @@
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, List, Optional
+
+from src.config.config_reader import get_option
+
+logger = logging.getLogger(__name__)
+
+
+def _minutes(hhmm: str) -> int:
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def current_limit_mbps(config: dict, now: Optional[datetime] = None) -> float:
+    """
+    返回当前时段的全局带宽上限（Mbps，0表示不限）：命中bandwidth_profiles中某个时段时用该时段的上限，
+    否则用max_bandwidth_mbps。时段为[start, end)，end早于start时跨越午夜。
+    """
+    now = now or datetime.now()
+    minute = now.hour * 60 + now.minute
+    for profile in get_option(config, "bandwidth_profiles"):
+        start, end = _minutes(profile["start"]), _minutes(profile["end"])
+        if (start <= minute < end) if start <= end else (minute >= start or minute < end):
+            return profile["max_bandwidth_mbps"]
+    return get_option(config, "max_bandwidth_mbps")
+
+
+class BandwidthSlot:
+    """
+    一个进行中的下载在带宽预算中的份额。rate_bps为None表示不限速。
+    进程内引擎下载时attach其YoutubeDL实例，份额变化时立即生效（yt-dlp每个数据块都读取ratelimit）。
+    """
+
+    def __init__(self):
+        self.rate_bps: Optional[int] = None
+        self._ydl = None
+
+    def limit_args(self) -> List[str]:
+        """
+        yt-dlp的限速参数（启动时的份额）。
+        """
+        return ["--limit-rate", str(self.rate_bps)] if self.rate_bps else []
+
+    def attach(self, ydl) -> None:
+        self._ydl = ydl
+        ydl.params["ratelimit"] = self.rate_bps
+
+    def detach(self) -> None:
+        self._ydl = None
+
+    def set_rate(self, rate_bps: Optional[int]) -> None:
+        self.rate_bps = rate_bps
+        if self._ydl is not None:
+            self._ydl.params["ratelimit"] = rate_bps
+
+
+def _share_bps(limit_mbps: float, count: int) -> Optional[int]:
+    return int(limit_mbps * 1_000_000 / 8 / count) if limit_mbps and count else None
+
+
+class BandwidthBudget:
+    """
+    进程级带宽预算。进程内引擎：当前时段的上限在所有进行中的下载之间平均分配，下载开始和结束时重新分配，即时生效。
+    子进程引擎：yt-dlp启动后无法再调整--limit-rate，每个下载固定取上限的1/download_workers，
+    并发下载最多download_workers个，总和不会超过上限。
+    """
+
+    def __init__(self):
+        self._slots: List[BandwidthSlot] = []
+        self._lock = threading.Lock()
+
+    def _rebalance(self, config: dict) -> None:
+        rate = _share_bps(current_limit_mbps(config), len(self._slots))
+        for slot in self._slots:
+            slot.set_rate(rate)
+
+    @contextmanager
+    def slot(self, config: dict) -> Iterator[BandwidthSlot]:
+        slot = BandwidthSlot()
+        if get_option(config, "engine") != "inprocess":
+            slot.set_rate(_share_bps(current_limit_mbps(config), get_option(config, "download_workers")))
+            yield slot
+            return
+        with self._lock:
+            self._slots.append(slot)
+            self._rebalance(config)
+        try:
+            yield slot
+        finally:
+            with self._lock:
+                self._slots.remove(slot)
+                self._rebalance(config)
+
+
+_budget = BandwidthBudget()
+
+
+def bandwidth_slot(config: dict):
+    """
+    在进程级带宽预算中登记一个下载，返回上下文管理器，产出该下载的BandwidthSlot。
+    """
+    return _budget.slot(config)
@@ -1,72 +1,268 @@
+import hashlib
+import html
 import json
 import logging
-import subprocess
+import os
+import re
 import time
-from typing import Dict, List
+import xml.etree.ElementTree as ET
+from typing import Callable, Dict, List, Optional
 
+from src.config.config_reader import get_option
+from src.downloader.engine import get_engine
+from src.downloader.http_client import http_get
+from src.downloader.rate_limiter import (
+    MEMBERS_ONLY,
+    PERMANENT_FAILURES,
+    THROTTLED,
+    THROTTLING_FAILURES,
+    RequestsCancelled,
+    classify_failure,
+    classify_video_failures,
+    youtube_request,
+)
 from src.utils.utils import add_cookies_to_cmd
 
 logger = logging.getLogger(__name__)
 
+# 频道上传订阅源（Atom，包含最近约15个视频），按UC开头的频道ID访问
+FEED_URL = "https://www.youtube.com/feeds/videos.xml?channel_id={}"
+FEED_NS = {"atom": "http://www.w3.org/2005/Atom", "yt": "http://www.youtube.com/xml/schemas/2015"}
+# 频道主页（按handle），用于解析UC开头的频道ID
+CHANNEL_PAGE_URL = "https://www.youtube.com/{}"
+UC_ID_RE = re.compile(r"^UC[0-9A-Za-z_-]{22}$")
+CANONICAL_RE = re.compile(r'<link rel="canonical" href="https://www\.youtube\.com/channel/(UC[0-9A-Za-z_-]{22})"')
+OG_TITLE_RE = re.compile(r'<meta property="og:title" content="([^"]*)"')
 
-def get_videos(channel_id: str, is_first: bool, config: dict) -> List[Dict[str, str]]:
+
+def channel_videos_url(channel_id: str) -> str:
+    """
+    返回频道视频列表页URL：UC开头的频道ID直接按ID访问（无需解析handle），否则按handle访问。
+    """
+    if UC_ID_RE.match(channel_id):
+        return f"https://www.youtube.com/channel/{channel_id}/videos"
+    if channel_id.startswith("@"):
+        return f"https://www.youtube.com/{channel_id}/videos"
+    # 纯handle名，自动添加@
+    return f"https://www.youtube.com/@{channel_id}/videos"
+
+
+def resolve_channel(channel_id: str, config: dict) -> Optional[Dict[str, str]]:
+    """
+    请求频道主页，解析handle对应的UC开头频道ID和频道名，返回 {"uc_id", "uploader"}。
+    请求或解析失败返回None（扫描时可再从yt-dlp输出中获得UC ID）。
+    """
+    handle = channel_id if channel_id.startswith("@") else f"@{channel_id}"
+    # 网络异常穿过youtube_request只释放探测资格，不能当作成功请求关闭熔断
+    try:
+        with youtube_request(config) as request:
+            status, _, body = http_get(CHANNEL_PAGE_URL.format(handle), config["proxy"])
+            if status == 429:
+                request.failure = THROTTLED
+    except RequestsCancelled:
+        raise
+    except Exception as e:
+        logger.warning(f"解析频道 {channel_id} 失败: {e}")
+        return None
+    page = body.decode("utf-8", errors="replace")
+    match = CANONICAL_RE.search(page) if status == 200 else None
+    if not match:
+        logger.warning(f"解析频道 {channel_id} 失败: HTTP {status}，未找到频道ID")
+        return None
+    title = OG_TITLE_RE.search(page)
+    return {"uc_id": match.group(1), "uploader": html.unescape(title.group(1)) if title else None}
+
+
+def parse_video_line(line: str, channel_id: str, flat: bool = False) -> Optional[Dict[str, str]]:
+    """
+    解析一行--dump-json输出，只保留用到的字段，其余字段随即丢弃。
+    channel_uc_id为UC开头的频道ID（用于订阅源检查，可能为空）。
+    flat=True时解析--flat-playlist的条目（_type为url，通常没有upload_date）。
+    非视频条目或JSON错误返回None。
     """
-    使用yt-dlp查询频道最近视频元数据。
+    try:
+        video_info = json.loads(line)
+    except json.JSONDecodeError as e:
+        logger.warning(f"JSON解析错误 for 频道 {channel_id}: {e}")
+        return None
+    if video_info.get("_type") != ("url" if flat else "video"):
+        return None
+    return {
+        "video_id": video_info.get("id") or "",
+        "title": (video_info.get("title") or "").replace("/", "_").replace("\\", "_"),  # 清理文件名
+        "upload_date": video_info.get("upload_date") or "",  # YYYYMMDD
+        "channel_name": (video_info.get("uploader") or "").replace("/", "_").replace("\\", "_"),
+        "channel_uc_id": video_info.get("channel_id") or video_info.get("playlist_channel_id") or "",
+    }
+
+
+def feed_url(channel_uc_id: str) -> str:
+    """
+    返回频道上传订阅源的URL（也是HTTP缓存的键）。
+    """
+    return FEED_URL.format(channel_uc_id)
+
+
+def fetch_feed(channel_uc_id: str, config: dict, cached: Optional[Dict[str, str]] = None) -> Optional[Dict]:
+    """
+    请求频道上传订阅源（一次普通HTTP请求，代替启动yt-dlp）。
+    cached为上次保存的缓存项时带If-None-Match/If-Modified-Since发送条件请求。
+    返回 {"url", "videos", "etag", "last_modified", "body_hash", "unchanged"}：
+    videos为最近视频列表（最新在前，字段与parse_video_line一致）；body_hash为视频ID列表的哈希
+    （订阅源正文含随时变化的播放数，不适合整体哈希）；304或body_hash与缓存一致时unchanged为True。
+    请求或解析失败返回None，由调用方回退到yt-dlp扫描。
+    """
+    url = feed_url(channel_uc_id)
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+    try:
+        with youtube_request(config) as request:
+            status, response_headers, body = http_get(url, config["proxy"], headers)
+            if status == 429:
+                request.failure = THROTTLED
+    except RequestsCancelled:
+        raise
+    except Exception as e:
+        logger.warning(f"获取频道 {channel_uc_id} 订阅源失败: {e}")
+        return None
+    if status == 304 and cached:
+        return {
+            "url": url,
+            "videos": [],
+            "etag": cached.get("etag"),
+            "last_modified": cached.get("last_modified"),
+            "body_hash": cached.get("body_hash"),
+            "unchanged": True,
+        }
+    if status != 200:
+        logger.warning(f"获取频道 {channel_uc_id} 订阅源失败: HTTP {status}")
+        return None
+    try:
+        root = ET.fromstring(body)
+    except ET.ParseError as e:
+        logger.warning(f"解析频道 {channel_uc_id} 订阅源失败: {e}")
+        return None
+
+    videos = []
+    for entry in root.findall("atom:entry", FEED_NS):
+        video_id = entry.findtext("yt:videoId", "", FEED_NS)
+        if not video_id:
+            continue
+        videos.append({
+            "video_id": video_id,
+            "title": entry.findtext("atom:title", "", FEED_NS).replace("/", "_").replace("\\", "_"),
+            "upload_date": entry.findtext("atom:published", "", FEED_NS)[:10].replace("-", ""),  # YYYYMMDD
+            "channel_name": entry.findtext("atom:author/atom:name", "", FEED_NS).replace("/", "_").replace("\\", "_"),
+            "channel_uc_id": channel_uc_id,
+        })
+
+    headers = {key.lower(): value for key, value in response_headers.items()}
+    body_hash = hashlib.sha1("\n".join(video["video_id"] for video in videos).encode("utf-8")).hexdigest()
+    return {
+        "url": url,
+        "videos": videos,
+        "etag": headers.get("etag"),
+        "last_modified": headers.get("last-modified"),
+        "body_hash": body_hash,
+        "unchanged": bool(cached) and cached.get("body_hash") == body_hash,
+    }
+
+
+def save_info_json(line: str, video_id: str, info_dir: str) -> str:
+    """
+    把扫描得到的完整info JSON原样写入info_dir/{video_id}.info.json，供下载阶段--load-info-json复用。
+    返回文件路径。
+    """
+    os.makedirs(info_dir, exist_ok=True)
+    path = os.path.join(info_dir, f"{video_id}.info.json")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(line)
+    return path
+
+
+def get_videos(
+    channel_id: str,
+    is_first: bool,
+    config: dict,
+    stop_at: Optional[Callable[[Dict[str, str]], bool]] = None,
+    info_dir: Optional[str] = None,
+    failures: Optional[Dict[str, str]] = None,
+) -> List[Dict[str, str]]:
+    """
+    使用yt-dlp查询频道最近视频元数据。channel_id可以是handle或UC开头的频道ID。
     查询最近config['query_limit']个视频，如果is_first则返回前config['first_run_limit']个。
     返回列表，按上传日期降序（最新在前）。
+    stop_at(video)返回True时（到达已知视频）立即停止读取列表并终止yt-dlp进程，
+    该视频及更早的视频不再返回；首次运行读满first_run_limit个后同样提前停止。
+    config['listing_mode']为"flat"时只做--flat-playlist轻量列举，返回的条目只有
+    video_id/title可靠，新视频的完整元数据需再用fetch_video_metadata获取。
+    指定info_dir时（非flat模式），返回视频的完整info JSON写入该目录，路径记在video['info_json']。
+    指定failures时，列表中不可用的视频（会员/私享/已删除等）的原因写入failures {video_id: 原因}。
     """
-    if channel_id.startswith("@"):
-        url = f"https://www.youtube.com/{channel_id}/videos"
-    else:
-        # 纯handle名，自动添加@
-        url = f"https://www.youtube.com/@{channel_id}/videos"
+    flat = get_option(config, "listing_mode") == "flat"
+    url = channel_videos_url(channel_id)
     cmd = [
         "yt-dlp",
         "--playlist-end",
         str(config["query_limit"]),
         "--proxy",
         config["proxy"],
+        "--lazy-playlist",
         "--dump-json",
         url,
     ]
+    if flat:
+        cmd.insert(-1, "--flat-playlist")
 
     add_cookies_to_cmd(cmd)
 
-    videos = []
     max_retries = config["max_retries"]
     for attempt in range(max_retries):
-        result = subprocess.run(cmd, capture_output=True, text=True, check=False)
-        output = result.stdout.strip()
-        if result.returncode != 0:
-            logger.warning(f"查询频道 {channel_id} 尝试 {attempt + 1} returncode {result.returncode}: {result.stderr}")
-            # 即使returncode != 0，也尝试解析stdout (可能有有效JSON)
-            if "This video is available to this channel's members" in result.stderr:
+        videos = []
+        stopped = False
+        with youtube_request(config) as request:
+            stream = get_engine(config).stream_json(cmd)
+            try:
+                for line in stream:
+                    video = parse_video_line(line, channel_id, flat)
+                    if not video:
+                        continue
+                    if stop_at is not None and stop_at(video):
+                        logger.info(f"频道 {channel_id} 到达已知视频 {video['video_id']}，停止读取列表")
+                        stopped = True
+                        break
+                    if info_dir and not flat:
+                        video["info_json"] = save_info_json(line, video["video_id"], info_dir)
+                    videos.append(video)
+                    if is_first and len(videos) >= config["first_run_limit"]:
+                        stopped = True
+                        break
+            finally:
+                stream.close()
+            if not stopped and stream.returncode != 0:
+                request.failure = classify_failure(stream.stderr)
+                if failures is not None:
+                    failures.update(classify_video_failures(stream.stderr))
+
+        if not stopped and stream.returncode != 0:
+            logger.warning(f"查询频道 {channel_id} 尝试 {attempt + 1} returncode {stream.returncode}: {stream.stderr}")
+            # 即使returncode != 0，也使用已解析的stdout (可能有有效JSON)
+            if request.failure == MEMBERS_ONLY:
                 logger.info(f"频道 {channel_id} 存在会员视频，但继续解析可用视频。")
-                attempt = max_retries  # 不再重试
-            if attempt < max_retries - 1:
+            elif request.failure in PERMANENT_FAILURES:
+                logger.info(f"频道 {channel_id} 存在不可用视频（{request.failure}），但继续解析可用视频。")
+            elif request.failure in THROTTLING_FAILURES:
+                # 熔断由请求协调器统一处理，本轮不再重试该频道
+                logger.warning(f"查询频道 {channel_id} 被限流（{request.failure}），使用已解析的视频")
+            elif attempt < max_retries - 1:
                 time.sleep(2**attempt)  # 指数退避
                 continue
-            else:  # 最终失败，但仍解析当前output
+            else:  # 最终失败，但仍使用当前output
                 logger.error(f"查询频道 {channel_id} 最终失败。此错误可能由于 yt-dlp 未更新导致，请运行 'yt-dlp -U' 更新版本。")
-        else:  # 成功
-            if not output:
-                break
-
-        for line in output.split("\n"):
-            if line.strip():
-                try:
-                    video_info = json.loads(line)
-                    if video_info.get("_type") == "video":
-                        video = {
-                            "video_id": video_info.get("id", ""),
-                            "title": video_info.get("title", "").replace("/", "_").replace("\\", "_"),  # 清理文件名
-                            "upload_date": video_info.get("upload_date", ""),  # YYYYMMDD
-                            "channel_name": video_info.get("uploader", "").replace("/", "_").replace("\\", "_"),
-                        }
-                        videos.append(video)
-                except json.JSONDecodeError as e:
-                    logger.warning(f"JSON解析错误 for 频道 {channel_id}: {e}")
-                    continue
 
         # 应用首次限制
         if is_first:
@@ -75,3 +271,66 @@ def get_videos(channel_id: str, is_first: bool, config: dict) -> List[Dict[str,
         return videos
 
     return []
+
+
+def fetch_video_metadata(
+    video_ids: List[str],
+    channel_id: str,
+    config: dict,
+    info_dir: Optional[str] = None,
+    failures: Optional[Dict[str, str]] = None,
+) -> List[Dict[str, str]]:
+    """
+    获取指定视频的完整元数据（两阶段扫描的第二阶段，只对排重后的新视频调用）。
+    一次yt-dlp调用处理全部ID；失败时只对缺失的ID重试。返回顺序与video_ids一致，
+    始终取不到元数据的视频（如会员/私享视频）被丢弃。
+    指定info_dir时完整info JSON写入该目录，路径记在video['info_json']。
+    指定failures时，不可用视频的原因写入failures {video_id: 原因}。
+    """
+    found = {}
+    max_retries = config["max_retries"]
+    for attempt in range(max_retries):
+        missing = [video_id for video_id in video_ids if video_id not in found]
+        if not missing:
+            break
+        cmd = [
+            "yt-dlp",
+            "--proxy",
+            config["proxy"],
+            "--no-playlist",
+            "--dump-json",
+        ] + [f"https://www.youtube.com/watch?v={video_id}" for video_id in missing]
+        add_cookies_to_cmd(cmd)
+
+        with youtube_request(config) as request:
+            stream = get_engine(config).stream_json(cmd)
+            try:
+                for line in stream:
+                    video = parse_video_line(line, channel_id)
+                    if video:
+                        if info_dir:
+                            video["info_json"] = save_info_json(line, video["video_id"], info_dir)
+                        found[video["video_id"]] = video
+            finally:
+                stream.close()
+            if stream.returncode != 0:
+                request.failure = classify_failure(stream.stderr)
+                if failures is not None:
+                    failures.update(classify_video_failures(stream.stderr))
+
+        if stream.returncode == 0:
+            break
+        logger.warning(f"获取频道 {channel_id} 视频元数据 尝试 {attempt + 1} returncode {stream.returncode}: {stream.stderr}")
+        if request.failure in PERMANENT_FAILURES:
+            logger.info(f"频道 {channel_id} 存在无法获取的视频（{request.failure}），跳过。")
+            break
+        if request.failure in THROTTLING_FAILURES:
+            logger.warning(f"获取频道 {channel_id} 视频元数据被限流（{request.failure}），本轮不再重试")
+            break
+        if attempt < max_retries - 1:
+            time.sleep(2**attempt)  # 指数退避
+
+    missing = [video_id for video_id in video_ids if video_id not in found]
+    if missing:
+        logger.error(f"频道 {channel_id} 以下视频无法获取元数据: {', '.join(missing)}")
+    return [found[video_id] for video_id in video_ids if video_id in found]
@@ -0,0 +1,328 @@
+import logging
+import queue
+import subprocess
+import tempfile
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from src.config.config_reader import get_option
+
+logger = logging.getLogger(__name__)
+
+# 运行中的yt-dlp子进程，停止时由terminate_processes()统一终止
+_live_procs = set()
+_live_procs_lock = threading.Lock()
+
+
+def _spawn(cmd: List[str], **kwargs) -> subprocess.Popen:
+    proc = subprocess.Popen(cmd, **kwargs)
+    with _live_procs_lock:
+        _live_procs.add(proc)
+    return proc
+
+
+def _reap(proc: subprocess.Popen) -> int:
+    try:
+        proc.wait()
+        return proc.returncode
+    finally:
+        with _live_procs_lock:
+            _live_procs.discard(proc)
+
+
+def terminate_processes() -> int:
+    """
+    终止所有仍在运行的yt-dlp子进程（收到停止信号时调用），返回终止的进程数。
+    等待这些进程的线程随之返回，进程内引擎的调用不受影响。
+    """
+    with _live_procs_lock:
+        procs = [proc for proc in _live_procs if proc.poll() is None]
+    for proc in procs:
+        proc.kill()
+    return len(procs)
+
+
+class JsonLineStream:
+    """
+    以Popen流式读取yt-dlp --dump-json输出，逐行产出（不在内存中缓冲完整stdout）。
+    stderr由后台线程读取以免管道写满阻塞子进程；close()时若子进程仍在运行则终止它。
+    returncode与stderr在close()之后可用。
+    """
+
+    def __init__(self, cmd: List[str]):
+        self.proc = _spawn(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, encoding="utf-8", errors="replace"
+        )
+        self._stderr_lines = []
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, daemon=True)
+        self._stderr_thread.start()
+        self.returncode = None
+
+    def _drain_stderr(self) -> None:
+        for line in self.proc.stderr:
+            self._stderr_lines.append(line)
+
+    def __iter__(self) -> Iterator[str]:
+        for line in self.proc.stdout:
+            line = line.strip()
+            if line:
+                yield line
+
+    @property
+    def stderr(self) -> str:
+        return "".join(self._stderr_lines)
+
+    def close(self) -> None:
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.returncode = _reap(self.proc)
+        self.proc.stdout.close()
+        self._stderr_thread.join()
+
+
+class SubprocessEngine:
+    """
+    每次调用启动一个yt-dlp命令行进程（原有行为）。
+    """
+
+    name = "subprocess"
+
+    def stream_json(self, cmd: List[str]) -> JsonLineStream:
+        return JsonLineStream(cmd)
+
+    def run(self, cmd: List[str], slot=None, errors: Optional[List[str]] = None) -> int:
+        """
+        执行yt-dlp命令并返回returncode。errors不为None时stderr写入临时文件，结束后追加到errors
+        （用于失败原因分类）。子进程的限速在启动时由命令中的--limit-rate确定。
+        """
+        if errors is None:
+            return _reap(_spawn(cmd))
+        with tempfile.TemporaryFile("w+", encoding="utf-8", errors="replace") as stderr:
+            returncode = _reap(_spawn(cmd, stderr=stderr))
+            stderr.seek(0)
+            errors.append(stderr.read())
+        return returncode
+
+
+def _split_cmd(cmd: List[str]) -> Tuple[object, Tuple[str, ...]]:
+    """
+    把yt-dlp命令解析为ydl参数，并生成实例复用的键（去掉URL、输出模板、info JSON路径和限速，按次设置）。
+    """
+    import yt_dlp
+
+    parsed = yt_dlp.parse_options(cmd[1:])
+    args = cmd[1:]
+    key = []
+    skip_next = False
+    for arg in args:
+        if skip_next:
+            skip_next = False
+            continue
+        if arg in ("-o", "--output", "--load-info-json", "-r", "--limit-rate"):
+            skip_next = True
+            continue
+        if arg in parsed.urls:
+            continue
+        key.append(arg)
+    return parsed, tuple(key)
+
+
+class InProcessJsonStream:
+    """
+    在后台线程中用复用的YoutubeDL实例执行--dump-json提取，逐行产出JSON（与子进程输出格式一致）。
+    close()后实例在下一个条目输出时中止提取并归还实例池。
+    """
+
+    _DONE = object()
+
+    def __init__(self, engine: "InProcessEngine", cmd: List[str]):
+        self._engine = engine
+        self._parsed, self._key = _split_cmd(cmd)
+        self._lines = queue.Queue()
+        self._stderr_lines = []
+        self._closed = False
+        self.returncode = None
+        self._thread = threading.Thread(target=self._run, name=f"{threading.current_thread().name}-ydl", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        from yt_dlp.utils import DownloadError
+
+        ydl = self._engine.checkout(self._key, self._parsed.ydl_opts)
+        ydl.sink = self
+        try:
+            self.returncode = ydl.download(self._parsed.urls)
+        except _StreamClosed:
+            self.returncode = -9
+        except DownloadError:
+            self.returncode = 1
+        except Exception as e:
+            self._stderr_lines.append(f"ERROR: {e}\n")
+            self.returncode = 1
+        finally:
+            ydl.sink = None
+            self._engine.checkin(self._key, ydl)
+            self._lines.put(self._DONE)
+
+    def on_stdout(self, message: str) -> None:
+        if self._closed:
+            raise _StreamClosed("stream closed")
+        self._lines.put(message)
+
+    def on_stderr(self, message: str) -> None:
+        self._stderr_lines.append(f"{message}\n")
+
+    def __iter__(self) -> Iterator[str]:
+        while True:
+            line = self._lines.get()
+            if line is self._DONE:
+                return
+            line = line.strip()
+            if line:
+                yield line
+
+    @property
+    def stderr(self) -> str:
+        return "".join(self._stderr_lines)
+
+    def close(self) -> None:
+        self._closed = True
+        self._thread.join()
+
+
+class _StderrCollector:
+    """
+    只收集stderr的sink（stdout照常输出）。
+    """
+
+    def __init__(self, errors: List[str]):
+        self._errors = errors
+
+    def on_stderr(self, message: str) -> None:
+        self._errors.append(f"{message}\n")
+
+
+def _stream_closed_class():
+    """
+    创建继承自yt-dlp DownloadCancelled的中止异常：它不会被yt-dlp的提取错误处理吞掉，
+    能中止整个列表提取。延迟创建使未安装yt_dlp模块时subprocess引擎仍可用。
+    """
+    from yt_dlp.utils import DownloadCancelled
+
+    class StreamClosed(DownloadCancelled):
+        msg = "stream closed"
+
+    return StreamClosed
+
+
+_StreamClosed = None
+
+
+def _make_capturing_ydl_class():
+    import yt_dlp
+
+    global _StreamClosed
+    _StreamClosed = _stream_closed_class()
+
+    class CapturingYoutubeDL(yt_dlp.YoutubeDL):
+        """
+        stdout/stderr输出在设置了sink时转交sink（sink没有on_stdout时stdout照常输出），未设置时保持原样输出。
+        """
+
+        sink = None
+
+        def to_stdout(self, message, skip_eol=False, quiet=None):
+            if self.sink is not None and hasattr(self.sink, "on_stdout"):
+                self.sink.on_stdout(message)
+            else:
+                super().to_stdout(message, skip_eol, quiet)
+
+        def to_stderr(self, message, only_once=False):
+            if self.sink is not None:
+                self.sink.on_stderr(message)
+            else:
+                super().to_stderr(message, only_once)
+
+    return CapturingYoutubeDL
+
+
+class InProcessEngine:
+    """
+    基于yt_dlp.YoutubeDL API的进程内引擎：省去每次调用的解释器启动和提取器加载。
+    按参数（不含URL/输出模板）缓存预热过的YoutubeDL实例池，跨调用复用实例及其缓存；
+    同一实例同一时刻只被一个线程使用。
+    """
+
+    name = "inprocess"
+
+    def __init__(self):
+        self._ydl_class = _make_capturing_ydl_class()
+        self._idle: Dict[Tuple[str, ...], List[object]] = {}
+        self._lock = threading.Lock()
+
+    def checkout(self, key: Tuple[str, ...], ydl_opts: dict):
+        with self._lock:
+            instances = self._idle.get(key)
+            ydl = instances.pop() if instances else None
+        if ydl is None:
+            ydl = self._ydl_class(ydl_opts)
+        else:
+            # 复用实例：换上本次的输出模板和限速，并清零上次调用残留的返回码/计数
+            ydl.params["outtmpl"] = dict(ydl_opts.get("outtmpl") or {})
+            ydl.params["ratelimit"] = ydl_opts.get("ratelimit")
+            ydl._parse_outtmpl()
+            ydl._download_retcode = 0
+            ydl._num_downloads = 0
+        return ydl
+
+    def checkin(self, key: Tuple[str, ...], ydl) -> None:
+        with self._lock:
+            self._idle.setdefault(key, []).append(ydl)
+
+    def stream_json(self, cmd: List[str]) -> InProcessJsonStream:
+        return InProcessJsonStream(self, cmd)
+
+    def run(self, cmd: List[str], slot=None, errors: Optional[List[str]] = None) -> int:
+        """
+        slot为带宽预算中的BandwidthSlot时，下载期间份额的变化即时作用于该实例。
+        errors不为None时收集yt-dlp的错误输出。
+        """
+        from yt_dlp.utils import DownloadError
+
+        parsed, key = _split_cmd(cmd)
+        ydl = self.checkout(key, parsed.ydl_opts)
+        if slot is not None:
+            slot.attach(ydl)
+        if errors is not None:
+            ydl.sink = _StderrCollector(errors)
+        try:
+            if parsed.options.load_info_filename:
+                return ydl.download_with_info_file(parsed.options.load_info_filename)
+            return ydl.download(parsed.urls)
+        except DownloadError as e:
+            logger.warning(f"yt-dlp 执行失败: {e}")
+            if errors is not None:
+                errors.append(f"{e}\n")
+            return 1
+        finally:
+            ydl.sink = None
+            if slot is not None:
+                slot.detach()
+            self.checkin(key, ydl)
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(config: dict):
+    """
+    按config['engine']返回进程级共享的yt-dlp引擎（"subprocess"或"inprocess"）。
+    """
+    name = get_option(config, "engine")
+    with _engines_lock:
+        engine = _engines.get(name)
+        if engine is None:
+            engine = InProcessEngine() if name == "inprocess" else SubprocessEngine()
+            _engines[name] = engine
+        return engine
@@ -0,0 +1,43 @@
+import threading
+from typing import Dict, Optional, Tuple
+
+# 轻量HTTP请求（订阅源等）的超时秒数
+HTTP_TIMEOUT_SEC = 15
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _get_client(proxy: str):
+    """
+    按代理返回进程级共享的YoutubeDL实例，只用其网络层（支持socks代理）。
+    安装requests时yt-dlp使用requests处理器，连接在多次请求间复用（连接池）。
+    """
+    import yt_dlp
+
+    with _clients_lock:
+        client = _clients.get(proxy)
+        if client is None:
+            client = yt_dlp.YoutubeDL({"proxy": proxy, "quiet": True, "no_warnings": True, "socket_timeout": HTTP_TIMEOUT_SEC})
+            _clients[proxy] = client
+        return client
+
+
+def http_get(url: str, proxy: str, headers: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, str], bytes]:
+    """
+    经配置的代理发送GET请求，返回 (状态码, 响应头, 响应体)。
+    HTTP错误状态（如304/404）不抛异常，以状态码返回且响应体为空；网络错误抛出yt-dlp的RequestError。
+    """
+    from yt_dlp.networking import Request
+    from yt_dlp.networking.exceptions import HTTPError
+
+    try:
+        response = _get_client(proxy).urlopen(Request(url, headers=headers or {}))
+    except HTTPError as e:
+        status, response_headers = e.status, dict(e.response.headers)
+        e.response.close()
+        return status, response_headers, b""
+    try:
+        return response.status, dict(response.headers), response.read()
+    finally:
+        response.close()
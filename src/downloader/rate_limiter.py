@@ -0,0 +1,214 @@
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from src.config.config_reader import get_option
+
+logger = logging.getLogger(__name__)
+
+# yt-dlp失败原因（由stderr分类），None表示未识别（按临时错误重试）
+THROTTLED = "throttled"
+BOT_CHECK = "bot_check"
+MEMBERS_ONLY = "members_only"
+PRIVATE = "private"
+REGION_BLOCKED = "region_blocked"
+UPCOMING = "upcoming"
+REMOVED = "removed"
+
+# 按顺序匹配：限流/机器人验证优先于具体视频的不可用原因
+FAILURE_PATTERNS = [
+    # "Video unavailable. This content isn't available, try again later." 是YouTube对本机的限流回复，不是视频被删除
+    (THROTTLED, re.compile(r"HTTP Error 429|Too Many Requests|rate.?limit|content isn.t available, try again later", re.I)),
+    (BOT_CHECK, re.compile(r"confirm you.re not a bot", re.I)),
+    (MEMBERS_ONLY, re.compile(r"available to this channel's members|members.only|Join this channel", re.I)),
+    (PRIVATE, re.compile(r"Private video|This video is private", re.I)),
+    (REGION_BLOCKED, re.compile(r"not (made this video )?available in your country|geo.?restrict", re.I)),
+    (UPCOMING, re.compile(r"Premieres in|Premiere will begin|live event will begin|This live event", re.I)),
+    (REMOVED, re.compile(r"video has been removed|account associated with this video has been terminated", re.I)),
+]
+
+# 需要全局退避的失败：YouTube对本机IP/账号限流
+THROTTLING_FAILURES = (THROTTLED, BOT_CHECK)
+# 同一视频重试也不会成功的失败
+PERMANENT_FAILURES = (MEMBERS_ONLY, PRIVATE, REGION_BLOCKED, UPCOMING, REMOVED)
+
+# 视频不可用的负缓存有效期（秒），None表示永久：已删除的视频几乎不会恢复，但误判（如限流回复的措辞变化）
+# 代价很高，仍按30天过期；首映/直播很快就能下载；会员/私享/地区限制可能因更换cookies或代理、作者改设置而恢复
+UNAVAILABLE_TTL_SEC = {
+    REMOVED: 30 * 86400,
+    UPCOMING: 3600,
+    MEMBERS_ONLY: 7 * 86400,
+    PRIVATE: 7 * 86400,
+    REGION_BLOCKED: 7 * 86400,
+}
+
+# yt-dlp单个视频的错误行，如 "ERROR: [youtube] dQw4w9WgXcQ: Private video"
+VIDEO_ERROR_LINE = re.compile(r"^ERROR: \[[^\]]+\] ([\w-]{11}): (.*)$", re.M)
+
+# 熔断后暂停所有请求的时长：首次BACKOFF_BASE_SEC，连续限流时加倍，最长BACKOFF_MAX_SEC
+BACKOFF_BASE_SEC = 60
+BACKOFF_MAX_SEC = 3600
+
+
+def classify_failure(stderr: str) -> Optional[str]:
+    """
+    按yt-dlp的stderr判断失败原因，未识别时返回None。
+    """
+    for kind, pattern in FAILURE_PATTERNS:
+        if pattern.search(stderr or ""):
+            return kind
+    return None
+
+
+def classify_video_failures(stderr: str) -> Dict[str, str]:
+    """
+    从一次处理多个视频的yt-dlp的stderr中逐个视频识别不可用原因，返回 {video_id: 原因}（只含PERMANENT_FAILURES）。
+    """
+    failures = {}
+    for video_id, message in VIDEO_ERROR_LINE.findall(stderr or ""):
+        kind = classify_failure(message)
+        if kind in PERMANENT_FAILURES:
+            failures[video_id] = kind
+    return failures
+
+
+class RequestsCancelled(Exception):
+    """
+    进程停止时，等待准入的请求被取消。
+    """
+
+
+class YoutubeRequest:
+    """
+    一次已准入的请求；调用方在请求失败时把failure设为classify_failure的结果。
+    """
+
+    def __init__(self):
+        self.failure: Optional[str] = None
+
+
+class RequestCoordinator:
+    """
+    进程级YouTube请求协调器，所有扫描/下载线程共享：
+    令牌桶按request_rate_per_min匀速准入（允许request_burst个突发）；
+    任一请求遇到限流或机器人验证时熔断，所有请求暂停，暂停时长在连续限流时加倍。
+    暂停结束后只放行一个探测请求，成功才恢复正常准入，失败则继续熔断。
+    """
+
+    def __init__(self, rate_per_min: float, burst: int):
+        self.rate_per_sec = rate_per_min / 60
+        self.burst = burst
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._open_until = 0.0
+        self._backoff = 0.0
+        self._probing = False
+        self._cancelled = False
+        self._cond = threading.Condition()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate_per_sec)
+        self._refilled_at = now
+
+    def admit(self) -> bool:
+        """
+        阻塞到可以发送请求，返回本次是否为熔断后的探测请求。
+        """
+        with self._cond:
+            while True:
+                if self._cancelled:
+                    raise RequestsCancelled("请求已取消")
+                now = time.monotonic()
+                if now < self._open_until:
+                    self._cond.wait(self._open_until - now)
+                    continue
+                if self._probing:
+                    self._cond.wait()
+                    continue
+                self._refill(now)
+                if self._tokens < 1:
+                    self._cond.wait((1 - self._tokens) / self.rate_per_sec)
+                    continue
+                self._tokens -= 1
+                probe = self._backoff > 0
+                self._probing = probe
+                return probe
+
+    def report(self, probe: bool, failure: Optional[str]) -> None:
+        """
+        报告请求结果。限流类失败打开熔断；探测请求成功时关闭熔断。
+        其余结果不改变熔断状态。
+        """
+        with self._cond:
+            if probe:
+                self._probing = False
+            if failure in THROTTLING_FAILURES:
+                self._backoff = min(self._backoff * 2, BACKOFF_MAX_SEC) if self._backoff else BACKOFF_BASE_SEC
+                self._open_until = time.monotonic() + self._backoff
+                logger.warning(f"YouTube限流（{failure}），暂停所有请求 {self._backoff:.0f} 秒")
+            elif probe:
+                logger.info("YouTube请求恢复正常")
+                self._backoff = 0.0
+            self._cond.notify_all()
+
+    def release(self, probe: bool) -> None:
+        """
+        请求未完成（出现异常）时释放探测资格，不改变熔断状态。
+        """
+        with self._cond:
+            if probe:
+                self._probing = False
+            self._cond.notify_all()
+
+    def cancel(self) -> None:
+        """
+        取消所有等待中的和之后的请求（进程停止时）。
+        """
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify_all()
+
+    @contextmanager
+    def request(self) -> Iterator[YoutubeRequest]:
+        probe = self.admit()
+        request = YoutubeRequest()
+        try:
+            yield request
+        except BaseException:
+            self.release(probe)
+            raise
+        self.report(probe, request.failure)
+
+
+_coordinator: Optional[RequestCoordinator] = None
+_coordinator_lock = threading.Lock()
+
+
+def get_coordinator(config: dict) -> RequestCoordinator:
+    """
+    返回进程级共享的请求协调器（首次调用时按config创建）。
+    """
+    global _coordinator
+    with _coordinator_lock:
+        if _coordinator is None:
+            _coordinator = RequestCoordinator(get_option(config, "request_rate_per_min"), get_option(config, "request_burst"))
+        return _coordinator
+
+
+def youtube_request(config: dict):
+    """
+    经请求协调器准入一次YouTube请求，返回上下文管理器，产出YoutubeRequest。
+    """
+    return get_coordinator(config).request()
+
+
+def cancel_requests() -> None:
+    """
+    进程停止时取消等待准入的请求。
+    """
+    with _coordinator_lock:
+        if _coordinator is not None:
+            _coordinator.cancel()
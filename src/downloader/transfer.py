@@ -0,0 +1,120 @@
+import errno
+import hashlib
+import logging
+import os
+import time
+
+from src.config.config_reader import get_option
+
+logger = logging.getLogger(__name__)
+
+# 跨文件系统复制（如到SMB/UNC共享）的块大小：大块读写减少网络往返
+TRANSFER_CHUNK_SIZE = 8 * 1024 * 1024
+
+# copy_file_range不适用于这对文件时的错误码，此时回退到分块复制
+_OFFLOAD_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, getattr(errno, "ENOTSUP", errno.EOPNOTSUPP)}
+
+
+def _copy_offload(src: str, dst: str) -> bool:
+    """
+    用copy_file_range在内核中复制（CIFS/NFS等支持时由服务器端完成，数据不经过本进程），
+    平台或文件系统不支持时返回False。
+    """
+    if not hasattr(os, "copy_file_range"):
+        return False
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            while os.copy_file_range(fsrc.fileno(), fdst.fileno(), TRANSFER_CHUNK_SIZE):
+                pass
+        except OSError as e:
+            if e.errno in _OFFLOAD_UNSUPPORTED:
+                return False
+            raise
+        os.fsync(fdst.fileno())
+    return True
+
+
+def _copy_chunked(src: str, dst: str, digest=None) -> None:
+    """
+    以TRANSFER_CHUNK_SIZE大块复制，digest不为None时同时计算源文件校验和。
+    """
+    buf = bytearray(TRANSFER_CHUNK_SIZE)
+    view = memoryview(buf)
+    with open(src, "rb", buffering=0) as fsrc, open(dst, "wb") as fdst:
+        while True:
+            n = fsrc.readinto(buf)
+            if not n:
+                break
+            fdst.write(view[:n])
+            if digest is not None:
+                digest.update(view[:n])
+        fdst.flush()
+        os.fsync(fdst.fileno())
+
+
+def _file_digest(path: str):
+    digest = hashlib.sha256()
+    buf = bytearray(TRANSFER_CHUNK_SIZE)
+    view = memoryview(buf)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                return digest
+            digest.update(view[:n])
+
+
+def _copy_verified(src: str, dst: str, checksum: bool) -> None:
+    """
+    复制到dst.part，校验大小（checksum为True时再回读目标校验SHA-256）后重命名为dst。
+    校验失败抛出OSError（按传输错误重试）。
+    """
+    part = dst + ".part"
+    size = os.path.getsize(src)
+    digest = hashlib.sha256() if checksum else None
+    if digest is not None or not _copy_offload(src, part):
+        _copy_chunked(src, part, digest)
+    copied = os.path.getsize(part)
+    if copied != size:
+        raise OSError(f"传输后大小不一致: {copied} != {size}")
+    if digest is not None and _file_digest(part).hexdigest() != digest.hexdigest():
+        raise OSError("传输后校验和不一致")
+    os.replace(part, dst)
+
+
+def transfer_file(src: str, dst: str, config: dict) -> str:
+    """
+    把下载完成的文件传输到目标路径，成功后删除源文件，返回目标路径。
+    同一文件系统时直接重命名；否则（如SMB/UNC共享）分块复制到临时文件，校验后重命名，
+    网络错误按max_retries指数退避重试，仍失败时抛出OSError（源文件保留）。
+    """
+    dst_dir = os.path.dirname(dst)
+    # 为本地目标目录创建目录（UNC路径不创建）
+    if dst_dir and not dst_dir.startswith("\\\\"):
+        os.makedirs(dst_dir, exist_ok=True)
+
+    try:
+        os.replace(src, dst)
+        logger.info(f"文件已移动到目标目录: {dst}")
+        return dst
+    except OSError:
+        if not os.path.exists(src):
+            raise
+        # 跨文件系统（EXDEV）等，改为复制
+
+    checksum = get_option(config, "transfer_checksum")
+    max_retries = config["max_retries"]
+    started = time.monotonic()
+    for attempt in range(max_retries):
+        try:
+            _copy_verified(src, dst, checksum)
+            break
+        except OSError as e:
+            if attempt == max_retries - 1:
+                raise
+            logger.warning(f"传输 {src} 失败（第 {attempt + 1} 次）: {e}，重试")
+            time.sleep(2**attempt)
+    os.remove(src)
+    elapsed = max(time.monotonic() - started, 1e-3)
+    logger.info(f"文件已传输到目标目录: {dst} ({os.path.getsize(dst) / elapsed / 1024 / 1024:.1f} MB/s)")
+    return dst
@@ -1,32 +1,158 @@
+import json
 import logging
 import os
 import shutil
-import subprocess
 import time
-from typing import Optional
+from typing import Dict, List, Optional
 
+from src.downloader.bandwidth import bandwidth_slot
+from src.downloader.engine import get_engine
+from src.downloader.rate_limiter import (
+    PERMANENT_FAILURES,
+    THROTTLING_FAILURES,
+    classify_failure,
+    classify_video_failures,
+    youtube_request,
+)
+from src.downloader.transfer import transfer_file
 from src.utils.utils import add_cookies_to_cmd, sanitize_filename
 
 logger = logging.getLogger(__name__)
 
+# 扫描阶段info JSON中的格式URL会过期，超过此时长不再复用
+INFO_JSON_MAX_AGE_SEC = 4 * 3600
 
-def download_video(video_id: str, channel_name: str, upload_date: str, title: str, config: dict) -> Optional[str]:
+# 持久的下载暂存目录：每个视频一个子目录（staging/<video_id>/），跨检查轮次和重启保留，
+# 未完成的.part文件在下次下载同一视频时续传
+STAGING_DIR = "staging"
+# 暂存子目录中记录视频信息的文件，用于启动时恢复已下载完成但未移走的文件
+STAGING_META = "meta.json"
+# 下载失败时日志中附带的yt-dlp stderr末尾行数
+STDERR_TAIL_LINES = 20
+
+
+def staging_dir(video_id: str) -> str:
+    return os.path.join(STAGING_DIR, video_id)
+
+
+def _staged_file(video_id: str) -> str:
+    """
+    暂存目录中下载完成的文件路径（下载中为.part，合并/转封装完成后才出现）。
+    """
+    return os.path.join(staging_dir(video_id), f"{video_id}.mp4")
+
+
+def _stderr_tail(errors: List[str]) -> str:
+    """
+    收集到的yt-dlp stderr的最后STDERR_TAIL_LINES行，附在失败日志中（stderr已被捕获用于分类，不再输出到控制台）。
+    """
+    lines = [line for line in "".join(errors).splitlines() if line.strip()]
+    return "\n".join(lines[-STDERR_TAIL_LINES:])
+
+
+def _target_file_name(video: dict) -> str:
+    return f"{sanitize_filename(video['channel_name'])}_{video['upload_date']}_{sanitize_filename(video['title'])}.mp4"
+
+
+def stage_video(video: dict, channel_id: str, is_first: bool) -> None:
+    """
+    创建视频的暂存子目录并写入视频信息（下载前调用），供中断后恢复时记录下载结果。
+    """
+    os.makedirs(staging_dir(video["video_id"]), exist_ok=True)
+    meta = {key: video[key] for key in ("video_id", "channel_name", "upload_date", "title")}
+    meta.update(channel_id=channel_id, is_first=is_first)
+    with open(os.path.join(staging_dir(video["video_id"]), STAGING_META), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+
+def transfer_video(video: dict, staged_path: str, config: dict) -> str:
+    """
+    把暂存的完成文件传输到download_dir（按频道/日期/标题命名）并删除该视频的暂存子目录，
+    返回目标文件路径。传输失败抛出OSError，暂存文件保留。
+    """
+    target_file_path = transfer_file(staged_path, os.path.join(config["download_dir"], _target_file_name(video)), config)
+    shutil.rmtree(staging_dir(video["video_id"]), ignore_errors=True)
+    return target_file_path
+
+
+def gc_staging(max_age_sec: float, now: Optional[float] = None) -> int:
+    """
+    删除超过max_age_sec未更新的暂存子目录（放弃的未完成下载），返回删除的目录数。
+    正在下载的视频其.part文件持续更新，不会被删除。
+    """
+    if not os.path.isdir(STAGING_DIR):
+        return 0
+    now = time.time() if now is None else now
+    removed = 0
+    for entry in os.scandir(STAGING_DIR):
+        if not entry.is_dir():
+            continue
+        mtimes = [entry.stat().st_mtime] + [f.stat().st_mtime for f in os.scandir(entry.path) if f.is_file()]
+        if now - max(mtimes) > max_age_sec:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def recover_staging(config: dict) -> List[dict]:
+    """
+    启动时处理上次运行遗留的暂存子目录：已下载完成但未移走的文件（如移动前进程被终止）
+    移动到download_dir，返回其视频信息（含file_path），由调用方记录下载结果；
+    未完成的下载保留，下次下载时续传。
+    """
+    if not os.path.isdir(STAGING_DIR):
+        return []
+    recovered = []
+    for entry in os.scandir(STAGING_DIR):
+        video_id = entry.name
+        meta_path = os.path.join(entry.path, STAGING_META)
+        if not entry.is_dir() or not os.path.exists(_staged_file(video_id)) or not os.path.exists(meta_path):
+            continue
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            meta["file_path"] = transfer_video(meta, _staged_file(video_id), config)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"恢复暂存视频 {video_id} 失败: {e}")
+            continue
+        logger.info(f"已恢复上次中断前下载完成的视频: {meta['file_path']}")
+        recovered.append(meta)
+    return recovered
+
+
+def _limited(cmd: List[str], slot) -> List[str]:
+    """
+    按带宽预算中的份额为yt-dlp命令加上--limit-rate（未设置上限时原样返回）。
+    """
+    return cmd[:1] + slot.limit_args() + cmd[1:]
+
+
+def download_video(
+    video_id: str,
+    channel_name: str,
+    upload_date: str,
+    title: str,
+    config: dict,
+    info_json: Optional[str] = None,
+    transfer: bool = True,
+    failures: Optional[Dict[str, str]] = None,
+) -> Optional[str]:
     """
     下载单个视频到配置的download_dir文件夹。
     支持本地路径和SMB UNC路径 (e.g., \\\\192.168.1.100\\share)。
+    先下载到该视频的暂存子目录（staging/<video_id>/），重试及后续轮次从已有的.part文件续传。
+    info_json为扫描阶段保存的info JSON时，首次尝试用--load-info-json直接下载，
+    跳过页面/播放器/格式的重复解析；失败后的重试回退到视频URL重新提取。
+    transfer=False时下载完成的文件留在暂存目录，返回暂存文件路径，由调用方的传输阶段用transfer_video传输。
+    指定failures时，视频不可用（会员/私享/已删除等）的原因写入failures[video_id]。
     返回文件路径如果成功，否则None。
     """
-    download_dir = config["download_dir"]
-    temp_dir = "temp"
-
-    # 创建临时目录
-    os.makedirs(temp_dir, exist_ok=True)
+    video = {"video_id": video_id, "channel_name": channel_name, "upload_date": upload_date, "title": title}
 
-    # 清理标题用于文件名
-    safe_title = sanitize_filename(title)
-    safe_channel = sanitize_filename(channel_name)
+    # 创建暂存目录（按video_id命名，与批量下载一致，以便互相续传）
+    os.makedirs(staging_dir(video_id), exist_ok=True)
 
-    temp_output_template = os.path.join(temp_dir, f"{safe_channel}_{upload_date}_{safe_title}.%(ext)s")
+    temp_output_template = os.path.join(staging_dir(video_id), f"{video_id}.%(ext)s")
     url = f"https://www.youtube.com/watch?v={video_id}"
     cmd = [
         "yt-dlp",
@@ -38,6 +164,7 @@ def download_video(video_id: str, channel_name: str, upload_date: str, title: st
         "mp4",
         "--no-playlist",
         "--mark-watched",
+        "--continue",
         "-o",
         temp_output_template,
         url,
@@ -45,34 +172,117 @@ def download_video(video_id: str, channel_name: str, upload_date: str, title: st
 
     add_cookies_to_cmd(cmd)
 
+    use_info_json = bool(info_json) and os.path.exists(info_json)
+    if use_info_json and time.time() - os.path.getmtime(info_json) > INFO_JSON_MAX_AGE_SEC:
+        logger.info(f"视频 {video_id} 的info JSON已过期，重新提取")
+        use_info_json = False
+
+    engine = get_engine(config)
     max_retries = config["max_retries"]
     for attempt in range(max_retries):
-        try:
-            result = subprocess.run(cmd, check=True)
-            if result.returncode == 0:
-                # 构建临时文件路径 (假设ext=mp4)
-                temp_file_path = os.path.join(temp_dir, f"{safe_channel}_{upload_date}_{safe_title}.mp4")
-                if os.path.exists(temp_file_path):
-                    # 构建目标文件路径
-                    target_file_path = os.path.join(download_dir, f"{safe_channel}_{upload_date}_{safe_title}.mp4")
-                    
-                    # 为本地目标目录创建目录（UNC路径不创建，由移动处理）
-                    if not download_dir.startswith("\\\\") and not os.path.exists(download_dir):
-                        os.makedirs(download_dir, exist_ok=True)
-                    
-                    # 移动文件到目标目录
-                    shutil.move(temp_file_path, target_file_path)
-                    logger.info(f"文件已移动到目标目录: {target_file_path}")
-                    return target_file_path
-                else:
-                    logger.warning(f"下载成功但临时文件未找到: {temp_file_path}")
-                    return None
-        except subprocess.CalledProcessError as e:
-            if attempt < max_retries - 1:
-                time.sleep(2**attempt)
-                continue
+        attempt_cmd = cmd[:-1] + ["--load-info-json", info_json] if use_info_json and attempt == 0 else cmd
+        errors = []
+        with youtube_request(config) as request, bandwidth_slot(config) as slot:
+            returncode = engine.run(_limited(attempt_cmd, slot), slot=slot, errors=errors)
+            if returncode != 0:
+                request.failure = classify_failure("".join(errors))
+        if returncode == 0:
+            # 构建暂存文件路径 (假设ext=mp4)
+            temp_file_path = _staged_file(video_id)
+            if os.path.exists(temp_file_path):
+                return transfer_video(video, temp_file_path, config) if transfer else temp_file_path
             else:
-                logger.error(f"下载视频 {video_id} 失败: {e}\n此错误可能由于 yt-dlp 未更新导致，请运行 'yt-dlp -U' 更新版本。")
+                logger.warning(f"下载成功但临时文件未找到: {temp_file_path}")
                 return None
+        if request.failure in PERMANENT_FAILURES:
+            logger.error(f"下载视频 {video_id} 失败: 视频不可用（{request.failure}），不再重试")
+            if failures is not None:
+                failures[video_id] = request.failure
+            return None
+        if request.failure in THROTTLING_FAILURES:
+            # 熔断由请求协调器统一处理，未完成的部分保留在暂存目录，下一轮续传
+            logger.error(f"下载视频 {video_id} 失败: YouTube限流（{request.failure}），本轮不再重试")
+            return None
+        if attempt < max_retries - 1:
+            time.sleep(2**attempt)
+            continue
+        else:
+            logger.error(
+                f"下载视频 {video_id} 失败: returncode {returncode}\n{_stderr_tail(errors)}\n"
+                f"此错误可能由于 yt-dlp 未更新导致，请运行 'yt-dlp -U' 更新版本。"
+            )
+            return None
 
     return None
+
+
+def download_videos(
+    videos: List[dict], config: dict, transfer: bool = True, failures: Optional[Dict[str, str]] = None
+) -> Dict[str, Optional[str]]:
+    """
+    批量下载：一次yt-dlp调用下载videos中的全部视频，分摊进程启动和提取器预热开销。
+    文件下载到各视频的暂存子目录，以文件是否产出逐个判断结果；批量调用中未完成的视频
+    逐个回退到download_video（含重试，从已下载的部分续传）；stderr表明不可用的视频不再回退。
+    transfer、failures的含义同download_video。
+    返回 {video_id: 文件路径或None}。
+    """
+    for video in videos:
+        os.makedirs(staging_dir(video["video_id"]), exist_ok=True)
+
+    cmd = [
+        "yt-dlp",
+        "--proxy",
+        config["proxy"],
+        "-f",
+        config["download_format"],
+        "--remux-video",
+        "mp4",
+        "--no-playlist",
+        "--mark-watched",
+        "--continue",
+        "-o",
+        os.path.join(STAGING_DIR, "%(id)s", "%(id)s.%(ext)s"),
+    ] + [f"https://www.youtube.com/watch?v={video['video_id']}" for video in videos]
+
+    add_cookies_to_cmd(cmd)
+
+    # yt-dlp默认单个视频下载出错时继续下载后续视频
+    errors = []
+    with youtube_request(config) as request, bandwidth_slot(config) as slot:
+        returncode = get_engine(config).run(_limited(cmd, slot), slot=slot, errors=errors)
+        if returncode != 0:
+            request.failure = classify_failure("".join(errors))
+    unavailable = classify_video_failures("".join(errors))
+
+    results = {}
+    missing = []
+    for video in videos:
+        video_id = video["video_id"]
+        staged_path = _staged_file(video_id)
+        if os.path.exists(staged_path):
+            results[video_id] = transfer_video(video, staged_path, config) if transfer else staged_path
+        elif video_id in unavailable:
+            logger.error(f"下载视频 {video_id} 失败: 视频不可用（{unavailable[video_id]}），不再重试")
+            results[video_id] = None
+            if failures is not None:
+                failures[video_id] = unavailable[video_id]
+        else:
+            missing.append(video)
+
+    if missing and request.failure in THROTTLING_FAILURES:
+        logger.error(f"批量下载中 {len(missing)}/{len(videos)} 个视频因YouTube限流（{request.failure}）未完成，本轮不再重试")
+        results.update((video["video_id"], None) for video in missing)
+    elif missing:
+        logger.warning(f"批量下载中 {len(missing)}/{len(videos)} 个视频未完成 (returncode {returncode})，逐个重试\n{_stderr_tail(errors)}")
+        for video in missing:
+            results[video["video_id"]] = download_video(
+                video["video_id"],
+                video["channel_name"],
+                video["upload_date"],
+                video["title"],
+                config,
+                info_json=video.get("info_json"),
+                transfer=transfer,
+                failures=failures,
+            )
+    return results
@@ -12,12 +12,23 @@ project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
 
+@pytest.fixture(autouse=True)
+def fresh_request_coordinator():
+    """每个测试使用新的进程级请求协调器（令牌桶/熔断状态不跨测试保留）。"""
+    from src.downloader import rate_limiter
+    rate_limiter._coordinator = None
+    yield
+    rate_limiter._coordinator = None
+
+
 @pytest.fixture
 def temp_db_path():
     """临时数据库路径的fixture，用于history_manager测试。"""
     with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as tmp:
         db_path = tmp.name
     yield db_path
+    from src.core.history_manager import close_stores
+    close_stores()
     try:
         os.unlink(db_path)
     except OSError:
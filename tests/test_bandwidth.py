@@ -0,0 +1,80 @@
+from datetime import datetime
+from unittest.mock import Mock, patch
+
+from src.downloader.bandwidth import BandwidthBudget, current_limit_mbps
+from src.downloader.engine import _split_cmd
+from src.downloader.video_downloader import download_video
+
+PROFILES = [
+    {"start": "09:00", "end": "18:00", "max_bandwidth_mbps": 20},
+    {"start": "23:00", "end": "06:00", "max_bandwidth_mbps": 0},
+]
+
+
+class TestCurrentLimit:
+    def test_profiles_override_default(self):
+        """测试命中时段时使用该时段的上限，跨午夜的时段同样生效。"""
+        config = {"max_bandwidth_mbps": 100, "bandwidth_profiles": PROFILES}
+        assert current_limit_mbps(config, datetime(2025, 1, 1, 10, 30)) == 20
+        assert current_limit_mbps(config, datetime(2025, 1, 1, 18, 0)) == 100
+        assert current_limit_mbps(config, datetime(2025, 1, 1, 2, 0)) == 0
+        assert current_limit_mbps(config, datetime(2025, 1, 1, 23, 0)) == 0
+
+    def test_unlimited_by_default(self):
+        """测试未配置时不限速。"""
+        assert current_limit_mbps({}) == 0
+
+
+class TestBandwidthBudget:
+    def test_shares_rebalanced_on_start_and_finish(self):
+        """测试进程内引擎的上限在进行中的下载之间平均分配，下载结束后其余下载的份额回升。"""
+        budget = BandwidthBudget()
+        config = {"max_bandwidth_mbps": 16, "engine": "inprocess"}
+        with budget.slot(config) as first:
+            assert first.rate_bps == 2_000_000
+            with budget.slot(config) as second:
+                assert first.rate_bps == second.rate_bps == 1_000_000
+            assert first.rate_bps == 2_000_000
+
+    def test_subprocess_share_fixed_per_worker(self):
+        """测试子进程引擎每个下载固定取上限的1/download_workers，并发满额时总和不超过上限。"""
+        budget = BandwidthBudget()
+        config = {"max_bandwidth_mbps": 16, "download_workers": 4}
+        with budget.slot(config) as first:
+            assert first.rate_bps == 500_000
+            assert first.limit_args() == ["--limit-rate", "500000"]
+            with budget.slot(config) as second:
+                assert first.rate_bps == second.rate_bps == 500_000
+
+    def test_attached_instance_updated_live(self):
+        """测试进程内引擎的实例在份额变化时即时更新ratelimit。"""
+        budget = BandwidthBudget()
+        config = {"max_bandwidth_mbps": 8, "engine": "inprocess"}
+        ydl = Mock(params={})
+        with budget.slot(config) as slot:
+            slot.attach(ydl)
+            assert ydl.params["ratelimit"] == 1_000_000
+            with budget.slot(config):
+                assert ydl.params["ratelimit"] == 500_000
+            assert ydl.params["ratelimit"] == 1_000_000
+
+    def test_no_limit_args_when_unlimited(self):
+        """测试不限速时不加--limit-rate。"""
+        with BandwidthBudget().slot({}) as slot:
+            assert slot.rate_bps is None
+            assert slot.limit_args() == []
+
+    def test_limit_rate_not_part_of_instance_key(self):
+        """测试限速不影响进程内引擎的实例复用键。"""
+        _, key = _split_cmd(["yt-dlp", "--limit-rate", "1000", "-o", "a.%(ext)s", "https://example.com/v"])
+        _, other = _split_cmd(["yt-dlp", "--limit-rate", "2000", "-o", "b.%(ext)s", "https://example.com/w"])
+        assert key == other
+
+    def test_download_video_passes_share(self, tmp_path, monkeypatch):
+        """测试download_video按份额（默认2个下载worker）为yt-dlp加--limit-rate。"""
+        monkeypatch.chdir(tmp_path)
+        config = {"download_format": "best", "max_retries": 1, "proxy": "p", "max_bandwidth_mbps": 8}
+        with patch('subprocess.Popen', return_value=Mock(returncode=1)) as mock_popen:
+            download_video("video1", "C", "20250101", "A", config)
+
+        assert mock_popen.call_args[0][0][:3] == ["yt-dlp", "--limit-rate", "500000"]
@@ -1,17 +1,99 @@
+import io
 import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import Mock, patch
 
 import pytest
 
-from src.downloader.channel_checker import get_videos
+from src.downloader import channel_checker
+from src.downloader.channel_checker import channel_videos_url, fetch_feed, fetch_video_metadata, get_videos, resolve_channel
+
+FEED_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns="http://www.w3.org/2005/Atom">
+ <yt:channelId>UCtest</yt:channelId>
+ <entry>
+  <yt:videoId>video2</yt:videoId>
+  <title>Newest / Video</title>
+  <author><name>Feed Channel</name></author>
+  <published>2025-01-02T10:00:00+00:00</published>
+ </entry>
+ <entry>
+  <yt:videoId>video1</yt:videoId>
+  <title>Older Video</title>
+  <author><name>Feed Channel</name></author>
+  <published>2025-01-01T10:00:00+00:00</published>
+ </entry>
+</feed>
+"""
+
+CHANNEL_PAGE = """<html><head>
+<meta property="og:title" content="Test &amp; Channel">
+<link rel="canonical" href="https://www.youtube.com/channel/UCabcdefghijklmnopqrstuv">
+</head></html>"""
+
+
+def make_popen(returncode=0, stdout="", stderr=""):
+    """构造模拟的Popen对象，stdout/stderr为可逐行迭代的流。"""
+    proc = Mock()
+    proc.stdout = io.StringIO(stdout)
+    proc.stderr = io.StringIO(stderr)
+    proc.poll.return_value = returncode
+    proc.wait.return_value = returncode
+    proc.returncode = returncode
+    return proc
+
+
+@pytest.fixture
+def local_feed_server(monkeypatch):
+    """本地HTTP服务器代替YouTube订阅源：UCtest返回FEED_XML（带ETag，支持条件请求），其他频道返回404。"""
+    requests = []
+
+    class FeedHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append((self.path, self.headers.get("If-None-Match")))
+            if self.path == "/@testhandle":
+                body = CHANNEL_PAGE.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            elif self.path.endswith("channel_id=UCtest"):
+                if self.headers.get("If-None-Match") == '"v1"':
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                body = FEED_XML.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/atom+xml")
+                self.send_header("ETag", '"v1"')
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self.send_error(404)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FeedHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    monkeypatch.setattr(channel_checker, "FEED_URL", base + "/feeds/videos.xml?channel_id={}")
+    monkeypatch.setattr(channel_checker, "CHANNEL_PAGE_URL", base + "/{}")
+    yield requests
+    server.shutdown()
+    server.server_close()
 
 
 class TestChannelChecker:
 
-    @patch('subprocess.run')
+    @patch('subprocess.Popen')
     def test_get_videos_at_channel(self, mock_run, mock_subprocess):
         """测试@频道handle格式。"""
-        mock_run.return_value = Mock(returncode=0, stdout=json.dumps({
+        mock_run.return_value = make_popen(returncode=0, stdout=json.dumps({
             "_type": "video",
             "id": "video2",
             "title": "Another Video",
@@ -19,7 +101,7 @@ class TestChannelChecker:
             "uploader": "Another Channel"
         }))
 
-        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test_proxy"}
+        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test_proxy", "listing_mode": "full"}
         videos = get_videos("@handle", False, config)
         
         assert len(videos) == 1
@@ -28,10 +110,10 @@ class TestChannelChecker:
         args = mock_run.call_args[0][0]
         assert args[-1] == "https://www.youtube.com/@handle/videos"
 
-    @patch('subprocess.run')
+    @patch('subprocess.Popen')
     def test_get_videos_plain_handle(self, mock_run, mock_subprocess):
         """测试纯handle名自动添加@。"""
-        mock_run.return_value = Mock(returncode=0, stdout=json.dumps({
+        mock_run.return_value = make_popen(returncode=0, stdout=json.dumps({
             "_type": "video",
             "id": "video3",
             "title": "Plain Handle Video",
@@ -39,7 +121,7 @@ class TestChannelChecker:
             "uploader": "Plain Channel"
         }))
 
-        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test_proxy"}
+        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test_proxy", "listing_mode": "full"}
         videos = get_videos("plainhandle", False, config)
         
         assert len(videos) == 1
@@ -48,7 +130,7 @@ class TestChannelChecker:
         args = mock_run.call_args[0][0]
         assert args[-1] == "https://www.youtube.com/@plainhandle/videos"
 
-    @patch('subprocess.run')
+    @patch('subprocess.Popen')
     def test_first_run_limit_applied(self, mock_run, mock_subprocess):
         """测试首次运行限制返回前10个视频。"""
         # 模拟50个视频，但只返回前10个
@@ -62,24 +144,24 @@ class TestChannelChecker:
                 "uploader": "Test Channel"
             }) + "\n"
         
-        mock_run.return_value = Mock(returncode=0, stdout=stdout)
+        mock_run.return_value = make_popen(returncode=0, stdout=stdout)
 
-        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test_proxy"}
+        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test_proxy", "listing_mode": "full"}
         videos = get_videos("testchannel", True, config)  # is_first=True
         
         assert len(videos) == 10  # 限制为10
 
-    @patch('subprocess.run')
+    @patch('subprocess.Popen')
     def test_no_videos_returns_empty(self, mock_run, mock_subprocess):
         """测试无视频返回空列表。"""
-        mock_run.return_value = Mock(returncode=0, stdout="")
+        mock_run.return_value = make_popen(returncode=0, stdout="")
 
-        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test_proxy"}
+        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test_proxy", "listing_mode": "full"}
         videos = get_videos("testchannel", False, config)
         
         assert videos == []
 
-    @patch('subprocess.run')
+    @patch('subprocess.Popen')
     def test_parse_non_video_skipped(self, mock_run, mock_subprocess):
         """测试跳过非视频类型JSON。"""
         stdout = json.dumps({"_type": "playlist"}) + "\n" + json.dumps({
@@ -90,14 +172,14 @@ class TestChannelChecker:
             "uploader": "Test Channel"
         })
 
-        mock_run.return_value = Mock(returncode=0, stdout=stdout)
+        mock_run.return_value = make_popen(returncode=0, stdout=stdout)
 
-        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test_proxy"}
+        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test_proxy", "listing_mode": "full"}
         videos = get_videos("testchannel", False, config)
         
         assert len(videos) == 1
 
-    @patch('subprocess.run')
+    @patch('subprocess.Popen')
     def test_json_decode_error_skipped(self, mock_run, mock_subprocess):
         """测试JSON解析错误跳过该行。"""
         stdout = "invalid json\n" + json.dumps({
@@ -108,20 +190,20 @@ class TestChannelChecker:
             "uploader": "Test Channel"
         })
 
-        mock_run.return_value = Mock(returncode=0, stdout=stdout)
+        mock_run.return_value = make_popen(returncode=0, stdout=stdout)
 
-        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test_proxy"}
+        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test_proxy", "listing_mode": "full"}
         videos = get_videos("testchannel", False, config)
         
         assert len(videos) == 1  # 只解析有效行
 
-    @patch('subprocess.run')
+    @patch('subprocess.Popen')
     def test_retries_on_failure(self, mock_run, mock_subprocess):
         """测试失败时重试。"""
         # 第一次失败，第二次成功
         mock_run.side_effect = [
-            Mock(returncode=1, stdout="", stderr="Error"),
-            Mock(returncode=0, stdout=json.dumps({
+            make_popen(returncode=1, stdout="", stderr="Error"),
+            make_popen(returncode=0, stdout=json.dumps({
                 "_type": "video",
                 "id": "video1",
                 "title": "Retry Video",
@@ -130,16 +212,16 @@ class TestChannelChecker:
             }))
         ]
 
-        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 2, "proxy": "test_proxy"}
+        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 2, "proxy": "test_proxy", "listing_mode": "full"}
         videos = get_videos("testchannel", False, config)
         
         assert len(videos) == 1
         assert mock_run.call_count == 2  # 重试一次
 
-    @patch('subprocess.run')
+    @patch('subprocess.Popen')
     def test_member_video_error_continues(self, mock_run, mock_subprocess):
         """测试会员视频错误继续解析。"""
-        mock_run.return_value = Mock(returncode=1, stdout=json.dumps({
+        mock_run.return_value = make_popen(returncode=1, stdout=json.dumps({
             "_type": "video",
             "id": "video1",
             "title": "Public Video",
@@ -147,15 +229,15 @@ class TestChannelChecker:
             "uploader": "Test Channel"
         }), stderr="This video is available to this channel's members")
 
-        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test_proxy"}
+        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test_proxy", "listing_mode": "full"}
         videos = get_videos("testchannel", False, config)
         
         assert len(videos) == 1  # 仍解析stdout
 
-    @patch('subprocess.run')
+    @patch('subprocess.Popen')
     def test_title_cleanup(self, mock_run, mock_subprocess):
         """测试标题清理（替换/和\）。"""
-        mock_run.return_value = Mock(returncode=0, stdout=json.dumps({
+        mock_run.return_value = make_popen(returncode=0, stdout=json.dumps({
             "_type": "video",
             "id": "video1",
             "title": "Test / Video \\ with slashes",
@@ -163,8 +245,167 @@ class TestChannelChecker:
             "uploader": "Channel / Name"
         }))
 
-        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test_proxy"}
+        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test_proxy", "listing_mode": "full"}
         videos = get_videos("testchannel", False, config)
         
         assert videos[0]["title"] == "Test _ Video _ with slashes"
-        assert videos[0]["channel_name"] == "Channel _ Name"
\ No newline at end of file
+        assert videos[0]["channel_name"] == "Channel _ Name"
+    @patch('subprocess.Popen')
+    def test_only_used_fields_kept(self, mock_run, mock_subprocess):
+        """测试只保留四个字段，formats等大字段被丢弃。"""
+        mock_run.return_value = make_popen(returncode=0, stdout=json.dumps({
+            "_type": "video",
+            "id": "video1",
+            "title": "Big Video",
+            "upload_date": "20250101",
+            "uploader": "Test Channel",
+            "formats": [{"url": "x" * 1000}] * 100,
+        }))
+
+        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test_proxy", "listing_mode": "full"}
+        videos = get_videos("testchannel", False, config)
+
+        assert set(videos[0]) == {"video_id", "title", "upload_date", "channel_name", "channel_uc_id"}
+
+
+    @patch('subprocess.Popen')
+    def test_stop_at_known_video_kills_process(self, mock_run, mock_subprocess):
+        """测试到达已知视频时停止读取并终止yt-dlp进程。"""
+        stdout = "".join(json.dumps({
+            "_type": "video", "id": f"video{i}", "title": f"Video {i}", "upload_date": "20250101", "uploader": "C"
+        }) + "\n" for i in range(5))
+        proc = make_popen(returncode=-9, stdout=stdout)
+        proc.poll.return_value = None  # 仍在运行
+        mock_run.return_value = proc
+
+        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test_proxy", "listing_mode": "full"}
+        videos = get_videos("testchannel", False, config, stop_at=lambda video: video["video_id"] == "video2")
+
+        assert [video["video_id"] for video in videos] == ["video0", "video1"]
+        proc.kill.assert_called_once()
+        assert mock_run.call_count == 1  # 提前停止不视为失败，不重试
+
+    @patch('subprocess.Popen')
+    def test_first_run_stops_after_limit(self, mock_run, mock_subprocess):
+        """测试首次运行读满first_run_limit个后停止读取。"""
+        stdout = "".join(json.dumps({
+            "_type": "video", "id": f"video{i}", "title": f"Video {i}", "upload_date": "20250101", "uploader": "C"
+        }) + "\n" for i in range(5))
+        proc = make_popen(returncode=0, stdout=stdout)
+        proc.poll.return_value = None
+        mock_run.return_value = proc
+
+        config = {"query_limit": 50, "first_run_limit": 2, "max_retries": 3, "proxy": "test_proxy", "listing_mode": "full"}
+        videos = get_videos("testchannel", True, config)
+
+        assert len(videos) == 2
+        proc.kill.assert_called_once()
+
+    @patch('subprocess.Popen')
+    def test_flat_listing_mode(self, mock_run, mock_subprocess):
+        """测试flat模式使用--flat-playlist并解析url条目。"""
+        mock_run.return_value = make_popen(returncode=0, stdout=json.dumps({
+            "_type": "url",
+            "ie_key": "Youtube",
+            "id": "video1",
+            "title": "Flat Video",
+            "uploader": None,
+            "playlist_channel_id": "UCtest",
+        }))
+
+        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test_proxy", "listing_mode": "flat"}
+        videos = get_videos("testchannel", False, config)
+
+        assert videos == [{"video_id": "video1", "title": "Flat Video", "upload_date": "", "channel_name": "", "channel_uc_id": "UCtest"}]
+        args = mock_run.call_args[0][0]
+        assert "--flat-playlist" in args
+        assert args[-1] == "https://www.youtube.com/@testchannel/videos"
+
+    @patch('subprocess.Popen')
+    def test_fetch_metadata_retries_missing_only(self, mock_run, mock_subprocess):
+        """测试第二阶段元数据获取只对缺失ID重试，并保持输入顺序。"""
+        def video_json(video_id):
+            return json.dumps({"_type": "video", "id": video_id, "title": video_id, "upload_date": "20250101", "uploader": "C"})
+
+        mock_run.side_effect = [
+            make_popen(returncode=1, stdout=video_json("video2"), stderr="network error"),
+            make_popen(returncode=0, stdout=video_json("video1")),
+        ]
+
+        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 2, "proxy": "test_proxy"}
+        with patch('time.sleep'):
+            videos = fetch_video_metadata(["video1", "video2"], "testchannel", config)
+
+        assert [video["video_id"] for video in videos] == ["video1", "video2"]
+        retry_args = mock_run.call_args_list[1][0][0]
+        assert retry_args[-1] == "https://www.youtube.com/watch?v=video1"
+        assert "https://www.youtube.com/watch?v=video2" not in retry_args
+
+    @patch('subprocess.Popen')
+    def test_info_json_saved_for_reuse(self, mock_run, mock_subprocess, tmp_path):
+        """测试指定info_dir时保存完整info JSON供下载阶段复用。"""
+        line = json.dumps({
+            "_type": "video",
+            "id": "video1",
+            "title": "Video",
+            "upload_date": "20250101",
+            "uploader": "Test Channel",
+            "formats": [{"format_id": "18"}],
+        })
+        mock_run.return_value = make_popen(returncode=0, stdout=line)
+
+        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test_proxy", "listing_mode": "full"}
+        videos = get_videos("testchannel", False, config, info_dir=str(tmp_path))
+
+        assert videos[0]["info_json"] == str(tmp_path / "video1.info.json")
+        assert json.loads((tmp_path / "video1.info.json").read_text(encoding="utf-8"))["formats"] == [{"format_id": "18"}]
+
+    def test_fetch_feed(self, local_feed_server):
+        """测试从订阅源解析最近视频（最新在前），字段与yt-dlp扫描结果一致。"""
+        config = {"proxy": ""}
+        feed = fetch_feed("UCtest", config)
+
+        assert [video["video_id"] for video in feed["videos"]] == ["video2", "video1"]
+        assert feed["videos"][0] == {
+            "video_id": "video2",
+            "title": "Newest _ Video",
+            "upload_date": "20250102",
+            "channel_name": "Feed Channel",
+            "channel_uc_id": "UCtest",
+        }
+        assert feed["etag"] == '"v1"'
+        assert not feed["unchanged"]
+        assert local_feed_server == [("/feeds/videos.xml?channel_id=UCtest", None)]
+
+    def test_fetch_feed_conditional_request(self, local_feed_server):
+        """测试带缓存项时发送条件请求，304视为未变化；ETag失效但视频ID列表相同也视为未变化。"""
+        config = {"proxy": ""}
+        first = fetch_feed("UCtest", config)
+        cached = {"etag": first["etag"], "last_modified": first["last_modified"], "body_hash": first["body_hash"]}
+
+        not_modified = fetch_feed("UCtest", config, cached)
+        assert not_modified["unchanged"]
+        assert not_modified["videos"] == []
+        assert local_feed_server[-1][1] == '"v1"'
+
+        same_ids = fetch_feed("UCtest", config, dict(cached, etag='"old"'))
+        assert same_ids["unchanged"]
+        assert len(same_ids["videos"]) == 2
+
+        changed = fetch_feed("UCtest", config, dict(cached, etag='"old"', body_hash="other"))
+        assert not changed["unchanged"]
+
+    def test_fetch_feed_http_error(self, local_feed_server):
+        """测试订阅源请求失败时返回None（调用方回退到yt-dlp扫描）。"""
+        assert fetch_feed("UCmissing", {"proxy": ""}) is None
+
+    def test_resolve_channel(self, local_feed_server):
+        """测试从频道主页解析UC ID和频道名；解析失败返回None。"""
+        assert resolve_channel("testhandle", {"proxy": ""}) == {"uc_id": "UCabcdefghijklmnopqrstuv", "uploader": "Test & Channel"}
+        assert resolve_channel("@missing", {"proxy": ""}) is None
+
+    def test_channel_videos_url(self):
+        """测试UC ID直接按ID访问，handle按@handle访问。"""
+        assert channel_videos_url("UCabcdefghijklmnopqrstuv") == "https://www.youtube.com/channel/UCabcdefghijklmnopqrstuv/videos"
+        assert channel_videos_url("@handle") == "https://www.youtube.com/@handle/videos"
+        assert channel_videos_url("handle") == "https://www.youtube.com/@handle/videos"
@@ -0,0 +1,147 @@
+import asyncio
+import multiprocessing
+import time
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from src.core.cluster import heartbeat, node_id
+from src.core.history_manager import (
+    claim_channels,
+    claim_jobs,
+    close_stores,
+    complete_job,
+    enqueue_jobs,
+    init_db,
+    release_channels,
+    renew_leases,
+)
+from src.core.scheduler import PollScheduler
+
+CHANNELS = [f"c{i}" for i in range(6)]
+CLUSTER_CONFIG = {"interval_min": 60, "poll_min_interval_min": 60, "poll_max_interval_min": 10080,
+                  "stagger_window_min": 0, "scan_jitter": 0, "cluster_mode": True}
+
+
+def drain_jobs(db_path, owner, results):
+    """子进程：不断领取并完成下载任务，直到没有到期任务，把领到的video_id放入results。"""
+    while True:
+        claimed = claim_jobs(owner, 2, db_path=db_path)
+        if not claimed:
+            break
+        for job in claimed:
+            results.put((owner, job["video"]["video_id"]))
+            complete_job(job["video"]["video_id"], db_path)
+    close_stores()
+
+
+def claim_all_channels(db_path, owner, start, results):
+    """子进程：与其他进程同时领取全部频道，把领到的频道放入results。"""
+    start.wait()
+    claimed, _ = claim_channels(CHANNELS, owner, 60, db_path=db_path)
+    for channel_id in claimed:
+        results.put((owner, channel_id))
+    close_stores()
+
+
+def run_processes(target, args_for):
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    extra = ctx.Event()
+    processes = [ctx.Process(target=target, args=args_for(f"node{i}", results, extra)) for i in range(3)]
+    for process in processes:
+        process.start()
+    extra.set()
+    collected = []
+    deadline = time.time() + 60
+    while any(process.is_alive() for process in processes) or not results.empty():
+        try:
+            collected.append(results.get(timeout=0.1))
+        except Exception:
+            pass
+        assert time.time() < deadline
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    return collected
+
+
+class TestSharedDatabase:
+    def test_each_job_downloaded_once_across_processes(self, temp_db_path):
+        """测试多个进程共享一个数据库领取下载任务时，每个视频只被一个节点领取。"""
+        init_db(temp_db_path)
+        for channel in CHANNELS:
+            enqueue_jobs(channel, False, [{"video_id": f"{channel}_v{i}"} for i in range(5)], temp_db_path)
+
+        collected = run_processes(drain_jobs, lambda owner, results, _: (temp_db_path, owner, results))
+
+        video_ids = [video_id for _, video_id in collected]
+        assert sorted(video_ids) == sorted(f"{channel}_v{i}" for channel in CHANNELS for i in range(5))
+
+    def test_each_channel_claimed_once_across_processes(self, temp_db_path):
+        """测试多个进程同时领取频道时，每个频道只被一个节点领取。"""
+        init_db(temp_db_path)
+
+        collected = run_processes(claim_all_channels, lambda owner, results, start: (temp_db_path, owner, start, results))
+
+        assert sorted(channel_id for _, channel_id in collected) == CHANNELS
+
+    def test_expired_leases_taken_over_unless_renewed(self, temp_db_path):
+        """测试节点失联（不再心跳）后其任务和频道被其他节点接管，心跳续约的租约不会被接管。"""
+        init_db(temp_db_path)
+        enqueue_jobs("c0", False, [{"video_id": "v1"}, {"video_id": "v2"}], temp_db_path)
+        claim_jobs("dead", 1, lease_sec=0.05, db_path=temp_db_path)
+        claim_jobs("alive", 1, lease_sec=0.05, db_path=temp_db_path)
+        claim_channels(["c0", "c1"], "dead", 0.05, db_path=temp_db_path)
+
+        time.sleep(0.1)
+        assert renew_leases("alive", 60, temp_db_path) == 1
+
+        assert [job["video"]["video_id"] for job in claim_jobs("other", 5, db_path=temp_db_path)] == ["v1"]
+        claimed, deferred = claim_channels(["c0", "c1"], "other", 60, db_path=temp_db_path)
+        assert claimed == ["c0", "c1"] and deferred == {}
+
+        release_channels(["c0"], "other", temp_db_path)
+        claimed, deferred = claim_channels(["c0", "c1"], "alive", 60, db_path=temp_db_path)
+        assert claimed == ["c0"] and list(deferred) == ["c1"]
+
+
+class TestClusterScheduler:
+    @pytest.fixture
+    def shared_db(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        init_db()
+        yield
+        close_stores()
+
+    def test_channel_checked_once_per_due_time(self, shared_db):
+        """测试两个节点的调度器同时到期时只有一个节点检查，另一个节点改按共享计划排期。"""
+        first = AsyncMock()
+        second = AsyncMock()
+        schedulers = [
+            PollScheduler(first, dict(CLUSTER_CONFIG, node_id="a")),
+            PollScheduler(second, dict(CLUSTER_CONFIG, node_id="b")),
+        ]
+        with patch('src.core.scheduler.get_channel_ids', return_value=["c0"]), \
+                patch('src.core.scheduler.get_channel_upload_times', return_value=[]):
+            for scheduler in schedulers:
+                asyncio.run(scheduler.run_pending())
+
+        first.assert_awaited_once_with(["c0"])
+        second.assert_not_awaited()
+        assert schedulers[1].timetable() == schedulers[0].timetable()
+
+    def test_heartbeat_renews_until_cancelled(self):
+        """测试心跳按租约时长的一部分定期续约本节点的租约。"""
+        config = {"node_id": "n1", "lease_seconds": 0.03}
+
+        async def run():
+            task = asyncio.create_task(heartbeat(config))
+            await asyncio.sleep(0.05)
+            task.cancel()
+
+        with patch('src.core.cluster.renew_leases') as mock_renew:
+            asyncio.run(run())
+
+        mock_renew.assert_called_with("n1", 0.03)
+        assert node_id({}) != node_id(config) == "n1"
@@ -0,0 +1,142 @@
+import functools
+import json
+import sys
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.downloader.engine import InProcessEngine, JsonLineStream, SubprocessEngine, get_engine, terminate_processes
+
+
+@pytest.fixture
+def local_video_server(tmp_path):
+    """本地HTTP服务器，提供一个直链视频文件，供进程内引擎在无外网时提取/下载。"""
+    serve_dir = tmp_path / "serve"
+    serve_dir.mkdir()
+    (serve_dir / "clip.mp4").write_bytes(b"\x00" * 4096)
+    handler = functools.partial(SimpleHTTPRequestHandler, directory=str(serve_dir))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/clip.mp4"
+    server.shutdown()
+    server.server_close()
+
+
+
+class TestJsonLineStream:
+    def test_streams_stdout_and_collects_stderr(self):
+        """测试真实子进程逐行输出，stderr由后台线程收集。"""
+        script = "import sys\nfor i in range(3):\n    print(i, flush=True)\nsys.stderr.write('warn' * 50000)\nsys.exit(2)"
+        stream = JsonLineStream([sys.executable, "-c", script])
+        try:
+            lines = list(stream)
+        finally:
+            stream.close()
+        assert lines == ["0", "1", "2"]
+        assert stream.returncode == 2
+        assert len(stream.stderr) == 200000
+
+    def test_close_kills_running_process(self):
+        """测试提前close时终止仍在运行的子进程。"""
+        script = "import time\nprint('first', flush=True)\ntime.sleep(30)"
+        stream = JsonLineStream([sys.executable, "-c", script])
+        first = next(iter(stream))
+        stream.close()
+        assert first == "first"
+        assert stream.returncode != 0
+
+
+class TestEngines:
+    def test_get_engine_by_config(self):
+        """测试按配置选择引擎并复用同一实例。"""
+        assert isinstance(get_engine({}), SubprocessEngine)
+        assert get_engine({"engine": "subprocess"}) is get_engine({})
+        engine = get_engine({"engine": "inprocess"})
+        assert isinstance(engine, InProcessEngine)
+        assert get_engine({"engine": "inprocess"}) is engine
+
+    def test_terminate_processes_stops_running_commands(self):
+        """测试停止时终止进行中的子进程，等待中的run()随之返回。"""
+        engine = SubprocessEngine()
+        started = threading.Event()
+        results = []
+        script = "import time\ntime.sleep(30)"
+
+        def run():
+            started.set()
+            results.append(engine.run([sys.executable, "-c", script]))
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        started.wait()
+        killed = 0
+        while not killed:
+            killed = terminate_processes()
+        thread.join(timeout=10)
+
+        assert not thread.is_alive()
+        assert killed == 1
+        assert results[0] != 0
+        assert terminate_processes() == 0
+
+    def test_inprocess_stream_json_reuses_instance(self, local_video_server):
+        """测试进程内引擎逐行产出JSON，并在多次调用间复用同一YoutubeDL实例。"""
+        engine = InProcessEngine()
+        cmd = ["yt-dlp", "--proxy", "", "--no-playlist", "--dump-json", local_video_server]
+
+        stream = engine.stream_json(cmd)
+        try:
+            lines = list(stream)
+        finally:
+            stream.close()
+        assert stream.returncode == 0
+        info = json.loads(lines[0])
+        assert info["id"] == "clip"
+        assert info["_type"] == "video"
+
+        instance = next(iter(engine._idle.values()))[0]
+        stream = engine.stream_json(cmd)
+        try:
+            list(stream)
+        finally:
+            stream.close()
+        assert next(iter(engine._idle.values())) == [instance]
+
+    def test_inprocess_error_captured(self):
+        """测试进程内引擎提取失败时返回非零并收集错误输出。"""
+        engine = InProcessEngine()
+        stream = engine.stream_json(["yt-dlp", "--proxy", "", "--dump-json", "http://127.0.0.1:9/missing.mp4"])
+        try:
+            assert list(stream) == []
+        finally:
+            stream.close()
+        assert stream.returncode != 0
+        assert "ERROR" in stream.stderr
+
+    def test_inprocess_run_downloads(self, local_video_server, tmp_path):
+        """测试进程内引擎下载文件，输出模板按次生效。"""
+        engine = InProcessEngine()
+        for name in ("first", "second"):
+            output = tmp_path / f"{name}.%(ext)s"
+            returncode = engine.run(["yt-dlp", "--proxy", "", "--no-playlist", "-o", str(output), local_video_server])
+            assert returncode == 0
+            assert (tmp_path / f"{name}.mp4").stat().st_size == 4096
+        assert sum(len(instances) for instances in engine._idle.values()) == 1
+
+    def test_inprocess_run_with_info_json(self, local_video_server, tmp_path):
+        """测试进程内引擎用--load-info-json下载，不重新提取。"""
+        engine = InProcessEngine()
+        stream = engine.stream_json(["yt-dlp", "--proxy", "", "--no-playlist", "--dump-json", local_video_server])
+        try:
+            line = next(iter(stream))
+        finally:
+            stream.close()
+        info_json = tmp_path / "clip.info.json"
+        info_json.write_text(line, encoding="utf-8")
+
+        output = tmp_path / "out.%(ext)s"
+        returncode = engine.run(["yt-dlp", "--proxy", "", "-o", str(output), "--load-info-json", str(info_json)])
+        assert returncode == 0
+        assert (tmp_path / "out.mp4").exists()
@@ -1,9 +1,43 @@
 import os
 import sqlite3
+import time
+from unittest.mock import patch
 
 import pytest
 
-from history_manager import has_records_for_channel, init_db, is_downloaded, log_download, mark_downloaded
+from src.core.history_manager import (
+    JOB_RETRY_BASE_SEC,
+    MAX_SQL_VARIABLES,
+    HistoryStore,
+    HistoryWriter,
+    claim_jobs,
+    close_stores,
+    complete_job,
+    enqueue_jobs,
+    fail_job,
+    filter_new_video_ids,
+    filter_open_jobs,
+    flush_downloads,
+    delete_channel_resolution,
+    get_channel_resolution,
+    get_channel_watermark,
+    get_http_cache,
+    get_unavailable_videos,
+    has_records_for_channel,
+    init_db,
+    is_downloaded,
+    log_download,
+    next_job_due_at,
+    mark_downloaded,
+    mark_unavailable,
+    prune_http_cache,
+    prune_unavailable,
+    record_download,
+    requeue_running_jobs,
+    set_channel_resolution,
+    set_channel_watermark,
+    set_http_cache,
+)
 
 
 class TestHistoryManager:
@@ -56,6 +90,108 @@ class TestHistoryManager:
         mark_downloaded("video1", "test_channel", temp_db_path)
         assert is_downloaded("video1", temp_db_path)
 
+    def test_filter_new_video_ids(self, temp_db_path):
+        """测试批量排重返回未下载ID并保持顺序。"""
+        init_db(temp_db_path)
+        mark_downloaded("video2", "test_channel", temp_db_path)
+        result = filter_new_video_ids(["video3", "video2", "video1", "video3"], temp_db_path)
+        assert result == ["video3", "video1"]
+
+    def test_filter_new_video_ids_chunked(self, temp_db_path):
+        """测试超过参数上限时分块查询。"""
+        init_db(temp_db_path)
+        video_ids = [f"video{i}" for i in range(MAX_SQL_VARIABLES * 2 + 5)]
+        for video_id in video_ids[::3]:
+            mark_downloaded(video_id, "test_channel", temp_db_path)
+        result = filter_new_video_ids(video_ids, temp_db_path)
+        assert result == [video_id for i, video_id in enumerate(video_ids) if i % 3 != 0]
+
+    def test_channel_watermark_roundtrip(self, temp_db_path):
+        """测试频道水位线读写与覆盖更新。"""
+        init_db(temp_db_path)
+        assert get_channel_watermark("test_channel", temp_db_path) is None
+        set_channel_watermark("test_channel", "video1", "20250101", temp_db_path)
+        set_channel_watermark("test_channel", "video2", "20250102", temp_db_path)
+        assert get_channel_watermark("test_channel", temp_db_path) == {"video_id": "video2", "upload_date": "20250102"}
+
+    def test_channel_resolution_migrates_history(self, temp_db_path):
+        """测试保存频道解析结果，并把以handle记录的历史迁移到UC ID下。"""
+        init_db(temp_db_path)
+        assert get_channel_resolution("handle", temp_db_path) is None
+        mark_downloaded("video1", "handle", temp_db_path)
+        log_download("video1", "handle", "success", None, "true", temp_db_path)
+
+        set_channel_resolution("handle", "UC" + "a" * 22, "Name", temp_db_path)
+
+        assert get_channel_resolution("handle", temp_db_path) == {
+            "uc_id": "UC" + "a" * 22, "uploader": "Name", "stale": False
+        }
+        assert not has_records_for_channel("handle", temp_db_path)
+        assert has_records_for_channel("UC" + "a" * 22, temp_db_path)
+        conn = sqlite3.connect(temp_db_path)
+        assert conn.execute("SELECT channel_id FROM logs").fetchall() == [("UC" + "a" * 22,)]
+        # 超过有效期视为过期
+        conn.execute("UPDATE channel_resolution SET updated_at = datetime('now', '-31 days')")
+        conn.commit()
+        conn.close()
+        assert get_channel_resolution("handle", temp_db_path)["stale"]
+
+        delete_channel_resolution("handle", temp_db_path)
+        assert get_channel_resolution("handle", temp_db_path) is None
+
+    def test_channel_resolution_upgrades_old_table(self, temp_db_path):
+        """测试旧版channel_resolution表（只有uc_id列）初始化时补齐新增列。"""
+        conn = sqlite3.connect(temp_db_path)
+        conn.execute("CREATE TABLE channel_resolution (channel_id TEXT PRIMARY KEY, uc_id TEXT NOT NULL, updated_at DATETIME DEFAULT CURRENT_TIMESTAMP)")
+        conn.execute("INSERT INTO channel_resolution (channel_id, uc_id) VALUES ('handle', 'UCold')")
+        conn.commit()
+        conn.close()
+
+        init_db(temp_db_path)
+
+        assert get_channel_resolution("handle", temp_db_path)["uc_id"] == "UCold"
+        assert get_channel_resolution("handle", temp_db_path)["uploader"] is None
+
+    def test_http_cache_roundtrip_and_prune(self, temp_db_path):
+        """测试HTTP缓存项读写，以及清理已移除频道的缓存项。"""
+        init_db(temp_db_path)
+        assert get_http_cache("url1", temp_db_path) is None
+        set_http_cache("url1", "channel1", '"e1"', None, "h1", ["short1"], temp_db_path)
+        set_http_cache("url2", "channel2", None, "Mon, 01 Jan 2025 00:00:00 GMT", "h2", db_path=temp_db_path)
+        assert get_http_cache("url1", temp_db_path) == {"etag": '"e1"', "last_modified": None, "body_hash": "h1", "ignored_ids": ["short1"]}
+        assert get_http_cache("url2", temp_db_path)["ignored_ids"] == []
+
+        assert prune_http_cache(["channel1"], temp_db_path) == 1
+        assert get_http_cache("url2", temp_db_path) is None
+        assert get_http_cache("url1", temp_db_path) is not None
+
+    def test_unavailable_cache_respects_ttl(self, temp_db_path):
+        """测试负缓存按有效期生效：永久项一直有效，过期项不再返回并被清理。"""
+        init_db(temp_db_path)
+        mark_unavailable("gone", "channel1", "removed", None, temp_db_path)
+        mark_unavailable("soon", "channel1", "upcoming", 3600, temp_db_path)
+        mark_unavailable("stale", "channel1", "private", -1, temp_db_path)
+
+        unavailable = get_unavailable_videos(["gone", "soon", "stale", "other"], temp_db_path)
+        assert unavailable == {"gone": "removed", "soon": "upcoming"}
+        assert prune_unavailable(temp_db_path) == 1
+
+        # 再次记录时刷新原因和有效期
+        mark_unavailable("soon", "channel1", "removed", None, temp_db_path)
+        assert get_unavailable_videos(["soon"], temp_db_path) == {"soon": "removed"}
+
+    def test_expired_unavailable_invalidates_feed_cache(self, temp_db_path):
+        """测试负缓存过期清理时清除所在频道（按UC ID经解析缓存对应）的订阅源验证信息，保留ignored_ids。"""
+        init_db(temp_db_path)
+        set_channel_resolution("handle", "UC" + "a" * 22, "Name", temp_db_path)
+        set_http_cache("url1", "handle", '"e1"', None, "h1", ["short1"], temp_db_path)
+        set_http_cache("url2", "other", '"e2"', None, "h2", db_path=temp_db_path)
+        mark_unavailable("premiere1", "UC" + "a" * 22, "upcoming", -1, temp_db_path)
+
+        assert prune_unavailable(temp_db_path) == 1
+        assert get_http_cache("url1", temp_db_path) == {"etag": None, "last_modified": None, "body_hash": None, "ignored_ids": ["short1"]}
+        assert get_http_cache("url2", temp_db_path)["body_hash"] == "h2"
+
     def test_mark_downloaded_inserts_if_new(self, temp_db_path):
         """测试标记新视频插入记录。"""
         init_db(temp_db_path)
@@ -125,4 +261,182 @@ class TestHistoryManager:
         cursor.execute("SELECT COUNT(*) FROM logs")
         count = cursor.fetchone()[0]
         assert count == 2
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+    def test_store_enables_wal_and_reuses_connection(self, temp_db_path):
+        """测试HistoryStore启用WAL并复用长连接。"""
+        store = HistoryStore(temp_db_path, pool_size=2)
+        store.init_schema()
+        with store.connection() as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            first = conn
+        store.mark_downloaded("video1", "test_channel")
+        with store.connection() as conn:
+            assert conn is first
+        assert store.is_downloaded("video1")
+        store.close()
+
+    def test_store_rollback_journal(self, temp_db_path):
+        """测试集群模式使用的回滚日志：journal_mode=DELETE且synchronous=FULL。"""
+        store = HistoryStore(temp_db_path, pool_size=1, journal_mode="delete")
+        store.init_schema()
+        with store.connection() as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+            assert conn.execute("PRAGMA synchronous").fetchone()[0] == 2
+        store.close()
+
+    def test_store_concurrent_writes(self, temp_db_path):
+        """测试多线程共享连接池并发写入。"""
+        import threading
+
+        store = HistoryStore(temp_db_path, pool_size=3)
+        store.init_schema()
+
+        def writer(n):
+            for i in range(20):
+                store.mark_downloaded(f"video{n}_{i}", f"channel{n}")
+                store.log_download(f"video{n}_{i}", f"channel{n}", "success")
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert len(store._connections) <= 3
+        with store.connection() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM history").fetchone()[0] == 120
+            assert conn.execute("SELECT COUNT(*) FROM logs").fetchone()[0] == 120
+        store.close()
+
+
+def job_states(db_path):
+    conn = sqlite3.connect(db_path)
+    states = dict(conn.execute("SELECT video_id, state FROM jobs"))
+    conn.close()
+    return states
+
+
+class TestJobQueue:
+    def test_enqueue_ignores_existing_jobs(self, temp_db_path):
+        """测试同一视频只建一个任务（跨频道或重复发现时）。"""
+        init_db(temp_db_path)
+        assert enqueue_jobs("c1", True, [{"video_id": "v1"}, {"video_id": "v2"}], temp_db_path) == 2
+        assert enqueue_jobs("c2", False, [{"video_id": "v2"}, {"video_id": "v3"}], temp_db_path) == 1
+
+    def test_filter_open_jobs(self, temp_db_path):
+        """测试只返回有等待、进行中或等待重试任务的视频，已完成的任务不算。"""
+        init_db(temp_db_path)
+        enqueue_jobs("c1", False, [{"video_id": "v1"}, {"video_id": "v2"}, {"video_id": "v3"}], temp_db_path)
+        claim_jobs("w1", 1, db_path=temp_db_path)
+        complete_job("v2", temp_db_path)
+
+        assert filter_open_jobs(["v3", "v2", "v1", "v4"], temp_db_path) == ["v3", "v1"]
+
+    def test_claim_batches_one_channel_and_never_twice(self, temp_db_path):
+        """测试领取同一频道的到期任务，已领取（租约有效）的任务不会再被领取。"""
+        init_db(temp_db_path)
+        enqueue_jobs("c1", True, [{"video_id": "a1", "title": "T"}, {"video_id": "a2"}], temp_db_path)
+        enqueue_jobs("c2", False, [{"video_id": "b1"}], temp_db_path)
+
+        first = claim_jobs("w1", 5, db_path=temp_db_path)
+        assert [job["video"]["video_id"] for job in first] == ["a1", "a2"]
+        assert first[0] == {"video": {"video_id": "a1", "title": "T"}, "channel_id": "c1", "is_first": True, "attempts": 1}
+        assert [job["video"]["video_id"] for job in claim_jobs("w2", 5, db_path=temp_db_path)] == ["b1"]
+        assert claim_jobs("w2", 5, db_path=temp_db_path) == []
+
+    def test_expired_lease_reclaimed(self, temp_db_path):
+        """测试租约过期的running任务可被重新领取。"""
+        init_db(temp_db_path)
+        enqueue_jobs("c1", False, [{"video_id": "v1"}], temp_db_path)
+        claim_jobs("w1", 1, lease_sec=-1, db_path=temp_db_path)
+
+        reclaimed = claim_jobs("w2", 1, db_path=temp_db_path)
+        assert reclaimed[0]["attempts"] == 2
+
+    def test_failure_backoff_then_dead(self, temp_db_path):
+        """测试失败后按退避安排重试，尝试次数用尽后转为dead；完成的任务不再领取。"""
+        init_db(temp_db_path)
+        enqueue_jobs("c1", False, [{"video_id": "v1"}, {"video_id": "v2"}], temp_db_path)
+        claim_jobs("w1", 2, db_path=temp_db_path)
+        complete_job("v2", temp_db_path)
+
+        before = time.time()
+        assert fail_job("v1", "boom", 2, temp_db_path) == "failed"
+        assert next_job_due_at(temp_db_path) >= before + JOB_RETRY_BASE_SEC
+        assert claim_jobs("w1", 2, db_path=temp_db_path) == []
+
+        with patch('src.core.history_manager.time.time', return_value=before + 2 * JOB_RETRY_BASE_SEC):
+            assert [job["attempts"] for job in claim_jobs("w1", 2, db_path=temp_db_path)] == [2]
+        assert fail_job("v1", "boom", 2, temp_db_path) == "dead"
+        assert job_states(temp_db_path) == {"v1": "dead", "v2": "done"}
+        assert next_job_due_at(temp_db_path) is None
+
+    def test_requeue_running_after_restart(self, temp_db_path):
+        """测试重启时中断的running任务放回pending，且不计入尝试次数。"""
+        init_db(temp_db_path)
+        enqueue_jobs("c1", False, [{"video_id": "v1"}], temp_db_path)
+        claim_jobs("w1", 1, db_path=temp_db_path)
+
+        assert requeue_running_jobs(db_path=temp_db_path) == 1
+        assert claim_jobs("w2", 1, db_path=temp_db_path)[0]["attempts"] == 1
+
+
+def log_rows(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT video_id, status FROM logs ORDER BY id").fetchall()
+
+
+class TestHistoryWriter:
+    def test_results_buffered_until_flush(self, temp_db_path):
+        """测试下载结果先进入缓冲，flush时history、logs和任务完成一起写入。"""
+        init_db(temp_db_path)
+        enqueue_jobs("c1", False, [{"video_id": "v1"}, {"video_id": "v2"}], temp_db_path)
+        claim_jobs("w1", 2, db_path=temp_db_path)
+        record_download("v1", "c1", "success", "/a.mp4", "False", temp_db_path)
+        record_download("v2", "c1", "failed", None, "False", temp_db_path)
+
+        assert log_rows(temp_db_path) == []
+        assert flush_downloads(temp_db_path) == 2
+        assert log_rows(temp_db_path) == [("v1", "success"), ("v2", "failed")]
+        assert is_downloaded("v1", temp_db_path) and not is_downloaded("v2", temp_db_path)
+        assert job_states(temp_db_path) == {"v1": "done", "v2": "running"}
+        assert flush_downloads(temp_db_path) == 0
+
+    def test_one_transaction_per_batch(self, temp_db_path):
+        """测试攒满batch_size条时后台线程把整批写入一次。"""
+        init_db(temp_db_path)
+        store = HistoryStore(temp_db_path)
+        store.writer = HistoryWriter(store, batch_size=10, flush_sec=60)
+        with patch.object(store, "write_downloads", wraps=store.write_downloads) as mock_write:
+            for i in range(10):
+                store.writer.record((f"v{i}", "c1", "success", None, "False"))
+            deadline = time.time() + 5
+            while not mock_write.called and time.time() < deadline:
+                time.sleep(0.01)
+            store.close()
+
+        assert mock_write.call_count == 1
+        assert len(log_rows(temp_db_path)) == 10
+
+    def test_flushed_after_flush_sec(self, temp_db_path):
+        """测试未攒满时最早一条等待flush_sec秒后写入。"""
+        init_db(temp_db_path)
+        store = HistoryStore(temp_db_path)
+        store.writer = HistoryWriter(store, batch_size=100, flush_sec=0.05)
+        store.writer.record(("v1", "c1", "success", None, "False"))
+
+        deadline = time.time() + 5
+        while not log_rows(temp_db_path) and time.time() < deadline:
+            time.sleep(0.01)
+        assert log_rows(temp_db_path) == [("v1", "success")]
+        store.close()
+
+    def test_close_flushes_pending(self, temp_db_path):
+        """测试关闭时写入缓冲中剩余的结果。"""
+        init_db(temp_db_path)
+        record_download("v1", "c1", "success", None, "False", temp_db_path)
+        close_stores()
+
+        assert log_rows(temp_db_path) == [("v1", "success")]
+        assert is_downloaded("v1", temp_db_path)
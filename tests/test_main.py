@@ -1,23 +1,75 @@
+import asyncio
+import os
+import signal
 import sys
+import threading
+import time
 from unittest.mock import MagicMock, Mock, patch
 
 import pytest
 
-from main import check_and_download, main, signal_handler
+from main import INFO_DIR, DownloadPipeline, FeedCacheStats, check_and_download, check_channels, main, recover_staged_downloads, scan_channel, serve, signal_handler
+from src.core.history_manager import (
+    claim_jobs,
+    close_stores,
+    enqueue_jobs,
+    flush_downloads,
+    get_http_cache,
+    init_db,
+    is_downloaded,
+    mark_downloaded,
+    next_job_due_at,
+    set_http_cache,
+)
+from src.core.video_index import DownloadedIndex
+from src.downloader.channel_checker import feed_url
+
+RESOLVED = {"uc_id": "UCx", "uploader": "C", "stale": False}
+
+
+@pytest.fixture(autouse=True)
+def mock_channel_state():
+    """隔离频道水位线、单条排重查询与下载暂存目录，避免测试访问真实数据库和文件。"""
+    with patch('main.get_channel_watermark', return_value=None), \
+            patch('main.set_channel_watermark') as mock_set, \
+            patch('main.is_downloaded', return_value=False), \
+            patch('main.get_channel_resolution', return_value=None), \
+            patch('main.set_channel_resolution'), \
+            patch('main.delete_channel_resolution'), \
+            patch('main.resolve_channel', return_value=None), \
+            patch('main.get_http_cache', return_value=None), \
+            patch('main.set_http_cache'), \
+            patch('main.prune_http_cache', return_value=0), \
+            patch('main.get_unavailable_videos', return_value={}), \
+            patch('main.mark_unavailable'), \
+            patch('main.prune_unavailable', return_value=0), \
+            patch('main.stage_video'), \
+            patch('main.recover_staging', return_value=[]), \
+            patch('main.gc_staging', return_value=0), \
+            patch('main.transfer_video', side_effect=lambda video, staged_path, config: staged_path):
+        yield mock_set
+
+
+@pytest.fixture(autouse=True)
+def job_db(tmp_path, monkeypatch):
+    """在临时目录中运行，下载任务队列使用该目录下的数据库。"""
+    monkeypatch.chdir(tmp_path)
+    init_db()
+    yield
+    close_stores()
 
 
 class TestMain:
     @patch('main.get_channel_ids')
     @patch('main.has_records_for_channel')
     @patch('main.get_videos')
-    @patch('main.is_downloaded')
+    @patch('main.filter_new_video_ids')
     @patch('main.download_video')
-    @patch('main.mark_downloaded')
-    @patch('main.log_download')
+    @patch('main.record_download')
     @patch('main.logger')
-    def test_check_and_download_success_flow(self, mock_logger, mock_log_download, mock_mark_downloaded, mock_download_video, mock_is_downloaded, mock_get_videos, mock_has_records, mock_get_channel_ids):
+    def test_check_and_download_success_flow(self, mock_logger, mock_record_download, mock_download_video, mock_filter_new, mock_get_videos, mock_has_records, mock_get_channel_ids):
         """测试完整成功流程。"""
-        mock_config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test"}
+        mock_config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test", "listing_mode": "full"}
         
         mock_channel_ids = ["channel1"]
         mock_get_channel_ids.return_value = mock_channel_ids
@@ -29,7 +81,7 @@ class TestMain:
         ]
         mock_get_videos.return_value = mock_videos
         
-        mock_is_downloaded.return_value = False  # 新视频
+        mock_filter_new.side_effect = lambda ids: list(ids)  # 新视频
         
         mock_file_path = "/path/to/downloaded.mp4"
         mock_download_video.return_value = mock_file_path
@@ -39,36 +91,33 @@ class TestMain:
         # 检查调用链
         mock_get_channel_ids.assert_called_once()
         mock_has_records.assert_called_once_with("channel1")
-        mock_get_videos.assert_called_once_with("channel1", True, mock_config)
-        mock_is_downloaded.assert_called_once_with("video1")
-        mock_download_video.assert_called_once_with("video1", "Test Channel", "20250101", "Test Video", mock_config)
-        mock_mark_downloaded.assert_called_once_with("video1", "channel1")
-        mock_log_download.assert_called_once_with("video1", "channel1", "success", mock_file_path, "True")
+        assert mock_get_videos.call_args[0] == ("channel1", True, mock_config)
+        mock_filter_new.assert_called_once_with(["video1"])
+        mock_download_video.assert_called_once_with("video1", "Test Channel", "20250101", "Test Video", mock_config, info_json=None, transfer=False, failures={})
+        mock_record_download.assert_called_once_with("video1", "channel1", "success", mock_file_path, "True")
         mock_logger.info.assert_any_call(f"开始检查 {len(mock_channel_ids)} 个频道的新视频")
         mock_logger.info.assert_any_call("检查循环完成")
 
     @patch('main.get_channel_ids')
     @patch('main.has_records_for_channel')
     @patch('main.get_videos')
-    @patch('main.is_downloaded')
+    @patch('main.filter_new_video_ids')
     @patch('main.download_video')
-    @patch('main.log_download')
-    @patch('main.mark_downloaded')
+    @patch('main.record_download')
     @patch('main.logger')
-    def test_check_and_download_failure_log_only(self, mock_logger, mock_mark_downloaded, mock_log_download, mock_download_video, mock_is_downloaded, mock_get_videos, mock_has_records, mock_get_channel_ids):
+    def test_check_and_download_failure_log_only(self, mock_logger, mock_record_download, mock_download_video, mock_filter_new, mock_get_videos, mock_has_records, mock_get_channel_ids):
         """测试下载失败只记录日志，不标记history。"""
-        mock_config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test"}
+        mock_config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test", "listing_mode": "full"}
         
         mock_get_channel_ids.return_value = ["channel1"]
         mock_has_records.return_value = False
         mock_get_videos.return_value = [{"video_id": "video1", "title": "Test Video", "upload_date": "20250101", "channel_name": "Test Channel"}]
-        mock_is_downloaded.return_value = False
+        mock_filter_new.side_effect = lambda ids: list(ids)
         mock_download_video.return_value = None  # 失败
         
         check_and_download(mock_config)
         
-        mock_log_download.assert_called_once_with("video1", "channel1", "failed", None, "True")
-        mock_mark_downloaded.assert_not_called()
+        mock_record_download.assert_called_once_with("video1", "channel1", "failed", None, "True")
         mock_logger.error.assert_called_once_with(f"下载失败: video1")
 
     @patch('main.get_channel_ids')
@@ -76,7 +125,7 @@ class TestMain:
     def test_no_channels_warning(self, mock_logger, mock_get_channel_ids):
         """测试无频道时警告并返回。"""
         mock_get_channel_ids.return_value = []
-        mock_config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test"}
+        mock_config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test", "listing_mode": "full"}
         
         check_and_download(mock_config)
         
@@ -94,7 +143,7 @@ class TestMain:
         mock_get_channel_ids.return_value = ["channel1"]
         mock_has_records.return_value = False
         mock_get_videos.return_value = []
-        mock_config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test"}
+        mock_config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test", "listing_mode": "full"}
         
         check_and_download(mock_config)
         
@@ -103,15 +152,15 @@ class TestMain:
     @patch('main.get_channel_ids')
     @patch('main.has_records_for_channel')
     @patch('main.get_videos')
-    @patch('main.is_downloaded')
+    @patch('main.filter_new_video_ids')
     @patch('main.logger')
-    def test_already_downloaded_skip(self, mock_logger, mock_is_downloaded, mock_get_videos, mock_has_records, mock_get_channel_ids):
+    def test_already_downloaded_skip(self, mock_logger, mock_filter_new, mock_get_videos, mock_has_records, mock_get_channel_ids):
         """测试已下载视频跳过。"""
         mock_get_channel_ids.return_value = ["channel1"]
         mock_has_records.return_value = False
         mock_get_videos.return_value = [{"video_id": "video1", "title": "Test Video", "upload_date": "20250101", "channel_name": "Test Channel"}]
-        mock_is_downloaded.return_value = True  # 已下载
-        mock_config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test"}
+        mock_filter_new.return_value = []  # 已下载
+        mock_config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test", "listing_mode": "full"}
         
         check_and_download(mock_config)
         
@@ -120,6 +169,417 @@ class TestMain:
         with patch('main.download_video') as mock_download:
             mock_download.assert_not_called()
 
+    @patch('main.get_channel_ids')
+    @patch('main.has_records_for_channel')
+    @patch('main.get_videos')
+    @patch('main.filter_new_video_ids')
+    @patch('main.download_video')
+    @patch('main.record_download')
+    def test_unavailable_videos_cached_and_skipped(self, mock_record_download, mock_download_video, mock_filter_new, mock_get_videos, mock_has_records, mock_get_channel_ids):
+        """测试下载时发现不可用的视频写入负缓存（按原因的有效期），负缓存中的视频不再下载。"""
+        mock_get_channel_ids.return_value = ["channel1"]
+        mock_has_records.return_value = True
+        mock_get_videos.return_value = [
+            {"video_id": video_id, "title": "T", "upload_date": "20250101", "channel_name": "C"} for video_id in ("gone", "cached")
+        ]
+        mock_filter_new.side_effect = lambda ids: list(ids)
+
+        def fake_download(video_id, *args, failures=None, **kwargs):
+            failures[video_id] = "removed"
+            return None
+
+        mock_download_video.side_effect = fake_download
+        mock_config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test", "listing_mode": "full"}
+
+        with patch('main.get_unavailable_videos', return_value={"cached": "upcoming"}), \
+                patch('main.mark_unavailable') as mock_mark_unavailable:
+            check_and_download(mock_config)
+
+        assert [call.args[0] for call in mock_download_video.call_args_list] == ["gone"]
+        mock_mark_unavailable.assert_called_once_with("gone", "channel1", "removed", 30 * 86400)
+        mock_record_download.assert_called_once_with("gone", "channel1", "failed", None, "False")
+
+    @patch('main.get_channel_ids')
+    @patch('main.has_records_for_channel')
+    @patch('main.get_videos')
+    @patch('main.enqueue_new_videos')
+    @patch('main.logger')
+    def test_concurrent_scan_all_channels(self, mock_logger, mock_process, mock_get_videos, mock_has_records, mock_get_channel_ids):
+        """测试并发扫描所有频道，单个频道扫描异常不影响其他频道。"""
+        mock_get_channel_ids.return_value = ["channel1", "channel2", "channel3"]
+        mock_has_records.return_value = True
+
+        def fake_get_videos(channel_id, is_first, config, stop_at=None, info_dir=None, failures=None):
+            if channel_id == "channel2":
+                raise RuntimeError("boom")
+            return [{"video_id": f"{channel_id}_v", "title": "T", "upload_date": "20250101", "channel_name": "C"}]
+
+        mock_get_videos.side_effect = fake_get_videos
+        mock_config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test", "listing_mode": "full", "scan_workers": 2}
+
+        check_and_download(mock_config)
+
+        assert mock_get_videos.call_count == 3
+        processed = sorted(call.args[0] for call in mock_process.call_args_list)
+        assert processed == ["channel1", "channel3"]
+        mock_logger.info.assert_any_call("检查循环完成")
+
+    @patch('main.get_channel_ids')
+    @patch('main.has_records_for_channel')
+    @patch('main.get_videos')
+    @patch('main.filter_new_video_ids')
+    @patch('main.download_video')
+    @patch('main.record_download')
+    @patch('main.logger')
+    def test_download_pool_drains_queue(self, mock_logger, mock_record_download, mock_download_video, mock_filter_new, mock_get_videos, mock_has_records, mock_get_channel_ids):
+        """测试下载线程池消费有界队列，重复视频只下载一次。"""
+        mock_get_channel_ids.return_value = ["channel1", "channel2"]
+        mock_has_records.return_value = True
+        mock_get_videos.side_effect = lambda channel_id, is_first, config, stop_at=None, info_dir=None, failures=None: [
+            {"video_id": f"{channel_id}_{i}", "title": "T", "upload_date": "20250101", "channel_name": "C"} for i in range(5)
+        ] + [{"video_id": "shared", "title": "T", "upload_date": "20250101", "channel_name": "C"}]
+        mock_filter_new.side_effect = lambda ids: list(ids)
+        mock_download_video.side_effect = lambda video_id, *args, **kwargs: f"/downloads/{video_id}.mp4"
+        mock_config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test", "listing_mode": "full",
+                       "download_workers": 3, "download_queue_size": 2}
+
+        check_and_download(mock_config)
+
+        downloaded = sorted(call.args[0] for call in mock_download_video.call_args_list)
+        assert len(downloaded) == 11
+        assert downloaded.count("shared") == 1
+        assert [call.args[2] for call in mock_record_download.call_args_list] == ["success"] * 11
+
+    @patch('main.get_channel_ids')
+    @patch('main.has_records_for_channel')
+    @patch('main.get_videos')
+    @patch('main.filter_new_video_ids')
+    @patch('main.download_videos')
+    @patch('main.download_video')
+    @patch('main.record_download')
+    @patch('main.logger')
+    def test_batched_downloads_record_per_video(self, mock_logger, mock_record_download, mock_download_video, mock_download_videos, mock_filter_new, mock_get_videos, mock_has_records, mock_get_channel_ids):
+        """测试同一频道的新视频分批批量下载，history/logs仍按视频记录。"""
+        mock_get_channel_ids.return_value = ["channel1"]
+        mock_has_records.return_value = True
+        mock_get_videos.return_value = [
+            {"video_id": f"v{i}", "title": "T", "upload_date": "20250101", "channel_name": "C"} for i in range(5)
+        ]
+        mock_filter_new.side_effect = lambda ids: list(ids)
+        mock_download_videos.side_effect = lambda videos, config, **kwargs: {
+            video["video_id"]: None if video["video_id"] == "v1" else f"/downloads/{video['video_id']}.mp4" for video in videos
+        }
+        mock_download_video.return_value = "/downloads/v4.mp4"
+        mock_config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test", "listing_mode": "full",
+                       "download_batch_size": 2}
+
+        check_and_download(mock_config)
+
+        # 多个下载worker并发领取批次，调用顺序不固定
+        batches = sorted([video["video_id"] for video in call.args[0]] for call in mock_download_videos.call_args_list)
+        assert batches == [["v0", "v1"], ["v2", "v3"]]
+        # 余下的单个视频走单视频下载
+        assert mock_download_video.call_args.args[0] == "v4"
+        assert sorted(call.args[0] for call in mock_record_download.call_args_list if call.args[2] == "success") == ["v0", "v2", "v3", "v4"]
+        mock_record_download.assert_any_call("v1", "channel1", "failed", None, "False")
+
+    @patch('main.get_videos')
+    @patch('main.has_records_for_channel')
+    def test_scan_channel_stops_at_watermark(self, mock_has_records, mock_get_videos):
+        """测试扫描在水位线或已下载视频处停止，并返回停止处的已知视频。"""
+        mock_has_records.return_value = True
+        listing = [
+            {"video_id": "new1", "title": "T", "upload_date": "20250103", "channel_name": "C"},
+            {"video_id": "mark", "title": "T", "upload_date": "20250102", "channel_name": "C"},
+        ]
+
+        def fake_get_videos(channel_id, is_first, config, stop_at=None, info_dir=None, failures=None):
+            result = []
+            for video in listing:
+                if stop_at(video):
+                    break
+                result.append(video)
+            return result
+
+        mock_get_videos.side_effect = fake_get_videos
+        with patch('main.get_channel_watermark', return_value={"video_id": "mark", "upload_date": "20250102"}):
+            is_first, videos, known_video = scan_channel("channel1", {"listing_mode": "full"})
+
+        assert not is_first
+        assert [video["video_id"] for video in videos] == ["new1"]
+        assert known_video["video_id"] == "mark"
+
+    @patch('main.fetch_video_metadata')
+    @patch('main.filter_new_video_ids')
+    @patch('main.get_videos')
+    @patch('main.has_records_for_channel')
+    def test_scan_channel_flat_fetches_metadata_for_new_only(self, mock_has_records, mock_get_videos, mock_filter_new, mock_fetch):
+        """测试flat列举模式只为未下载视频获取完整元数据。"""
+        mock_has_records.return_value = True
+        mock_get_videos.return_value = [
+            {"video_id": "new1", "title": "T", "upload_date": "", "channel_name": ""},
+            {"video_id": "old1", "title": "T", "upload_date": "", "channel_name": ""},
+        ]
+        mock_filter_new.return_value = ["new1"]
+        full = [{"video_id": "new1", "title": "T", "upload_date": "20250101", "channel_name": "C"}]
+        mock_fetch.return_value = full
+        config = {"listing_mode": "flat"}
+
+        is_first, videos, known_video = scan_channel("channel1", config)
+
+        mock_fetch.assert_called_once_with(["new1"], "channel1", config, info_dir=INFO_DIR, failures={})
+        assert videos == full
+
+    @patch('main.fetch_feed')
+    @patch('main.filter_new_video_ids')
+    @patch('main.get_videos')
+    @patch('main.has_records_for_channel')
+    def test_scan_channel_feed_without_new_videos_skips_scan(self, mock_has_records, mock_get_videos, mock_filter_new, mock_fetch_feed):
+        """测试订阅源中没有未下载视频时跳过yt-dlp扫描，并写入订阅源缓存。"""
+        mock_has_records.return_value = True
+        feed_videos = [{"video_id": "old1", "title": "T", "upload_date": "20250101", "channel_name": "C", "channel_uc_id": "UCx"}]
+        mock_fetch_feed.return_value = {"url": "u", "videos": feed_videos, "etag": "e1", "last_modified": None,
+                                        "body_hash": "h1", "unchanged": False}
+        mock_filter_new.return_value = []
+        stats = FeedCacheStats()
+
+        with patch('main.get_channel_resolution', return_value=RESOLVED), patch('main.set_http_cache') as mock_set_cache:
+            is_first, videos, known_video = scan_channel("channel1", {"listing_mode": "full"}, stats)
+
+        mock_get_videos.assert_not_called()
+        assert videos == []
+        assert known_video == feed_videos[0]
+        mock_set_cache.assert_called_once_with(
+            "https://www.youtube.com/feeds/videos.xml?channel_id=UCx", "channel1", "e1", None, "h1", []
+        )
+        assert (stats.hits, stats.misses) == (0, 1)
+
+    @patch('main.fetch_feed')
+    @patch('main.get_videos')
+    @patch('main.has_records_for_channel', return_value=True)
+    def test_scan_channel_feed_only_videos_scanned_once(self, mock_has_records, mock_get_videos, mock_fetch_feed):
+        """测试订阅源中不在/videos列表里的视频（Shorts、直播）只触发一次回退扫描，之后跳过扫描，且回退扫描后写入缓存。"""
+        feed_videos = [{"video_id": video_id, "title": "T", "upload_date": "20250102", "channel_name": "C", "channel_uc_id": "UCx"}
+                       for video_id in ("short1", "old1")]
+        mock_fetch_feed.return_value = {"url": "u", "videos": feed_videos, "etag": None, "last_modified": None,
+                                        "body_hash": "h1", "unchanged": False}
+        mock_get_videos.side_effect = lambda *args, stop_at=None, **kwargs: [] if stop_at(feed_videos[1]) else [feed_videos[1]]
+        mark_downloaded("old1", "UCx")
+
+        with patch('main.get_channel_resolution', return_value=RESOLVED), \
+                patch('main.get_http_cache', side_effect=get_http_cache), \
+                patch('main.set_http_cache', side_effect=set_http_cache), \
+                patch('main.is_downloaded', side_effect=is_downloaded):
+            assert scan_channel("channel1", {"listing_mode": "full"})[1] == []
+            # 回退扫描没有发现新视频时也写入缓存；订阅源中有被忽略的视频，不写验证信息
+            assert get_http_cache(feed_url("UCx")) == {"etag": None, "last_modified": None, "body_hash": None, "ignored_ids": ["short1"]}
+            assert scan_channel("channel1", {"listing_mode": "full"})[1] == []
+
+        mock_get_videos.assert_called_once()
+        assert mock_fetch_feed.call_args[0][2]["ignored_ids"] == ["short1"]
+
+    @patch('main.fetch_feed')
+    @patch('main.get_videos')
+    @patch('main.has_records_for_channel', return_value=True)
+    def test_scan_channel_feed_unavailable_video_not_cached(self, mock_has_records, mock_get_videos, mock_fetch_feed):
+        """测试订阅源中有负缓存的视频（等待首播）时跳过扫描，但不写验证信息，水位线取最新的已下载视频。"""
+        feed_videos = [{"video_id": video_id, "title": "T", "upload_date": "20250102", "channel_name": "C", "channel_uc_id": "UCx"}
+                       for video_id in ("premiere1", "old1")]
+        mock_fetch_feed.return_value = {"url": "u", "videos": feed_videos, "etag": "e1", "last_modified": None,
+                                        "body_hash": "h1", "unchanged": False}
+        mark_downloaded("old1", "UCx")
+
+        with patch('main.get_channel_resolution', return_value=RESOLVED), \
+                patch('main.get_unavailable_videos', return_value={"premiere1": "upcoming"}), \
+                patch('main.set_http_cache') as mock_set_cache:
+            is_first, videos, known_video = scan_channel("channel1", {"listing_mode": "full"})
+
+        mock_get_videos.assert_not_called()
+        assert videos == []
+        assert known_video == feed_videos[1]
+        mock_set_cache.assert_called_once_with(feed_url("UCx"), "channel1", None, None, None, [])
+
+    @patch('main.fetch_feed')
+    @patch('main.get_videos')
+    @patch('main.has_records_for_channel', return_value=True)
+    def test_scan_channel_feed_queued_videos_skip_scan(self, mock_has_records, mock_get_videos, mock_fetch_feed):
+        """测试订阅源中的视频已有未完成的下载任务（等待重试）时不回退到yt-dlp扫描。"""
+        feed_videos = [{"video_id": video_id, "title": "T", "upload_date": "20250102", "channel_name": "C", "channel_uc_id": "UCx"}
+                       for video_id in ("retry1", "old1")]
+        mock_fetch_feed.return_value = {"url": "u", "videos": feed_videos, "etag": None, "last_modified": None,
+                                        "body_hash": "h1", "unchanged": False}
+        mark_downloaded("old1", "UCx")
+        enqueue_jobs("channel1", False, [feed_videos[0]])
+
+        with patch('main.get_channel_resolution', return_value=RESOLVED):
+            assert scan_channel("channel1", {"listing_mode": "full"})[1] == []
+
+        mock_get_videos.assert_not_called()
+
+    @patch('main.fetch_feed')
+    @patch('main.filter_new_video_ids')
+    @patch('main.get_videos')
+    @patch('main.has_records_for_channel')
+    def test_scan_channel_feed_unchanged_short_circuits(self, mock_has_records, mock_get_videos, mock_filter_new, mock_fetch_feed):
+        """测试订阅源未变化（304/哈希一致）时不排重、不扫描，已知视频取水位线。"""
+        mock_has_records.return_value = True
+        mock_fetch_feed.return_value = {"url": "u", "videos": [], "etag": "e1", "last_modified": None,
+                                        "body_hash": "h1", "unchanged": True}
+        watermark = {"video_id": "mark", "upload_date": "20250101"}
+        stats = FeedCacheStats()
+
+        with patch('main.get_channel_resolution', return_value=RESOLVED), \
+                patch('main.get_channel_watermark', return_value=watermark), \
+                patch('main.get_http_cache', return_value={"etag": "e1", "last_modified": None, "body_hash": "h1"}):
+            is_first, videos, known_video = scan_channel("channel1", {"listing_mode": "full"}, stats)
+
+        assert mock_fetch_feed.call_args[0][2] == {"etag": "e1", "last_modified": None, "body_hash": "h1"}
+        mock_filter_new.assert_not_called()
+        mock_get_videos.assert_not_called()
+        assert videos == []
+        assert known_video == watermark
+        assert (stats.hits, stats.misses) == (1, 0)
+
+    @patch('main.fetch_feed')
+    @patch('main.filter_new_video_ids')
+    @patch('main.get_videos')
+    @patch('main.has_records_for_channel')
+    def test_scan_channel_feed_with_new_video_runs_scan(self, mock_has_records, mock_get_videos, mock_filter_new, mock_fetch_feed):
+        """测试订阅源出现新视频时照常扫描且不写缓存，并记录扫描得到的UC ID。"""
+        mock_has_records.return_value = True
+        feed_videos = [{"video_id": "new1", "title": "T", "upload_date": "20250102", "channel_name": "C", "channel_uc_id": "UCx"}]
+        mock_fetch_feed.return_value = {"url": "u", "videos": feed_videos, "etag": None, "last_modified": None,
+                                        "body_hash": "h2", "unchanged": False}
+        mock_filter_new.side_effect = lambda ids: list(ids)
+        mock_get_videos.return_value = [{"video_id": "new1", "title": "T", "upload_date": "20250102", "channel_name": "C", "channel_uc_id": "UCnew"}]
+
+        with patch('main.get_channel_resolution', return_value=RESOLVED), patch('main.set_channel_resolution') as mock_set_resolution, \
+                patch('main.set_http_cache') as mock_set_cache:
+            is_first, videos, known_video = scan_channel("channel1", {"listing_mode": "full"})
+
+        mock_get_videos.assert_called_once()
+        mock_set_cache.assert_not_called()
+        assert [video["video_id"] for video in videos] == ["new1"]
+        mock_set_resolution.assert_called_once_with("channel1", "UCnew", "C")
+
+    @patch('main.get_videos')
+    @patch('main.has_records_for_channel')
+    def test_scan_channel_resolves_handle_and_uses_uc_id(self, mock_has_records, mock_get_videos):
+        """测试无解析缓存时解析handle并保存，之后按UC ID判断首次运行和访问频道。"""
+        mock_has_records.return_value = True
+        mock_get_videos.return_value = [{"video_id": "new1", "title": "T", "upload_date": "20250102", "channel_name": "C", "channel_uc_id": "UCx"}]
+
+        with patch('main.resolve_channel', return_value={"uc_id": "UCx", "uploader": "C"}), \
+                patch('main.set_channel_resolution') as mock_set_resolution:
+            is_first, videos, known_video = scan_channel("handle", {"listing_mode": "full", "feed_check": False})
+
+        mock_set_resolution.assert_called_once_with("handle", "UCx", "C")
+        mock_has_records.assert_called_once_with("UCx")
+        assert mock_get_videos.call_args[0][0] == "UCx"
+        assert not is_first
+
+    @patch('main.get_videos')
+    @patch('main.has_records_for_channel')
+    def test_scan_channel_drops_resolution_when_uc_listing_fails(self, mock_has_records, mock_get_videos):
+        """测试按UC ID未取到任何视频时清除解析缓存；未过期的缓存不重新解析。"""
+        mock_has_records.return_value = True
+        mock_get_videos.return_value = []
+
+        with patch('main.get_channel_resolution', return_value=RESOLVED), \
+                patch('main.resolve_channel') as mock_resolve, \
+                patch('main.delete_channel_resolution') as mock_delete:
+            scan_channel("handle", {"listing_mode": "full", "feed_check": False})
+
+        mock_resolve.assert_not_called()
+        mock_delete.assert_called_once_with("handle")
+
+    @patch('main.get_channel_ids', return_value=["channel1"])
+    @patch('main.has_records_for_channel', return_value=True)
+    @patch('main.get_videos')
+    @patch('main.download_video')
+    def test_scan_does_not_wait_for_downloads(self, mock_download_video, mock_get_videos, mock_has_records, mock_get_channel_ids):
+        """测试使用长期运行的流水线时扫描结束即返回，下载在后台继续，调度器不等待下载。"""
+        mock_get_videos.return_value = [{"video_id": "v1", "title": "T", "upload_date": "20250101", "channel_name": "C"}]
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_download(video_id, *args, **kwargs):
+            started.set()
+            release.wait(10)
+            return "/downloads/v1.mp4"
+
+        mock_download_video.side_effect = slow_download
+        config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test", "listing_mode": "full"}
+
+        async def run():
+            pipeline = DownloadPipeline(config)
+            pipeline.start()
+            try:
+                await asyncio.wait_for(check_channels(config, ["channel1"], pipeline), timeout=2)
+                assert await asyncio.to_thread(started.wait, 5)
+                release.set()
+                await pipeline.drain()
+            finally:
+                pipeline.close()
+
+        asyncio.run(run())
+        flush_downloads()
+        assert is_downloaded("v1")
+
+    @patch('main.get_channel_ids')
+    @patch('main.has_records_for_channel')
+    @patch('main.get_videos')
+    @patch('main.filter_new_video_ids')
+    @patch('main.download_video')
+    @patch('main.logger')
+    def test_watermark_advanced_only_without_failures(self, mock_logger, mock_download_video, mock_filter_new, mock_get_videos, mock_has_records, mock_get_channel_ids, mock_channel_state):
+        """测试只有任务全部完成的频道才推进水位线，等待重试的任务使水位线保持不动。"""
+        mock_get_channel_ids.return_value = ["good", "bad"]
+        mock_has_records.return_value = True
+        mock_get_videos.side_effect = lambda channel_id, is_first, config, stop_at=None, info_dir=None, failures=None: [
+            {"video_id": f"{channel_id}_v", "title": "T", "upload_date": "20250101", "channel_name": "C"}
+        ]
+        mock_filter_new.side_effect = lambda ids: list(ids)
+        mock_download_video.side_effect = lambda video_id, *args, **kwargs: None if video_id == "bad_v" else "/ok.mp4"
+        mock_config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test", "listing_mode": "full"}
+
+        with patch('main.is_downloaded', side_effect=is_downloaded):
+            check_and_download(mock_config)
+
+        mock_channel_state.assert_called_once_with("good", "good_v", "20250101")
+
+    def test_watermark_not_advanced_to_undownloaded_video(self, mock_channel_state):
+        """测试频道的任务都已结束但最新视频未下载（不可用而删除任务）时不把它作为水位线。"""
+        pipeline = DownloadPipeline({})
+        pipeline.hold_watermark("channel1", {"video_id": "premiere1", "upload_date": "20250102"})
+        pipeline.advance_watermarks()
+        pipeline.close()
+
+        mock_channel_state.assert_not_called()
+        assert pipeline.watermarks == {}
+
+    @patch('main.get_channel_ids')
+    @patch('main.has_records_for_channel')
+    @patch('main.get_videos')
+    @patch('main.filter_new_video_ids')
+    @patch('main.download_video')
+    @patch('main.record_download')
+    @patch('main.logger')
+    def test_transfer_failure_not_recorded_as_success(self, mock_logger, mock_record_download, mock_download_video, mock_filter_new, mock_get_videos, mock_has_records, mock_get_channel_ids, mock_channel_state):
+        """测试下载完成但传输失败时记录失败，不标记已下载，不推进水位线。"""
+        mock_get_channel_ids.return_value = ["channel1"]
+        mock_has_records.return_value = True
+        mock_get_videos.return_value = [{"video_id": "v1", "title": "T", "upload_date": "20250101", "channel_name": "C"}]
+        mock_filter_new.side_effect = lambda ids: list(ids)
+        mock_download_video.return_value = "staging/v1/v1.mp4"
+        mock_config = {"query_limit": 50, "first_run_limit": 10, "max_retries": 3, "proxy": "test", "listing_mode": "full"}
+
+        with patch('main.transfer_video', side_effect=OSError("share unavailable")):
+            check_and_download(mock_config)
+
+        mock_record_download.assert_called_once_with("v1", "channel1", "failed", None, "False")
+        mock_channel_state.assert_not_called()
+
     def test_signal_handler(self):
         """测试信号处理程序。"""
         with patch('main.logger') as mock_logger:
@@ -130,15 +590,17 @@ class TestMain:
 
     @patch('main.load_config')
     @patch('main.init_db')
-    @patch('main.check_and_download')
+    @patch('main.load_downloaded_index')
+    @patch('main.check_channels')
     @patch('main.setup_schedule')
     @patch('main.run_loop')
     @patch('main.signal.signal')
     @patch('main.logger')
-    def test_main_entry_point(self, mock_logger, mock_signal, mock_run_loop, mock_setup_schedule, mock_check_and_download, mock_init_db, mock_load_config):
+    def test_main_entry_point(self, mock_logger, mock_signal, mock_run_loop, mock_setup_schedule, mock_check_channels, mock_load_index, mock_init_db, mock_load_config):
         """测试main入口点逻辑（if __name__ == "__main__"）。"""
         mock_config = {"interval_min": 30}
         mock_load_config.return_value = mock_config
+        mock_load_index.return_value = DownloadedIndex(1000)
         
         # 由于run_loop无限循环，使用side_effect模拟KeyboardInterrupt
         mock_run_loop.side_effect = KeyboardInterrupt
@@ -152,19 +614,78 @@ class TestMain:
         mock_load_config.assert_called_once()
         mock_init_db.assert_called_once()
         mock_logger.info.assert_any_call("YouTube订阅视频下载器启动")
-        mock_check_and_download.assert_called_once_with(mock_config)
+        # 检查由调度器按频道触发，不再启动时全量检查
+        mock_check_channels.assert_not_called()
         
         # setup_schedule调用
         mock_setup_schedule.assert_called_once()
         # 检查wrapper函数
         wrapper = mock_setup_schedule.call_args[0][0]
         assert callable(wrapper)
-        wrapper()  # 调用wrapper应调用check_and_download
-        mock_check_and_download.assert_called_with(mock_config)
+        asyncio.run(wrapper(["channel1"]))  # 调用wrapper应只检查到期的频道
+        assert mock_check_channels.await_args.args[:2] == (mock_config, ["channel1"])
         
-        mock_run_loop.assert_called_once()
+        mock_run_loop.assert_called_once_with(mock_setup_schedule.return_value)
         mock_logger.info.assert_any_call("脚本停止")  # KeyboardInterrupt处理
 
+    @patch('main.record_download')
+    def test_recover_staged_downloads_records_history(self, mock_record_download):
+        """测试启动时恢复的暂存视频补记history/logs。"""
+        meta = {"video_id": "v1", "channel_id": "UCx", "is_first": False, "file_path": "/downloads/a.mp4"}
+        with patch('main.recover_staging', return_value=[meta]), patch('main.flush_downloads') as mock_flush:
+            recover_staged_downloads({"download_dir": "/downloads"})
+
+        mock_record_download.assert_called_once_with("v1", "UCx", "success", "/downloads/a.mp4", "False")
+        mock_flush.assert_called_once()
+
+    @patch('main.get_channel_ids', return_value=["channel1"])
+    @patch('main.download_video')
+    def test_interrupted_jobs_resume_after_restart(self, mock_download_video, mock_get_channel_ids):
+        """测试上次运行中断的任务在重启后直接续做，不需要重新扫描频道；失败的任务按退避稍后重试。"""
+        video = {"video_id": "v1", "title": "T", "upload_date": "20250101", "channel_name": "C"}
+        enqueue_jobs("channel1", False, [video, dict(video, video_id="v2")])
+        claim_jobs("crashed-worker", 2)
+        mock_download_video.side_effect = lambda video_id, *args, **kwargs: "/downloads/v1.mp4" if video_id == "v1" else None
+
+        recover_staged_downloads({})
+        with patch('main.get_videos') as mock_get_videos:
+            check_and_download({"max_retries": 3, "proxy": "test"}, [])
+
+        mock_get_videos.assert_not_called()
+        assert sorted(call.args[0] for call in mock_download_video.call_args_list) == ["v1", "v2"]
+        assert is_downloaded("v1") and not is_downloaded("v2")
+        assert claim_jobs("w", 2) == []
+        assert next_job_due_at() > time.time()
+
+    @patch('main.terminate_processes')
+    @patch('main.setup_schedule')
+    @patch('main.logger')
+    def test_serve_stops_on_sigterm(self, mock_logger, mock_setup_schedule, mock_terminate):
+        """测试SIGTERM取消调度任务：serve正常返回并终止yt-dlp子进程。"""
+        async def fake_run_loop(scheduler):
+            os.kill(os.getpid(), signal.SIGTERM)
+            await asyncio.sleep(3600)
+
+        with patch('main.run_loop', side_effect=fake_run_loop):
+            asyncio.run(asyncio.wait_for(serve({}), timeout=10))
+
+        mock_terminate.assert_called_once()
+        mock_logger.info.assert_any_call("接收到停止信号，优雅关闭...")
+
+    @patch('main.load_config')
+    @patch('main.init_db')
+    @patch('main.print_timetable')
+    @patch('main.run_loop')
+    @patch('main.signal.signal')
+    def test_main_dry_run_prints_timetable(self, mock_signal, mock_run_loop, mock_print_timetable, mock_init_db, mock_load_config):
+        """测试--dry-run只打印时间表，不进入调度循环。"""
+        mock_load_config.return_value = {"interval_min": 30}
+
+        main(["--dry-run"])
+
+        mock_print_timetable.assert_called_once_with({"interval_min": 30})
+        mock_run_loop.assert_not_called()
+
     @patch('main.load_config')
     def test_main_config_load_failure(self, mock_load_config):
         """测试配置加载失败时退出。"""
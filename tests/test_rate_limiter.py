@@ -0,0 +1,188 @@
+import threading
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+
+from src.downloader import rate_limiter
+from src.downloader.channel_checker import fetch_feed, get_videos
+from src.downloader.rate_limiter import (
+    BOT_CHECK,
+    MEMBERS_ONLY,
+    PRIVATE,
+    REGION_BLOCKED,
+    REMOVED,
+    THROTTLED,
+    UPCOMING,
+    RequestCoordinator,
+    RequestsCancelled,
+    classify_failure,
+    classify_video_failures,
+)
+from src.downloader.video_downloader import download_video, download_videos
+from tests.test_channel_checker import make_popen
+
+
+class TestClassifyFailure:
+    @pytest.mark.parametrize("stderr, kind", [
+        ("ERROR: [youtube] abc: HTTP Error 429: Too Many Requests", THROTTLED),
+        ("ERROR: [youtube] abc: Video unavailable. This content isn't available, try again later.", THROTTLED),
+        ("ERROR: [youtube] abc: Sign in to confirm you’re not a bot. Use --cookies", BOT_CHECK),
+        ("ERROR: [youtube] abc: This video is available to this channel's members on level: X", MEMBERS_ONLY),
+        ("ERROR: [youtube] abc: Private video. Sign in if you've been granted access", PRIVATE),
+        ("ERROR: [youtube] abc: Video unavailable. The uploader has not made this video available in your country", REGION_BLOCKED),
+        ("ERROR: [youtube] abc: Premieres in 3 hours", UPCOMING),
+        ("ERROR: [youtube] abc: This video has been removed by the uploader", REMOVED),
+        ("ERROR: [youtube] abc: Video unavailable. This video is no longer available because the YouTube account "
+         "associated with this video has been terminated.", REMOVED),
+        ("ERROR: unable to download video data: <urlopen error timed out>", None),
+    ])
+    def test_classify(self, stderr, kind):
+        """测试按stderr识别失败原因。"""
+        assert classify_failure(stderr) == kind
+
+
+    def test_classify_per_video(self):
+        """测试从批量调用的stderr中逐个视频识别不可用原因，忽略临时错误和限流回复。"""
+        stderr = (
+            "ERROR: [youtube] aaaaaaaaaaa: Private video. Sign in if you've been granted access\n"
+            "WARNING: [youtube] bbbbbbbbbbb: falling back\n"
+            "ERROR: [youtube] ccccccccccc: This video has been removed by the uploader\n"
+            "ERROR: [youtube] ddddddddddd: Premieres in 2 hours\n"
+            "ERROR: [youtube] eeeeeeeeeee: unable to download video data: timed out\n"
+            "ERROR: [youtube] fffffffffff: Video unavailable. This content isn't available, try again later.\n"
+        )
+        assert classify_video_failures(stderr) == {"aaaaaaaaaaa": PRIVATE, "ccccccccccc": REMOVED, "ddddddddddd": UPCOMING}
+
+
+class TestRequestCoordinator:
+    def test_token_bucket_paces_after_burst(self):
+        """测试突发额度用完后按速率准入。"""
+        coordinator = RequestCoordinator(rate_per_min=600, burst=2)
+        started = time.monotonic()
+        for _ in range(3):
+            with coordinator.request():
+                pass
+        assert time.monotonic() - started >= 0.09
+
+    def test_throttling_opens_circuit_for_everyone(self):
+        """测试一个请求遇到限流后所有请求暂停，探测成功后恢复且退避复位。"""
+        coordinator = RequestCoordinator(rate_per_min=6000, burst=10)
+        with patch.object(rate_limiter, "BACKOFF_BASE_SEC", 0.2):
+            with coordinator.request() as request:
+                request.failure = THROTTLED
+            started = time.monotonic()
+            with coordinator.request():
+                pass
+            assert time.monotonic() - started >= 0.15
+        assert coordinator._backoff == 0
+
+    def test_probe_failure_doubles_backoff(self):
+        """测试探测请求再次被限流时退避加倍。"""
+        coordinator = RequestCoordinator(rate_per_min=6000, burst=10)
+        with patch.object(rate_limiter, "BACKOFF_BASE_SEC", 0.05):
+            for _ in range(2):
+                with coordinator.request() as request:
+                    request.failure = BOT_CHECK
+        assert coordinator._backoff == 0.1
+
+    def test_only_one_probe_while_half_open(self):
+        """测试熔断结束后只放行一个探测请求，其余等待探测结果。"""
+        coordinator = RequestCoordinator(rate_per_min=6000, burst=10)
+        with patch.object(rate_limiter, "BACKOFF_BASE_SEC", 0.01):
+            with coordinator.request() as request:
+                request.failure = THROTTLED
+            time.sleep(0.02)
+            assert coordinator.admit() is True
+            admitted = threading.Event()
+            waiter = threading.Thread(target=lambda: (coordinator.admit(), admitted.set()))
+            waiter.start()
+            assert not admitted.wait(0.1)
+            coordinator.report(True, None)
+            assert admitted.wait(1)
+            waiter.join()
+
+    def test_cancel_releases_waiters(self):
+        """测试停止时等待中的请求抛出RequestsCancelled。"""
+        coordinator = RequestCoordinator(rate_per_min=6000, burst=10)
+        with coordinator.request() as request:
+            request.failure = THROTTLED
+        errors = []
+
+        def wait():
+            try:
+                coordinator.admit()
+            except RequestsCancelled as e:
+                errors.append(e)
+
+        waiter = threading.Thread(target=wait)
+        waiter.start()
+        coordinator.cancel()
+        waiter.join(timeout=1)
+        assert len(errors) == 1
+
+
+class TestThrottledCallers:
+    @patch('subprocess.Popen')
+    def test_get_videos_does_not_retry_when_throttled(self, mock_popen):
+        """测试扫描遇到限流时不再本地重试。"""
+        mock_popen.return_value = make_popen(returncode=1, stderr="ERROR: HTTP Error 429: Too Many Requests\n")
+
+        config = {"query_limit": 5, "first_run_limit": 5, "max_retries": 3, "proxy": "p", "listing_mode": "full"}
+        with patch('time.sleep') as mock_sleep:
+            assert get_videos("testchannel", False, config) == []
+
+        assert mock_popen.call_count == 1
+        mock_sleep.assert_not_called()
+
+    def test_network_error_does_not_close_circuit(self):
+        """测试探测请求遇到网络异常时不被当作成功，熔断保持打开。"""
+        coordinator = rate_limiter.get_coordinator({})
+        with patch.object(rate_limiter, "BACKOFF_BASE_SEC", 0.01):
+            with coordinator.request() as request:
+                request.failure = THROTTLED
+            time.sleep(0.02)
+            with patch('src.downloader.channel_checker.http_get', side_effect=OSError("connection reset")):
+                assert fetch_feed("UCtest", {"proxy": ""}) is None
+
+        assert coordinator._backoff == 0.01
+        assert not coordinator._probing
+
+    def test_download_stops_on_permanent_failure(self, tmp_path, monkeypatch):
+        """测试视频不可用时下载不再重试。"""
+        monkeypatch.chdir(tmp_path)
+
+        def fake_popen(cmd, stderr=None, **kwargs):
+            stderr.write("ERROR: [youtube] video1: Private video\n")
+            return Mock(returncode=1)
+
+        config = {"download_format": "best", "max_retries": 3, "proxy": "p"}
+        failures = {}
+        with patch('subprocess.Popen', side_effect=fake_popen) as mock_popen, patch('time.sleep') as mock_sleep:
+            assert download_video("video1", "C", "20250101", "A", config, failures=failures) is None
+
+        assert failures == {"video1": PRIVATE}
+        assert mock_popen.call_count == 1
+        mock_sleep.assert_not_called()
+
+    def test_batch_does_not_retry_unavailable_videos(self, tmp_path, monkeypatch):
+        """测试批量下载中不可用的视频不再逐个回退，原因写入failures。"""
+        monkeypatch.chdir(tmp_path)
+
+        def fake_popen(cmd, stderr=None, **kwargs):
+            stderr.write("ERROR: [youtube] aaaaaaaaaaa: This video has been removed by the uploader\n")
+            return Mock(returncode=1)
+
+        videos = [
+            {"video_id": video_id, "channel_name": "C", "upload_date": "20250101", "title": "T"}
+            for video_id in ("aaaaaaaaaaa", "bbbbbbbbbbb")
+        ]
+        config = {"download_format": "best", "max_retries": 1, "proxy": "p"}
+        failures = {}
+        with patch('subprocess.Popen', side_effect=fake_popen), \
+                patch('src.downloader.video_downloader.download_video', return_value=None) as mock_single:
+            results = download_videos(videos, config, transfer=False, failures=failures)
+
+        assert results == {"aaaaaaaaaaa": None, "bbbbbbbbbbb": None}
+        assert failures == {"aaaaaaaaaaa": REMOVED}
+        assert [call.args[0] for call in mock_single.call_args_list] == ["bbbbbbbbbbb"]
@@ -1,53 +1,221 @@
+import asyncio
 import time
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, Mock, patch
 
 import pytest
-import schedule
-
-from scheduler import run_loop, setup_schedule
-
-
-class TestScheduler:
-    def test_setup_schedule_sets_interval_from_config(self):
-        """测试使用配置中的interval_min设置定时任务。"""
-        mock_func = Mock()
-        config = {"interval_min": 15}
-        
-        with patch('schedule.every') as mock_every:
-            setup_schedule(mock_func, config)
-        
-        mock_every(15).minutes.do.assert_called_once_with(mock_func)
-
-    def test_setup_schedule_default_interval(self):
-        """测试默认interval_min=30。"""
-        mock_func = Mock()
-        config = {"interval_min": 30}  # 默认值
-        
-        with patch('schedule.every') as mock_every:
-            setup_schedule(mock_func, config)
-        
-        mock_every(30).minutes.do.assert_called_once_with(mock_func)
-
-    @patch('time.sleep')
-    @patch('schedule.run_pending')
-    def test_run_loop_runs_pending_jobs(self, mock_run_pending, mock_sleep):
-        """测试run_loop运行pending任务。"""
-        mock_run_pending.return_value = None
-        mock_sleep.return_value = None
-        
-        # 限制循环次数
-        with patch('schedule.run_pending', side_effect=[True, False]):  # 模拟一次运行
-            with pytest.raises(StopIteration):  # 强制停止
-                gen = run_loop_generator()
-                next(gen)
-                next(gen)
-        
-        mock_run_pending.assert_called()
-        mock_sleep.assert_called_with(1)
-
-def run_loop_generator():
-    """生成器版本的run_loop用于测试。"""
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
-        yield
\ No newline at end of file
+
+from src.core.history_manager import (
+    get_channel_upload_times,
+    init_db,
+    load_poll_schedule,
+    enqueue_jobs,
+    log_download,
+    next_job_due_at,
+    save_poll_schedule,
+)
+from src.core.scheduler import (
+    MAX_SLEEP_SEC,
+    PollScheduler,
+    compute_poll_interval,
+    print_timetable,
+    run_loop,
+    setup_schedule,
+)
+
+HOUR = 3600
+DAY = 24 * HOUR
+CONFIG = {"interval_min": 1440, "poll_min_interval_min": 60, "poll_max_interval_min": 10080,
+          "stagger_window_min": 60, "scan_jitter": 0}
+
+
+@pytest.fixture
+def schedule_db(temp_db_path):
+    """把调度器使用的数据库指向临时文件。"""
+    init_db(temp_db_path)
+    with patch('src.core.scheduler.load_poll_schedule', lambda: load_poll_schedule(temp_db_path)), \
+            patch('src.core.scheduler.save_poll_schedule', lambda *args: save_poll_schedule(*args, db_path=temp_db_path)), \
+            patch('src.core.scheduler.delete_poll_schedule') as mock_delete, \
+            patch('src.core.scheduler.get_channel_upload_times', return_value=[]), \
+            patch('src.core.scheduler.next_job_due_at', lambda: next_job_due_at(temp_db_path)):
+        yield temp_db_path, mock_delete
+
+
+class TestComputePollInterval:
+    def test_no_history_uses_interval_min(self):
+        """测试没有上传记录时使用interval_min。"""
+        assert compute_poll_interval([], time.time(), CONFIG) == 1440 * 60
+
+    def test_active_channel_polls_more_often(self):
+        """测试每小时上传的频道按最小间隔轮询，每天上传的频道约6小时一次。"""
+        now = time.time()
+        hourly = [now - i * HOUR for i in range(10)]
+        daily = [now - i * DAY for i in range(10)]
+        assert compute_poll_interval(hourly, now, CONFIG) == 60 * 60
+        assert compute_poll_interval(daily, now, CONFIG) == DAY / 4
+
+    def test_dormant_channel_backs_off_to_max(self):
+        """测试长期未上传的频道放缓到最大间隔。"""
+        now = time.time()
+        dormant = [now - 200 * DAY, now - 380 * DAY]
+        assert compute_poll_interval(dormant, now, CONFIG) == 10080 * 60
+
+
+class TestPollScheduler:
+    def test_new_channels_due_immediately_and_rescheduled(self, schedule_db):
+        """测试新频道错开到期（第一个立即到期），检查后按上传节奏排期并持久化。"""
+        db_path, _ = schedule_db
+        scheduler = PollScheduler(Mock(), CONFIG)
+        now = time.time()
+        scheduler.sync_channels(["a", "b"], now)
+
+        assert scheduler.pop_due(now) == ["a"]
+        assert scheduler.pop_due(now + 30 * 60) == ["b"]
+
+        scheduler.reschedule(["a", "b"], now)
+        assert scheduler.next_poll_at() == now + 1440 * 60
+        assert load_poll_schedule(db_path) == {"a": now + 1440 * 60, "b": now + 1440 * 60}
+
+    def test_schedule_survives_restart(self, schedule_db):
+        """测试重启后按持久化的计划调度，未到期的频道不检查。"""
+        now = time.time()
+        save_poll_schedule("a", now + HOUR, HOUR, db_path=schedule_db[0])
+        save_poll_schedule("b", now - 1, HOUR, db_path=schedule_db[0])
+
+        scheduler = PollScheduler(Mock(), CONFIG)
+        scheduler.sync_channels(["a", "b"], now)
+
+        assert scheduler.pop_due(now) == ["b"]
+        assert scheduler.next_poll_at() == now + HOUR
+
+    def test_removed_channel_dropped(self, schedule_db):
+        """测试从channels.txt移除的频道不再调度并删除计划。"""
+        _, mock_delete = schedule_db
+        scheduler = PollScheduler(Mock(), CONFIG)
+        now = time.time()
+        scheduler.sync_channels(["a", "b"], now)
+        scheduler.sync_channels(["a"], now)
+
+        assert scheduler.pop_due(now) == ["a"]
+        mock_delete.assert_called_once_with("b")
+
+    def test_run_pending_checks_due_channels(self, schedule_db):
+        """测试run_pending只把到期频道交给check_func，出错时仍重新排期。"""
+        check_func = AsyncMock(side_effect=RuntimeError("boom"))
+        scheduler = setup_schedule(check_func, CONFIG)
+
+        with patch('src.core.scheduler.get_channel_ids', return_value=["a", "b"]):
+            with pytest.raises(RuntimeError):
+                asyncio.run(scheduler.run_pending())
+            asyncio.run(scheduler.run_pending())
+
+        check_func.assert_awaited_once_with(["a"])
+        assert [channel_id for _, channel_id in scheduler.timetable()] == ["b", "a"]
+        assert scheduler.idle_seconds() == MAX_SLEEP_SEC
+
+    def test_run_pending_runs_due_jobs_without_due_channels(self, schedule_db):
+        """测试没有到期频道时，到期的下载任务以空频道列表执行。"""
+        db_path, _ = schedule_db
+        check_func = AsyncMock()
+        scheduler = setup_schedule(check_func, CONFIG)
+        with patch('src.core.scheduler.get_channel_ids', return_value=["a"]):
+            asyncio.run(scheduler.run_pending())
+            check_func.assert_awaited_once_with(["a"])
+
+            enqueue_jobs("a", False, [{"video_id": "v1"}], db_path)
+            asyncio.run(scheduler.run_pending())
+
+        check_func.assert_awaited_with([])
+
+    def test_stagger_spreads_channels_with_jitter(self, schedule_db):
+        """测试一批新频道均匀分布在错开窗口内，抖动不超出各自时段。"""
+        scheduler = PollScheduler(Mock(), dict(CONFIG, scan_jitter=0.5))
+        now = time.time()
+        channel_ids = [f"c{i}" for i in range(60)]
+        scheduler.sync_channels(channel_ids, now)
+
+        table = dict((channel_id, at) for at, channel_id in scheduler.timetable())
+        assert table["c0"] == now
+        for i, channel_id in enumerate(channel_ids[1:], start=1):
+            assert now + i * 60 <= table[channel_id] <= now + i * 60 + 30
+        # 每分钟最多一个频道到期
+        assert scheduler.pop_due(now + 10 * 60 - 1) == channel_ids[:10]
+
+    def test_stagger_defaults_to_poll_interval(self, schedule_db):
+        """测试默认配置下一批频道分散在整个interval_min内，而不是集中在开始的一小时。"""
+        config = {key: value for key, value in CONFIG.items() if key != "stagger_window_min"}
+        scheduler = PollScheduler(Mock(), config)
+        now = time.time()
+        scheduler.sync_channels([f"c{i}" for i in range(24)], now)
+
+        times = [at for at, _ in scheduler.timetable()]
+        assert times[0] == now
+        assert times[-1] == now + 23 * HOUR
+        # 每小时一个频道到期
+        assert len(scheduler.pop_due(now + HOUR - 1)) == 1
+
+    def test_reschedule_jitter_bounded(self, schedule_db):
+        """测试重新排期的随机抖动不超过间隔的±scan_jitter。"""
+        scheduler = PollScheduler(Mock(), dict(CONFIG, scan_jitter=0.2))
+        now = time.time()
+        scheduler.reschedule([f"c{i}" for i in range(50)], now)
+        for at, _ in scheduler.timetable():
+            assert now + 1440 * 60 * 0.8 <= at <= now + 1440 * 60 * 1.2
+
+    def test_print_timetable_dry_run(self, schedule_db, capsys):
+        """测试--dry-run打印时间表且不写数据库。"""
+        db_path, mock_delete = schedule_db
+        with patch('src.core.scheduler.get_channel_ids', return_value=["a", "b"]):
+            print_timetable(CONFIG)
+
+        output = capsys.readouterr().out
+        assert "2 个频道的检查时间表" in output
+        assert output.index("  a") < output.index("  b")
+        assert load_poll_schedule(db_path) == {}
+
+    def test_upload_times_from_logs(self, temp_db_path):
+        """测试按非首次运行的成功下载记录估计上传节奏。"""
+        init_db(temp_db_path)
+        log_download("v1", "chan", "success", "/a.mp4", "True", temp_db_path)
+        log_download("v2", "chan", "failed", None, "False", temp_db_path)
+        log_download("v3", "chan", "success", "/b.mp4", "False", temp_db_path)
+
+        times = get_channel_upload_times("chan", temp_db_path)
+        assert len(times) == 1
+        assert abs(times[0] - time.time()) < 60
+
+
+class TestRunLoop:
+    @patch('asyncio.sleep')
+    def test_run_loop_runs_pending_and_sleeps(self, mock_sleep):
+        """测试run_loop运行到期任务后按调度器给出的时长休眠。"""
+        scheduler = Mock(run_pending=AsyncMock())
+        scheduler.idle_seconds.return_value = 12
+        mock_sleep.side_effect = [None, RuntimeError("stop")]
+
+        with pytest.raises(RuntimeError):
+            asyncio.run(run_loop(scheduler))
+
+        assert scheduler.run_pending.await_count == 2
+        mock_sleep.assert_awaited_with(12)
+
+    def test_run_loop_cancel_keeps_inflight_due(self, schedule_db):
+        """测试取消调度任务时进行中的检查被中断，到期频道保持到期且不写入poll_schedule。"""
+        started = asyncio.Event()
+
+        async def slow_check(channel_ids):
+            started.set()
+            await asyncio.sleep(3600)
+
+        async def scenario():
+            scheduler = setup_schedule(slow_check, CONFIG)
+            task = asyncio.create_task(run_loop(scheduler))
+            await started.wait()
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            return scheduler
+
+        with patch('src.core.scheduler.get_channel_ids', return_value=["a"]):
+            scheduler = asyncio.run(scenario())
+        assert scheduler.next_poll_at() <= time.time()
+        assert load_poll_schedule(schedule_db[0]) == {}
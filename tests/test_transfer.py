@@ -0,0 +1,96 @@
+import errno
+import os
+from unittest.mock import patch
+
+import pytest
+
+from src.downloader import transfer
+from src.downloader.transfer import transfer_file
+
+CONFIG = {"max_retries": 3}
+
+
+@pytest.fixture
+def cross_device():
+    """模拟源与目标位于不同文件系统：源文件的重命名失败（EXDEV），.part的重命名正常。"""
+    real_replace = os.replace
+
+    def fake_replace(src, dst):
+        if not str(src).endswith(".part"):
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        real_replace(src, dst)
+
+    with patch('src.downloader.transfer.os.replace', side_effect=fake_replace):
+        yield
+
+
+def make_source(tmp_path, size=3 * 1024 * 1024 + 7):
+    src = tmp_path / "staging" / "v1.mp4"
+    src.parent.mkdir()
+    data = os.urandom(size)
+    src.write_bytes(data)
+    return src, data
+
+
+class TestTransferFile:
+    def test_same_filesystem_renames(self, tmp_path):
+        """测试同一文件系统时直接重命名。"""
+        src, data = make_source(tmp_path)
+        dst = tmp_path / "out" / "a.mp4"
+
+        assert transfer_file(str(src), str(dst), CONFIG) == str(dst)
+        assert dst.read_bytes() == data
+        assert not src.exists()
+
+    @pytest.mark.parametrize("checksum", [False, True])
+    def test_cross_device_copies_and_verifies(self, tmp_path, cross_device, checksum):
+        """测试跨文件系统时分块复制（或内核复制）并校验，完成后删除源文件且不留.part。"""
+        src, data = make_source(tmp_path)
+        dst = tmp_path / "out" / "a.mp4"
+
+        with patch.object(transfer, "TRANSFER_CHUNK_SIZE", 1024 * 1024):
+            transfer_file(str(src), str(dst), dict(CONFIG, transfer_checksum=checksum))
+
+        assert dst.read_bytes() == data
+        assert not src.exists()
+        assert not (tmp_path / "out" / "a.mp4.part").exists()
+
+    def test_transient_error_retried(self, tmp_path, cross_device):
+        """测试传输中的网络错误按退避重试。"""
+        src, data = make_source(tmp_path)
+        dst = tmp_path / "out" / "a.mp4"
+        real_copy = transfer._copy_chunked
+        calls = []
+
+        def flaky_copy(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise OSError(errno.ECONNRESET, "Connection reset")
+            real_copy(*args)
+
+        with patch('src.downloader.transfer._copy_offload', return_value=False), \
+                patch('src.downloader.transfer._copy_chunked', side_effect=flaky_copy), \
+                patch('time.sleep') as mock_sleep:
+            transfer_file(str(src), str(dst), CONFIG)
+
+        assert len(calls) == 2
+        mock_sleep.assert_called_once_with(1)
+        assert dst.read_bytes() == data
+
+    def test_size_mismatch_keeps_source(self, tmp_path, cross_device):
+        """测试校验始终失败时抛出OSError，源文件保留以便之后恢复。"""
+        src, _ = make_source(tmp_path)
+        dst = tmp_path / "out" / "a.mp4"
+
+        def truncated_copy(src_path, dst_path, digest=None):
+            with open(dst_path, "wb") as f:
+                f.write(b"short")
+
+        with patch('src.downloader.transfer._copy_offload', return_value=False), \
+                patch('src.downloader.transfer._copy_chunked', side_effect=truncated_copy), \
+                patch('time.sleep'):
+            with pytest.raises(OSError, match="大小不一致"):
+                transfer_file(str(src), str(dst), CONFIG)
+
+        assert src.exists()
+        assert not dst.exists()
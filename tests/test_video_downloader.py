@@ -1,42 +1,50 @@
 import os
+import time
 from unittest.mock import Mock, patch
 
 import pytest
 
-from video_downloader import download_video
+from src.downloader.video_downloader import download_video, download_videos, gc_staging, recover_staging, stage_video
 
 
 class TestVideoDownloader:
+    @patch('src.downloader.video_downloader.transfer_file', side_effect=lambda src, dst, config: dst)
     @patch('os.makedirs')
     @patch('os.path.exists')
-    @patch('subprocess.run')
-    def test_download_success(self, mock_run, mock_exists, mock_makedirs):
-        """测试成功下载返回文件路径。"""
+    @patch('subprocess.Popen')
+    def test_download_success(self, mock_run, mock_exists, mock_makedirs, mock_transfer):
+        """测试成功下载到暂存目录后传输到download_dir，返回目标文件路径。"""
         mock_run.return_value = Mock(returncode=0)
         mock_exists.return_value = True
         mock_makedirs.return_value = None
 
-        config = {"download_format": "best[format]", "max_retries": 1, "proxy": "test_proxy"}
+        config = {"download_format": "best[format]", "max_retries": 1, "proxy": "test_proxy", "download_dir": "downloads"}
         file_path = download_video("video1", "Test Channel", "20250101", "Test / Title \\", config)
     
-        assert file_path == "downloads/Test_Channel_20250101_Test___Title__.mp4"
+        assert file_path == os.path.join("downloads", "Test_Channel_20250101_Test___Title__.mp4")
+        mock_transfer.assert_called_once_with(os.path.join("staging", "video1", "video1.mp4"), file_path, config)
         
         mock_run.assert_called_once()
         args = mock_run.call_args[0][0]
-        assert args[0] == "yt-dlp"
-        assert args[1] == "--proxy"
-        assert args[2] == "test_proxy"
-        assert args[3] == "-f"
-        assert args[4] == "best[format]"
-        assert args[5] == "--remux-video"
-        assert args[6] == "mp4"
-        assert args[7] == "-o"
-        assert args[8] == "downloads/Test_Channel_20250101_Test___Title__.%(ext)s"
-        assert args[9] == "https://www.youtube.com/watch?v=video1"
+        assert args == [
+            "yt-dlp",
+            "--proxy",
+            "test_proxy",
+            "-f",
+            "best[format]",
+            "--remux-video",
+            "mp4",
+            "--no-playlist",
+            "--mark-watched",
+            "--continue",
+            "-o",
+            os.path.join("staging", "video1", "video1.%(ext)s"),
+            "https://www.youtube.com/watch?v=video1",
+        ]
 
     @patch('os.makedirs')
     @patch('os.path.exists')
-    @patch('subprocess.run')
+    @patch('subprocess.Popen')
     def test_download_file_not_found(self, mock_run, mock_exists, mock_makedirs):
         """测试下载成功但文件不存在返回None。"""
         mock_run.return_value = Mock(returncode=0)
@@ -49,7 +57,7 @@ class TestVideoDownloader:
 
     @patch('os.makedirs')
     @patch('os.path.exists')
-    @patch('subprocess.run')
+    @patch('subprocess.Popen')
     def test_download_failure_no_retry(self, mock_run, mock_exists, mock_makedirs):
         """测试失败无重试返回None。"""
         mock_run.return_value = Mock(returncode=1)
@@ -60,10 +68,30 @@ class TestVideoDownloader:
         
         assert file_path is None
 
+    @patch('src.downloader.video_downloader.logger')
+    @patch('os.makedirs')
+    @patch('subprocess.Popen')
+    def test_download_failure_logs_stderr_tail(self, mock_run, mock_makedirs, mock_logger):
+        """测试最终失败时日志附带yt-dlp stderr的最后几行（未分类的错误原因仍可见）。"""
+        def fake_popen(cmd, stderr=None, **kwargs):
+            stderr.write("".join(f"[debug] line {i}\n" for i in range(30)))
+            stderr.write("ERROR: [youtube] video1: Requested format is not available\n")
+            return Mock(returncode=1)
+
+        mock_run.side_effect = fake_popen
+        config = {"download_format": "best[format]", "max_retries": 1, "proxy": "test_proxy"}
+        assert download_video("video1", "Test Channel", "20250101", "Test Title", config) is None
+
+        message = mock_logger.error.call_args[0][0]
+        assert "Requested format is not available" in message
+        assert "[debug] line 29" in message
+        assert "[debug] line 10\n" not in message
+
+    @patch('src.downloader.video_downloader.transfer_file', side_effect=lambda src, dst, config: dst)
     @patch('os.makedirs')
     @patch('os.path.exists')
-    @patch('subprocess.run')
-    def test_download_with_retry_success(self, mock_run, mock_exists, mock_makedirs):
+    @patch('subprocess.Popen')
+    def test_download_with_retry_success(self, mock_run, mock_exists, mock_makedirs, mock_transfer):
         """测试失败后重试成功。"""
         mock_run.side_effect = [
             Mock(returncode=1),  # 第一次失败
@@ -71,49 +99,151 @@ class TestVideoDownloader:
         ]
         mock_exists.return_value = True
 
-        config = {"download_format": "best[format]", "max_retries": 2, "proxy": "test_proxy"}
-        file_path = download_video("video1", "Test Channel", "20250101", "Test Title", config)
+        config = {"download_format": "best[format]", "max_retries": 2, "proxy": "test_proxy", "download_dir": "downloads"}
+        with patch('time.sleep'):
+            file_path = download_video("video1", "Test Channel", "20250101", "Test Title", config)
         
-        assert file_path == "downloads/Test_Channel_20250101_Test_Title.mp4"
+        assert file_path == os.path.join("downloads", "Test_Channel_20250101_Test_Title.mp4")
         assert mock_run.call_count == 2
 
+    @patch('src.downloader.video_downloader.transfer_file', side_effect=lambda src, dst, config: dst)
     @patch('os.makedirs')
     @patch('os.path.exists')
-    @patch('subprocess.run')
-    def test_title_and_channel_cleanup(self, mock_run, mock_exists, mock_makedirs):
+    @patch('subprocess.Popen')
+    def test_title_and_channel_cleanup(self, mock_run, mock_exists, mock_makedirs, mock_transfer):
         """测试标题和频道名清理（替换无效字符）。"""
         mock_run.return_value = Mock(returncode=0)
         mock_exists.return_value = True
 
-        config = {"download_format": "best[format]", "max_retries": 1, "proxy": "test_proxy"}
+        config = {"download_format": "best[format]", "max_retries": 1, "proxy": "test_proxy", "download_dir": "downloads"}
         file_path = download_video("video1", "Channel: Name*", "20250101", "Title? <With> |Chars\"", config)
     
-        assert file_path == "downloads/Channel___Name__20250101_Title____With___Chars_.mp4"
+        assert file_path == os.path.join("downloads", "Channel__Name__20250101_Title___With___Chars_.mp4")
 
+    @patch('src.downloader.video_downloader.transfer_file', side_effect=lambda src, dst, config: dst)
     @patch('os.makedirs')
     @patch('os.path.exists')
-    @patch('subprocess.run')
-    def test_downloads_dir_created_if_not_exists(self, mock_run, mock_exists, mock_makedirs):
-        """测试downloads目录不存在时创建。"""
+    @patch('subprocess.Popen')
+    def test_downloads_dir_created_if_not_exists(self, mock_run, mock_exists, mock_makedirs, mock_transfer):
+        """测试下载前创建该视频的暂存子目录。"""
         mock_run.return_value = Mock(returncode=0)
-        mock_exists.side_effect = [False, True]  # 第一次不存在，创建后存在
+        mock_exists.return_value = True
 
-        config = {"download_format": "best[format]", "max_retries": 1, "proxy": "test_proxy"}
+        config = {"download_format": "best[format]", "max_retries": 1, "proxy": "test_proxy", "download_dir": "downloads"}
         download_video("video1", "Test Channel", "20250101", "Test Title", config)
         
-        mock_makedirs.assert_called_once_with("downloads")
+        mock_makedirs.assert_called_once_with(os.path.join("staging", "video1"), exist_ok=True)
 
+    @patch('src.downloader.video_downloader.transfer_file', side_effect=lambda src, dst, config: dst)
     @patch('os.makedirs')
     @patch('os.path.exists')
-    @patch('subprocess.run')
-    def test_proxy_from_config(self, mock_run, mock_exists, mock_makedirs):
+    @patch('subprocess.Popen')
+    def test_proxy_from_config(self, mock_run, mock_exists, mock_makedirs, mock_transfer):
         """测试代理从配置使用。"""
         mock_run.return_value = Mock(returncode=0)
         mock_exists.return_value = True
 
-        config = {"download_format": "best[format]", "max_retries": 1, "proxy": "custom://proxy:8080"}
+        config = {"download_format": "best[format]", "max_retries": 1, "proxy": "custom://proxy:8080", "download_dir": "downloads"}
         download_video("video1", "Test Channel", "20250101", "Test Title", config)
         
         args = mock_run.call_args[0][0]
         assert args[1] == "--proxy"
-        assert args[2] == "custom://proxy:8080"
\ No newline at end of file
+        assert args[2] == "custom://proxy:8080"
+
+    @patch('src.downloader.video_downloader.transfer_video')
+    @patch('os.makedirs')
+    @patch('subprocess.Popen')
+    def test_load_info_json_first_then_url(self, mock_run, mock_makedirs, mock_transfer, tmp_path):
+        """测试首次尝试使用扫描阶段的info JSON，重试回退到视频URL。"""
+        info_json = tmp_path / "video1.info.json"
+        info_json.write_text("{}", encoding="utf-8")
+        mock_run.side_effect = [Mock(returncode=1), Mock(returncode=0)]
+
+        config = {"download_format": "best", "max_retries": 2, "proxy": "test_proxy", "download_dir": str(tmp_path)}
+        with patch('time.sleep'), patch('os.path.exists', return_value=True):
+            download_video("video1", "Test Channel", "20250101", "Test Title", config, info_json=str(info_json))
+
+        first_args = mock_run.call_args_list[0][0][0]
+        assert first_args[-2:] == ["--load-info-json", str(info_json)]
+        assert "https://www.youtube.com/watch?v=video1" not in first_args
+        retry_args = mock_run.call_args_list[1][0][0]
+        assert retry_args[-1] == "https://www.youtube.com/watch?v=video1"
+
+    def test_batch_download_single_invocation(self, tmp_path, monkeypatch):
+        """测试批量下载只调用一次yt-dlp，未产出文件的视频逐个回退重试。"""
+        monkeypatch.chdir(tmp_path)
+        videos = [
+            {"video_id": "video1", "title": "A", "upload_date": "20250101", "channel_name": "C"},
+            {"video_id": "video2", "title": "B", "upload_date": "20250102", "channel_name": "C"},
+        ]
+
+        def fake_popen(cmd, **kwargs):
+            # 批量调用只产出video1
+            (tmp_path / "staging" / "video1" / "video1.mp4").write_bytes(b"data")
+            return Mock(returncode=1)
+
+        config = {"download_format": "best", "max_retries": 1, "proxy": "test_proxy", "download_dir": str(tmp_path / "out")}
+        with patch('subprocess.Popen', side_effect=fake_popen) as mock_run, \
+                patch('src.downloader.video_downloader.download_video', return_value=None) as mock_single:
+            results = download_videos(videos, config)
+
+        mock_run.assert_called_once()
+        args = mock_run.call_args[0][0]
+        assert args[-2:] == ["https://www.youtube.com/watch?v=video1", "https://www.youtube.com/watch?v=video2"]
+        assert results["video1"] == os.path.join(str(tmp_path / "out"), "C_20250101_A.mp4")
+        assert os.path.exists(results["video1"])
+        assert results["video2"] is None
+        assert mock_single.call_args[0][0] == "video2"
+        assert not (tmp_path / "staging" / "video1").exists()
+
+    def test_retry_resumes_in_staging_dir(self, tmp_path, monkeypatch):
+        """测试下载写入按video_id命名的暂存子目录，失败后保留已下载部分供续传。"""
+        monkeypatch.chdir(tmp_path)
+
+        def fake_popen(cmd, **kwargs):
+            (tmp_path / "staging" / "video1" / "video1.mp4.part").write_bytes(b"partial")
+            return Mock(returncode=1)
+
+        config = {"download_format": "best", "max_retries": 2, "proxy": "test_proxy", "download_dir": str(tmp_path / "out")}
+        with patch('subprocess.Popen', side_effect=fake_popen) as mock_popen, patch('time.sleep'):
+            assert download_video("video1", "C", "20250101", "A", config) is None
+
+        args = mock_popen.call_args[0][0]
+        assert "--continue" in args
+        assert args[args.index("-o") + 1] == os.path.join("staging", "video1", "video1.%(ext)s")
+        assert (tmp_path / "staging" / "video1" / "video1.mp4.part").exists()
+
+
+class TestStaging:
+    def test_recover_finished_and_keep_partial(self, tmp_path, monkeypatch):
+        """测试启动时移走已完成的暂存文件并返回视频信息，未完成的下载保留。"""
+        monkeypatch.chdir(tmp_path)
+        done = {"video_id": "done1", "channel_name": "C", "upload_date": "20250101", "title": "A"}
+        partial = {"video_id": "part1", "channel_name": "C", "upload_date": "20250102", "title": "B"}
+        stage_video(done, "UCx", False)
+        stage_video(partial, "UCx", False)
+        (tmp_path / "staging" / "done1" / "done1.mp4").write_bytes(b"data")
+        (tmp_path / "staging" / "part1" / "part1.mp4.part").write_bytes(b"data")
+
+        recovered = recover_staging({"download_dir": str(tmp_path / "out")})
+
+        assert [(meta["video_id"], meta["channel_id"], meta["is_first"]) for meta in recovered] == [("done1", "UCx", False)]
+        assert recovered[0]["file_path"] == os.path.join(str(tmp_path / "out"), "C_20250101_A.mp4")
+        assert os.path.exists(recovered[0]["file_path"])
+        assert not (tmp_path / "staging" / "done1").exists()
+        assert (tmp_path / "staging" / "part1" / "part1.mp4.part").exists()
+
+    def test_gc_removes_only_stale_partials(self, tmp_path, monkeypatch):
+        """测试只删除超过保留时长未更新的暂存子目录。"""
+        monkeypatch.chdir(tmp_path)
+        for video_id, age in (("old", 4 * 86400), ("new", 60)):
+            part = tmp_path / "staging" / video_id / f"{video_id}.mp4.part"
+            part.parent.mkdir(parents=True)
+            part.write_bytes(b"data")
+            mtime = time.time() - age
+            os.utime(part, (mtime, mtime))
+            os.utime(part.parent, (mtime, mtime))
+
+        assert gc_staging(72 * 3600) == 1
+        assert not (tmp_path / "staging" / "old").exists()
+        assert (tmp_path / "staging" / "new").exists()
@@ -0,0 +1,54 @@
+from unittest.mock import patch
+
+from src.core.history_manager import HistoryStore
+from src.core.video_index import DownloadedIndex
+
+
+class TestDownloadedIndex:
+    def test_added_ids_are_members(self):
+        """测试已加入的ID一定命中（无漏判）。"""
+        index = DownloadedIndex(1000)
+        ids = [f"id{i:09d}" for i in range(1000)]
+        for video_id in ids:
+            index.add(video_id)
+        assert all(video_id in index for video_id in ids)
+        assert len(index) == 1000
+
+    def test_false_positive_rate_bounded(self):
+        """测试误判率接近设定值。"""
+        index = DownloadedIndex(10000, error_rate=0.01)
+        for i in range(10000):
+            index.add(f"known{i}")
+        false_positives = sum(1 for i in range(10000) if f"unknown{i}" in index)
+        assert false_positives < 300
+
+    def test_memory_sized_for_capacity(self):
+        """测试内存占用按容量和误判率计算。"""
+        index = DownloadedIndex(1_000_000, error_rate=0.001)
+        assert 1_700_000 < index.memory_bytes < 1_900_000
+
+
+class TestStoreWithIndex:
+    def test_filter_skips_sqlite_for_index_misses(self, temp_db_path):
+        """测试索引未命中的ID不查询SQLite，命中的回查确认。"""
+        store = HistoryStore(temp_db_path)
+        store.init_schema()
+        store.mark_downloaded("video1", "channel")
+        store.load_index()
+        assert len(store.index) == 1
+
+        with patch.object(store, "connection", side_effect=AssertionError("不应查询SQLite")):
+            assert store.filter_new_video_ids(["video2", "video3"]) == ["video2", "video3"]
+        assert store.filter_new_video_ids(["video1", "video2"]) == ["video2"]
+        assert not store.is_downloaded("video2")
+        store.close()
+
+    def test_mark_downloaded_updates_index(self, temp_db_path):
+        """测试mark_downloaded增量更新索引。"""
+        store = HistoryStore(temp_db_path)
+        store.init_schema()
+        store.load_index()
+        store.mark_downloaded("video1", "channel")
+        assert "video1" in store.index
+        assert store.filter_new_video_ids(["video1"]) == []
+        store.close()